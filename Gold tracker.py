@@ -1,17 +1,26 @@
 
 # Standard library imports
+import argparse
 import os
-import time
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
 
 # Third-party imports
-import requests
 import dotenv
 import yaml
-import pandas as pd
 
 # Local imports
+# pandas, the history store and asyncio are imported by the functions that need them, so a --quick check only loads
+# what it uses. See `python benchmarks.py startup`.
 import marketstack
-from mac_notifications import client
+import metalpriceapi
+from alerts import DEFAULT_COOLDOWN, AlertEngine, check_levels, describe, legacy_rules
+from http_client import Transport, get_default_transport, set_default_transport
+from metrics import Metrics, get_default_metrics, set_default_metrics
+from notify import Dispatcher, build_sinks, get_default_dispatcher, set_default_dispatcher
+from quota import RequestBudget, get_default_budget, set_default_budget
+from response_cache import ResponseCache, set_default_cache
+from valuation import FX_SERIES, FX_SYMBOL, INR_SUFFIX, inr_series, update_inr_series
 
 
 # =========================
@@ -22,8 +31,27 @@ def load_config():
     with open("config.yaml", "r") as file:
         return yaml.safe_load(file)
 
-def setup_environment():
+def setup_environment(config):
     dotenv.load_dotenv()
+    set_default_metrics(Metrics(profile_stages=config.get('profile_stages') or (), profile_dir=config.get('profile_dir', 'profiles')))
+    set_default_dispatcher(Dispatcher(
+        build_sinks(config.get('notify_sinks'), config.get('notify_webhook_url')),
+        coalesce_seconds=config.get('notify_coalesce_seconds', 1.0),
+        repeat_interval=config.get('notify_repeat_interval', 300),
+    ))
+    set_default_transport(Transport(
+        connect_timeout=config.get('http_connect_timeout', 3.05),
+        read_timeout=config.get('http_read_timeout', 15.0),
+        max_retries=config.get('http_max_retries', 3),
+    ))
+    if config.get('response_cache_path'):
+        set_default_cache(ResponseCache(config['response_cache_path'], max_bytes=config.get('response_cache_max_mb', 100) * 1024 * 1024))
+    if config.get('marketstack_base_url'):
+        marketstack.set_base_url(config['marketstack_base_url'])
+    if config.get('metalpriceapi_base_url'):
+        metalpriceapi.set_base_url(config['metalpriceapi_base_url'])
+    if config.get('quota_path'):
+        set_default_budget(RequestBudget(config['quota_path'], limits=config.get('quota')))
     api_key = os.getenv("METAL_PRICE_API")
     marketstack.set_api_key(os.getenv("MARKETSTACK_API"))
     return api_key
@@ -32,103 +60,438 @@ def setup_environment():
 # Utility Functions
 # =========================
 
-def get_etf_price(etf_symbol):
+DEFAULT_INSTRUMENTS = [
+    {'symbol': 'SIVR', 'series': 'Silver prices', 'kind': 'etf'},
+    {'symbol': 'GLDM', 'series': 'Gold prices', 'kind': 'etf'},
+    {'symbol': 'USDINR', 'series': 'USD to INR', 'kind': 'fx'},
+]
+# Column holding the price of each kind of instrument in the history store
+PRICE_COLUMNS = {'etf': 'close', 'fx': 'rate'}
+
+def update_etf_prices(store, instruments):
+    # One batched delta request for every tracked ETF
+    etf_series = {instrument['series']: instrument['symbol'] for instrument in instruments if instrument['kind'] == 'etf'}
+    if not etf_series:
+        return
     try:
-        etf_data = marketstack.EndOfDay(etf_symbol).get_data_df()
-        etf_data.sort_values(by='date', ascending=False, inplace=True)
-        
-        if not etf_data.empty:
-            return etf_data, etf_data['close'].values[0]
-        else:
-            print(f"No data found for ETF: {etf_symbol}")
-            return None
+        store.update_eod(etf_series)
     except Exception as e:
-        print(f"Exception while fetching ETF data for {etf_symbol}: {e}")
-        return None
+        print(f"Exception while fetching ETF data for {', '.join(etf_series.values())}: {e}")
+
+def update_rates(store, instruments, api_key):
+    # One metalpriceapi request for every tracked FX pair and spot metal
+    series = {instrument['symbol']: instrument['series'] for instrument in instruments if instrument['kind'] == 'fx'}
+    if not series:
+        return
+    rates = get_rates(list(series), api_key)
+    if rates:
+        metalpriceapi.record_rates(store, rates, series)
+    missing = [symbol for symbol in series if not rates or symbol not in rates]
+    if missing:
+        print(f"Failed to retrieve rates for {', '.join(missing)}.")
+
+def seed_inr_rates(store, instruments, api_key, checkpoint_path=None):
+    # INR values need a USD/INR rate on or before each ETF bar, but the rates the tracker records start at its first
+    # run. The rates before that are backfilled from metalpriceapi, once: the chunks fetched are checkpointed, and a
+    # chunk that fails is retried with a growing backoff rather than on every poll.
+    import backfill
+
+    firsts = [store.first_date(instrument['series'], instrument['symbol']) for instrument in instruments if instrument['kind'] == 'etf']
+    firsts = [first for first in firsts if first is not None]
+    first_rate = store.first_date(FX_SERIES, FX_SYMBOL)
+    if not api_key or not firsts or (first_rate is not None and first_rate <= min(firsts)):
+        return
+    rows = backfill.backfill(store, [(FX_SERIES, FX_SYMBOL)], min(firsts), first_rate, fetch=backfill.rate_fetcher(api_key), chunk_days=backfill.RATE_CHUNK_DAYS, checkpoint_path=checkpoint_path or backfill.DEFAULT_CHECKPOINT, retry_backoff=backfill.RETRY_BACKOFF)
+    if rows:
+        print(f"Loaded {rows} USD/INR rate(s) since {min(firsts):%Y-%m-%d} to value the ETF history in INR.")
+
+def update_inr_values(store, instruments):
+    # Converts the ETF bars that have no INR value yet at the USD/INR rate of their date
+    for instrument in instruments:
+        if instrument['kind'] != 'etf':
+            continue
+        try:
+            update_inr_series(store, instrument['series'], instrument['symbol'])
+        except Exception as e:
+            print(f"Exception while valuing {instrument['symbol']} in INR: {e}")
+
+def load_price_history(store, instruments, inr=False):
+    # Wide frame of prices: one row per date, one column per symbol (plus <SYMBOL>_INR for ETFs when inr is set)
+    import pandas as pd
+
+    columns = []
+    for instrument in instruments:
+        sources = [(instrument['series'], PRICE_COLUMNS[instrument['kind']], instrument['symbol'])]
+        if inr and instrument['kind'] == 'etf':
+            sources.append((inr_series(instrument['series']), 'close_inr', instrument['symbol'] + INR_SUFFIX))
+        for series, price_column, name in sources:
+            df = store.query(series, symbols=[instrument['symbol']], columns=[price_column])
+            if not df.empty and price_column in df:
+                columns.append(df.set_index('date')[price_column].rename(name))
+    if not columns:
+        return pd.DataFrame()
+    return pd.concat(columns, axis=1, sort=True)
 
-def check_etf_price(etf_symbol, threshold, alert_enabled):
-    df, price = get_etf_price(etf_symbol)
-    if price is not None:
-        print(f"{etf_symbol} current price: ₹{price:.2f}")
-        if alert_enabled and price >= threshold:
-            send_mac_notification(f"🚨 {etf_symbol} Alert", f"{etf_symbol} has reached ₹{price:.2f} 🚨")
+CURRENCY_SIGNS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥'}
+
+def print_price(instrument, price, inr_price=None):
+    # marketstack quotes the ETFs in USD; the INR value is shown when it is known
+    symbol = instrument['symbol']
+    if price is None:
+        print(f"Failed to retrieve price for {symbol}")
+    elif instrument['kind'] == 'fx':
+        base, quote = symbol[:3], symbol[3:]
+        print(f"1 {base} = {CURRENCY_SIGNS[quote]}{price:,.2f}" if quote in CURRENCY_SIGNS else f"1 {base} = {price:,.4f} {quote}")
+    elif inr_price is not None:
+        print(f"{symbol} current price: ${price:.2f} (₹{inr_price:,.2f})")
     else:
-        print(f"Failed to retrieve price for {etf_symbol}")
+        print(f"{symbol} current price: ${price:.2f}")
+
+def print_latest_prices(history, instruments):
+    def last(column):
+        prices = history[column].dropna() if column in history else None
+        return None if prices is None or prices.empty else prices.iloc[-1]
+
+    for instrument in instruments:
+        print_price(instrument, last(instrument['symbol']), last(instrument['symbol'] + INR_SUFFIX))
+
+def get_served_prices(address, symbols):
+    # Latest prices from a running quote server (--serve), which shares one upstream request between all its clients
+    # Stale quotes (served when the server's own upstream request failed) are left out, so they are asked from the APIs
+    from quote_server import QuoteClient
 
-    return df
+    try:
+        return QuoteClient(address).prices(symbols)
+    except Exception as e:
+        print(f"Quote server at {address} unavailable, asking the APIs directly: {e}")
+        return {}
 
-def get_usd_to_inr(api_key):
-    url = f"https://api.metalpriceapi.com/v1/convert?api_key={api_key}&from=USD&to=INR&amount=1"
+def get_latest_prices(instruments, api_key, quote_server=None):
+    # Latest price of every instrument as plain floats: from the quote server when one is given, otherwise (and for
+    # anything it could not answer) one request for all ETFs and one for all FX pairs and metals
+    prices = get_served_prices(quote_server, [instrument['symbol'] for instrument in instruments]) if quote_server else {}
+    etfs = [instrument['symbol'] for instrument in instruments if instrument['kind'] == 'etf']
+    missing = [symbol for symbol in etfs if symbol not in prices]
+    if missing:
+        try:
+            for row in marketstack.EndOfDay(','.join(missing)).latest().get_data(paginate=False):
+                prices[row['symbol']] = row['close']
+        except Exception as e:
+            print(f"Exception while fetching ETF data for {', '.join(missing)}: {e}")
+    missing = [instrument['symbol'] for instrument in instruments if instrument['kind'] == 'fx' and instrument['symbol'] not in prices]
+    if missing:
+        rates = get_rates(missing, api_key)
+        if rates:
+            prices.update(rates.prices())
+    if "USDINR" in prices:
+        for symbol in etfs:
+            if symbol in prices:
+                prices[symbol + INR_SUFFIX] = prices[symbol] * prices["USDINR"]
+    return prices
+
+def get_rates(symbols, api_key):
+    # Every FX pair and spot metal in symbols (USDINR, XAUUSD, ...) from one metalpriceapi request
     try:
-        response = requests.get(url)
-        data = response.json()
-        if response.status_code == 200 and "result" in data:
-            return data["result"]
-        else:
-            print(f"API error: {data}")
-            return None
+        return metalpriceapi.latest_rates(symbols, api_key)
     except Exception as e:
         print(f"Exception during API request: {e}")
         return None
 
-def send_mac_notification(title, message):
-    client.create_notification(
-        title=title,
-        subtitle=message
-    )
+def notify_alert(alert, label="Alert"):
+    # Queued for the notification thread, so a slow backend never holds up polling
+    alert = {name: value.item() if hasattr(value, 'item') else value for name, value in dict(alert).items()}
+    get_default_dispatcher().notify(f"{label} {alert['id']}", f"🚨 {alert['symbol']} {label}", f"{describe(alert)} 🚨", alert)
+
+# =========================
+# Checks
+# =========================
+
+def get_instruments(config):
+    return config.get('instruments') or DEFAULT_INSTRUMENTS
+
+def get_rules(config):
+    return config.get('rules') or legacy_rules(config)
+
+def get_alert_engine(config):
+    return AlertEngine(get_rules(config), state_path=config.get('alert_state_path', 'alert_state.json'), default_cooldown=config.get('alert_cooldown', DEFAULT_COOLDOWN))
+
+def check_instruments(store, engine, instruments, api_key, inr=False, checkpoint_path=None):
+    if any(instrument['kind'] == 'etf' for instrument in instruments):
+        update_etf_prices(store, instruments)
+    if any(instrument['kind'] == 'fx' for instrument in instruments):
+        update_rates(store, instruments, api_key)
+    if inr:
+        seed_inr_rates(store, instruments, api_key, checkpoint_path)
+        update_inr_values(store, instruments)
+
+    # Every rule for these instruments is evaluated in one pass over the stored history
+    history = load_price_history(store, instruments, inr)
+    print_latest_prices(history, instruments)
+    symbols = [instrument['symbol'] for instrument in instruments]
+    if inr:
+        symbols += [instrument['symbol'] + INR_SUFFIX for instrument in instruments if instrument['kind'] == 'etf']
+    fired = engine.evaluate(history, symbols=symbols)
+    for _, alert in fired.iterrows():
+        notify_alert(alert)
+
+def get_intraday_stream(config):
+    from streaming import IntradayStream
+
+    symbols = [instrument['symbol'] for instrument in get_instruments(config) if instrument['kind'] == 'etf']
+    return IntradayStream(symbols, interval=config.get('intraday_interval', '1min'), capacity=config.get('intraday_window', 390), ma_windows=config.get('intraday_moving_averages', [20, 50]))
+
+def print_intraday_stats(stats):
+    averages = '  '.join(f"MA{name[3:]} {value:.2f}" for name, value in stats.items() if name.startswith('ma_'))
+    print(f"{stats['symbol']} intraday: {stats['price']:.2f}  VWAP {stats['vwap']:.2f}  {averages}  range {stats['low']:.2f}-{stats['high']:.2f}  volatility {stats['volatility'] * 100:.3f}%/bar")
+
+def check_intraday(stream, engine):
+    # One request for the latest bar of every ETF; the rolling statistics are updated bar by bar
+    updated = stream.poll()
+    for symbol in updated:
+        print_intraday_stats(stream.streams[symbol].stats())
+    if engine is None or not updated:
+        return
+    # Intraday rules count their windows in intraday bars, over the buffered bars only
+    fired = engine.evaluate(stream.frame(), symbols=updated)
+    for _, alert in fired.iterrows():
+        notify_alert(alert, "Intraday Alert")
+
+def quick_check(config, api_key):
+    # Latest prices against the above/below rules only, without pandas or the history store. Nothing is recorded, and
+    # window rules are left to the next full run.
+    instruments = get_instruments(config)
+    prices = get_latest_prices(instruments, api_key, config.get('quote_server_address') if config.get('use_quote_server') else None)
+    for instrument in instruments:
+        print_price(instrument, prices.get(instrument['symbol']), prices.get(instrument['symbol'] + INR_SUFFIX))
+    fired = check_levels(get_rules(config), prices, state_path=config.get('alert_state_path', 'alert_state.json'), default_cooldown=config.get('alert_cooldown', DEFAULT_COOLDOWN))
+    for alert in fired:
+        notify_alert(alert)
+
+def write_metrics(config):
+    if config.get('metrics_path'):
+        get_default_metrics().write(config['metrics_path'])
+
+# =========================
+# Daemon Mode
+# =========================
+
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+
+def is_market_open(now=None):
+    now = (now or datetime.now(MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+async def poll(name, interval, check, stop, active=None):
+    # Blocking fetches run in worker threads, so instruments polled at the same tick are fetched concurrently.
+    # interval can be a callable, so the delay can follow the remaining request budget.
+    import asyncio
+
+    while not stop.is_set():
+        if active is None or active():
+            try:
+                await asyncio.to_thread(check)
+            except Exception as e:
+                print(f"Exception while polling {name}: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval() if callable(interval) else interval)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_daemon(config, api_key, store):
+    import asyncio
+    import signal
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    intervals = {'etf': config.get('ETF_poll_interval', 300), 'fx': config.get('USD_to_INR_poll_interval', 60)}
+    market_hours_only = config.get('ETF_market_hours_only', True)
+    engine = get_alert_engine(config)
+    budget = get_default_budget()
+
+    # Instruments sharing a kind and interval are polled together, so ETFs still go out as one batched request
+    groups = {}
+    for instrument in get_instruments(config):
+        interval = instrument.get('poll_interval', intervals[instrument['kind']])
+        groups.setdefault((instrument['kind'], interval), []).append(instrument)
+
+    # Every poll spends about one request of its API's budget. Polls sharing a key pace themselves as a whole: each
+    # one waits as if it made the requests of all of them, so together they stay within what the budget allows.
+    consumers = {'marketstack': sum(kind == 'etf' for kind, _ in groups) + bool(config.get('intraday')), 'metalpriceapi': sum(kind == 'fx' for kind, _ in groups)}
+
+    tasks = []
+    for (kind, interval), instruments in groups.items():
+        active = is_market_open if kind == 'etf' and market_hours_only else None
+        name = ', '.join(instrument['symbol'] for instrument in instruments)
+        if budget is not None:
+            # Never poll faster than what is left of the month's budget allows
+            api, key = ('marketstack', marketstack.marketstack_api_key) if kind == 'etf' else ('metalpriceapi', api_key)
+            interval = lambda interval=interval, api=api, key=key: max(interval, budget.suggested_interval(api, key, consumers[api]))
+        tasks.append(poll(name, interval, lambda instruments=instruments: check_instruments(store, engine, instruments, api_key, config.get('inr_valuation', False), config.get('backfill_checkpoint_path')), stop, active))
+
+    if config.get('intraday'):
+        stream = get_intraday_stream(config)
+        rules = config.get('intraday_rules')
+        intraday_engine = AlertEngine(rules, state_path=config.get('intraday_alert_state_path', 'intraday_alert_state.json'), default_cooldown=config.get('alert_cooldown', DEFAULT_COOLDOWN)) if rules else None
+        interval = config.get('intraday_poll_interval', 60)
+        if budget is not None:
+            interval = lambda interval=interval: max(interval, budget.suggested_interval('marketstack', marketstack.marketstack_api_key, consumers['marketstack']))
+        try:
+            await asyncio.to_thread(stream.warm_up)
+        except Exception as e:
+            print(f"Exception while loading recent intraday bars: {e}")
+        active = is_market_open if market_hours_only else None
+        tasks.append(poll("intraday " + ', '.join(stream.symbols), interval, lambda: check_intraday(stream, intraday_engine), stop, active))
+
+    if config.get('metrics_path'):
+        tasks.append(poll("metrics", config.get('metrics_interval', 15), lambda: write_metrics(config), stop))
+
+    # The intraday and metrics tasks are not instruments
+    print(f"Tracker daemon started with {sum(map(len, groups.values()))} instrument(s) in {len(groups)} poll group(s). Press Ctrl+C to stop.")
+    await asyncio.gather(*tasks)
+    get_default_dispatcher().close()
+    write_metrics(config)
+    get_default_transport().close()
+    print("Tracker daemon stopped.")
+
+def run_quote_server(config, api_key):
+    # Serves the latest quotes to every local consumer; quotes younger than quote_max_age are answered from memory
+    from quote_server import DEFAULT_ADDRESS, QuoteService, make_server
+
+    # Any currency pair or spot metal configured as an fx instrument is answered from one metalpriceapi request
+    fx_symbols = [instrument['symbol'] for instrument in get_instruments(config) if instrument['kind'] == 'fx']
+    service = QuoteService(fx_symbols, lambda symbols: metalpriceapi.latest_rates(symbols, api_key).prices(), max_age=config.get('quote_max_age', 60))
+    address = config.get('quote_server_address') or DEFAULT_ADDRESS
+    server = make_server(service, address)
+    print(f"Quote server listening on {address}. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        get_default_transport().close()
+        write_metrics(config)
+
+def run_backfill(config, store, symbols, api_key, since=None):
+    # Seeds the history of new instruments; the series of configured symbols is taken from the instruments list. FX pairs
+    # and spot metals come from metalpriceapi. With inr_valuation, the USD/INR rates of the same range are loaded along
+    # with the ETFs and their INR values derived.
+    import backfill
+
+    instruments = {instrument['symbol']: instrument for instrument in get_instruments(config)}
+    is_rate = lambda symbol: instruments.get(symbol, {}).get('kind') == 'fx'
+    etf_targets = [(instruments.get(symbol, {}).get('series', symbol), symbol) for symbol in symbols if not is_rate(symbol)]
+    rate_targets = [(instruments[symbol]['series'], symbol) for symbol in symbols if is_rate(symbol)]
+    inr = config.get('inr_valuation', False)
+    if inr and etf_targets and FX_SYMBOL not in symbols:
+        rate_targets.append((FX_SERIES, FX_SYMBOL))
+
+    start = since or backfill.years_ago(backfill.DEFAULT_YEARS).isoformat()
+    options = {'max_workers': config.get('backfill_workers', backfill.DEFAULT_WORKERS), 'checkpoint_path': config.get('backfill_checkpoint_path', backfill.DEFAULT_CHECKPOINT)}
+    rows = 0
+    if etf_targets:
+        rows += backfill.backfill(store, etf_targets, start, **options)
+    if rate_targets:
+        rows += backfill.backfill(store, rate_targets, start, fetch=backfill.rate_fetcher(api_key), chunk_days=backfill.RATE_CHUNK_DAYS, **options)
+    print(f"Backfilled {rows} rows for {', '.join(symbol for _, symbol in etf_targets + rate_targets)} since {start}.")
+    if inr:
+        update_inr_values(store, get_instruments(config))
+
+def print_report(report, hidden):
+    report = report.drop(columns=hidden)
+    for column in ('first_fire', 'last_fire'):
+        report[column] = report[column].dt.date
+    print(report.to_string(index=False))
+
+def run_backtest(config, store, sweep_symbols=None, thresholds=None):
+    # Replays the configured rules over the stored history; with sweep_symbols, tries a grid of thresholds for their
+    # above/below/pct_change rules instead
+    import pandas as pd
+
+    import backtest
+
+    inr = config.get('inr_valuation', False)
+    history = load_price_history(store, get_instruments(config), inr)
+    if history.empty:
+        print("No stored history to replay. Run the tracker (or --backfill) first.")
+        return
+    start, end = history.index.min(), history.index.max()
+    print(f"Replaying alert rules over {len(history)} bars from {start:%Y-%m-%d} to {end:%Y-%m-%d}.")
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_rows', None):
+        if not sweep_symbols:
+            report = backtest.replay(get_rules(config), history, config.get('alert_cooldown', DEFAULT_COOLDOWN))
+            print_report(report, ['id'])
+            return
+        for symbol in sweep_symbols:
+            rules = [rule for rule in get_rules(config) if rule['symbol'] == symbol and rule['type'] in backtest.SWEEP_RULE_TYPES]
+            # Without a configured rule, sweep "above" thresholds
+            for rule in rules or [{'symbol': symbol, 'type': 'above'}]:
+                report = backtest.sweep(history, rule, thresholds, config.get('alert_cooldown', DEFAULT_COOLDOWN))
+                print(f"\n{symbol} {rule['type']}" + (f" over {int(rule['window'])} bars" if rule['type'] == 'pct_change' else ""))
+                if report.empty:
+                    print(f"No stored {symbol} values to try thresholds against.")
+                else:
+                    print_report(report, ['symbol', 'type'])
 
 # =========================
 # Main Execution
 # =========================
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Track Gold and Silver ETFs and USD to INR.")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and poll every instrument on its own interval.")
+    parser.add_argument("--quick", action="store_true", help="Only check the latest prices against the above/below rules, without updating the history store. Starts up much faster, for frequent cron/launchd runs.")
+    parser.add_argument("--serve", action="store_true", help="Run the local quote server on quote_server_address, sharing one upstream request per quote between all local consumers.")
+    parser.add_argument("--backfill", nargs="+", metavar="SYMBOL", help="Load the daily history of these ETFs or FX pairs since --since in parallel chunks, then exit. Run it again to resume an interrupted backfill.")
+    parser.add_argument("--since", metavar="YYYY-MM-DD", help="First date loaded by --backfill (default: 10 years ago).")
+    parser.add_argument("--backtest", action="store_true", help="Replay the alert rules over the stored history and report how often each would have fired, then exit.")
+    parser.add_argument("--sweep", nargs="+", metavar="SYMBOL", help="Like --backtest, but replay the above/below/pct_change rules of these symbols for a grid of thresholds.")
+    parser.add_argument("--thresholds", nargs="+", type=float, metavar="VALUE", help="Thresholds tried by --sweep (default: 20 spread over the values seen).")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     config = load_config()
-    api_key = setup_environment()
-
-    # Load configuration values
-    SIVR_THRESHOLD = config['SIVR_threshold']
-    GLDM_THRESHOLD = config['GLDM_threshold']
-    USD_TO_INR_THRESHOLD = config['USD_to_INR_threshold']
-    USD_TO_INR_ALERT = config['USD_to_INR_alert']
-    SIVR_ALERT = config['SIVR_alert']
-    GLDM_ALERT = config['GLDM_alert']
-
-    # Load data from parquet files if available
-    if os.path.exists("Gold prices.parquet"):   
-        gold_df = pd.read_parquet("Gold prices.parquet")
-    elif os.path.exists("Silver prices.parquet"): 
-        silver_df = pd.read_parquet("Silver prices.parquet")
-    elif os.path.exists("USD to INR.parquet"):
-        usd_inr_df = pd.read_parquet("USD to INR.parquet")
-        print("Data loaded from parquet files.")
-    else:
-        gold_df = pd.DataFrame()
-        silver_df = pd.DataFrame()
-        usd_inr_df = pd.DataFrame() 
-
-    # Check Silver ETF price
-    if SIVR_ALERT:
-        df = check_etf_price('SIVR', SIVR_THRESHOLD, SIVR_ALERT)
-
-    # Check Gold ETF price
-    if GLDM_ALERT:
-        df = check_etf_price('GLDM', GLDM_THRESHOLD, GLDM_ALERT)
-
-    # Check USD to INR conversion rate
-    if USD_TO_INR_ALERT:
-        rate = get_usd_to_inr(api_key)
-        if rate:
-            print(f"1 USD = ₹{rate:.2f}")
-            if rate >= USD_TO_INR_THRESHOLD:
-                send_mac_notification("💰 USD to INR Alert", f"1 USD = ₹{rate:.2f} 🚨")
-        else:
-            print("Failed to retrieve conversion rate.")
-
-    # Save data to parquet files
-    gold_df.to_parquet("Gold prices.parquet")
-    silver_df.to_parquet("Silver prices.parquet")
-    usd_inr_df.to_parquet("USD to INR.parquet")
+    api_key = setup_environment(config)
+
+    if args.serve:
+        run_quote_server(config, api_key)
+        return
+
+    if args.quick:
+        quick_check(config, api_key)
+        get_default_dispatcher().close()
+        write_metrics(config)
+        return
+
+    # Price history is kept in an append-only store, so each run only fetches and writes new rows
+    from history import HistoryStore
+    store = HistoryStore(config.get('history_dir', 'history'))
+
+    if args.backfill:
+        run_backfill(config, store, args.backfill, api_key, args.since)
+        write_metrics(config)
+        return
+
+    if args.backtest or args.sweep:
+        run_backtest(config, store, args.sweep, args.thresholds)
+        return
+
+    if args.daemon:
+        import asyncio
+        asyncio.run(run_daemon(config, api_key, store))
+        return
+
+    # ETF prices come from a single batched request, then every alert rule is checked in one pass
+    check_instruments(store, get_alert_engine(config), get_instruments(config), api_key, config.get('inr_valuation', False), config.get('backfill_checkpoint_path'))
+    get_default_dispatcher().close()
+    write_metrics(config)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,263 @@
+'''
+Config driven alert rules, evaluated for every instrument in one vectorised pass.
+
+Each rule in config.yaml names a symbol and a type:
+
+    above / below             latest price compared with threshold
+    pct_change                % change over the last `window` bars; fires at or beyond threshold (negative = drop)
+    ma_cross_above / _below   latest price crossing the `window` bar moving average
+
+All rules are turned into one signed "margin" array (>= 0 means the condition holds). A rule fires when it becomes active,
+then stays active until the margin falls below -hysteresis, and it never fires twice within `cooldown` seconds. An
+ma_cross rule does not fire on its first evaluation, since there is no earlier side to have crossed from. The active flag
+and last fire time of every rule are kept in a small JSON state file between runs.
+
+check_levels() applies the same logic to above/below rules in plain Python, for quick checks of a few live prices that
+should not pay for importing NumPy and pandas.
+'''
+
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from metrics import get_default_metrics
+
+# numpy and pandas are imported where they are used, so the plain Python check_levels() path starts up fast
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+RULE_TYPES = ['above', 'below', 'pct_change', 'ma_cross_above', 'ma_cross_below']
+LEVEL_RULE_TYPES = ['above', 'below']
+WINDOW_RULE_TYPES = ['pct_change', 'ma_cross_above', 'ma_cross_below']
+DEFAULT_COOLDOWN = 3600
+# Legacy config keys: symbol -> (threshold key, alert key)
+LEGACY_KEYS = {
+    'SIVR': ('SIVR_threshold', 'SIVR_alert'),
+    'GLDM': ('GLDM_threshold', 'GLDM_alert'),
+    'USDINR': ('USD_to_INR_threshold', 'USD_to_INR_alert'),
+}
+
+
+def legacy_rules(config: dict) -> List[dict]:
+    # Translates the old SIVR_*/GLDM_*/USD_to_INR_* keys into "above" rules
+    rules = []
+    for symbol, (threshold_key, alert_key) in LEGACY_KEYS.items():
+        if config.get(alert_key) and threshold_key in config:
+            rules.append({'symbol': symbol, 'type': 'above', 'threshold': config[threshold_key]})
+    return rules
+
+
+def rule_id(rule: dict) -> str:
+    if rule.get('id') is not None:
+        return rule['id']
+    if rule['type'].startswith('ma_cross'):
+        return f"{rule['symbol']} {rule['type']} {int(rule['window'])}"
+    return f"{rule['symbol']} {rule['type']} {float(rule.get('threshold') or 0.0):g}"
+
+
+def load_state(path: Optional[str]) -> Dict[str, dict]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_state(path: Optional[str], state: Dict[str, dict]):
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def rules_frame(rules: List[dict], default_cooldown: float = DEFAULT_COOLDOWN) -> 'pd.DataFrame':
+    import numpy as np
+    import pandas as pd
+
+    frame = pd.DataFrame(rules, columns=['id', 'symbol', 'type', 'threshold', 'window', 'hysteresis', 'cooldown'])
+    unknown = set(frame['type']) - set(RULE_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown alert rule type(s): {sorted(unknown)}. Supported types are {RULE_TYPES}.")
+    if (frame['type'].isin(WINDOW_RULE_TYPES) & frame['window'].isna()).any():
+        raise ValueError("pct_change and ma_cross rules need a window.")
+
+    frame['threshold'] = frame['threshold'].astype('float64').fillna(0.0)
+    frame['window'] = frame['window'].fillna(1).astype('int64')
+    frame['hysteresis'] = frame['hysteresis'].astype('float64').fillna(0.0)
+    frame['cooldown'] = frame['cooldown'].astype('float64').fillna(default_cooldown)
+
+    frame['id'] = [rule_id(rule) for rule in rules]
+    if frame['id'].duplicated().any():
+        raise ValueError(f"Duplicate alert rule ids: {sorted(frame.loc[frame['id'].duplicated(), 'id'])}")
+
+    # +1 when the condition is "value at or above level", -1 when it is "at or below"
+    frame['direction'] = np.where(frame['type'].isin(['below', 'ma_cross_below']) | ((frame['type'] == 'pct_change') & (frame['threshold'] < 0)), -1.0, 1.0)
+    frame['level'] = np.where(frame['type'].str.startswith('ma_cross'), 0.0, frame['threshold'])
+    return frame.reset_index(drop=True)
+
+
+def rule_values(rules: 'pd.DataFrame', history: 'pd.DataFrame', latest: Optional['pd.Series'] = None) -> 'np.ndarray':
+    '''
+    Computes the value every rule compares against its level, for all rules at once.
+
+    history is a wide frame (one row per date, one column per symbol) sorted by date. If latest is given it is treated
+    as a new bar after the last row of history. Windows are counted in each symbol's own bars and end at the newest one.
+    '''
+    import numpy as np
+    import pandas as pd
+
+    symbols = list(history.columns)
+    bars = history.to_numpy(dtype='float64').reshape(len(history), len(symbols))
+    if latest is not None:
+        bars = np.vstack([bars, latest.reindex(symbols).to_numpy(dtype='float64')])
+    n = len(bars)
+    values = np.full(len(rules), np.nan)
+    if not n or not symbols:
+        return values
+
+    # Each symbol's bars are packed to the bottom of its column, so windows count that symbol's own bars (ETFs have no
+    # weekend rows, FX does) instead of rows of the joined frame.
+    order = np.argsort(~np.isnan(bars), axis=0, kind='stable')
+    bars = np.take_along_axis(bars, order, axis=0)
+    current = bars[-1]
+    column = pd.Index(symbols).get_indexer(rules['symbol'])
+    known = column >= 0
+    col = np.where(known, column, 0)
+    price = np.where(known, current[col], np.nan)
+    window = rules['window'].to_numpy()
+    rule_type = rules['type'].to_numpy()
+
+    # Level rules compare the price directly
+    is_level = np.isin(rule_type, ['above', 'below'])
+    values[is_level] = price[is_level]
+
+    # % change against the bar `window` bars ago
+    is_pct = (rule_type == 'pct_change') & known & (window < n)
+    base = bars[np.clip(n - 1 - window, 0, n - 1), col]
+    values[is_pct] = (price[is_pct] / base[is_pct] - 1.0) * 100.0
+
+    # Moving averages from cumulative sums, so any window length costs O(1) per rule. The window must be filled with the
+    # symbol's own bars: a symbol with fewer than `window` bars has no moving average yet.
+    sums = np.vstack([np.zeros(len(symbols)), np.cumsum(np.nan_to_num(bars), axis=0)])
+    seen = np.vstack([np.zeros(len(symbols)), np.cumsum(~np.isnan(bars), axis=0)])
+    start = np.clip(n - window, 0, n)
+    is_ma = np.isin(rule_type, ['ma_cross_above', 'ma_cross_below']) & known & (seen[n, col] - seen[start, col] >= window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moving_average = (sums[n, col] - sums[start, col]) / (seen[n, col] - seen[start, col])
+    values[is_ma] = price[is_ma] - moving_average[is_ma]
+    return values
+
+
+class AlertEngine:
+    def __init__(self, rules: List[dict], state_path: Optional[str] = "alert_state.json", default_cooldown: float = DEFAULT_COOLDOWN):
+        self.rules = rules_frame(rules, default_cooldown)
+        self.state_path = state_path
+        self.state = self.load_state()
+        self.lock = threading.Lock()
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(dict.fromkeys(self.rules['symbol']))
+
+    def load_state(self) -> Dict[str, dict]:
+        return load_state(self.state_path)
+
+    def save_state(self):
+        save_state(self.state_path, self.state)
+
+    def evaluate(self, history: 'pd.DataFrame', latest: Optional['pd.Series'] = None, now: Optional[float] = None, symbols: Optional[List[str]] = None) -> 'pd.DataFrame':
+        '''
+        Evaluates every rule (or only the rules for `symbols`) and returns the ones that fire now.
+
+        history is a wide frame of prices (one column per symbol, sorted by date). latest, if given, is a newer bar that
+        is not in history yet, e.g. a live quote.
+        '''
+        import numpy as np
+        import pandas as pd
+
+        now = time.time() if now is None else now
+        rules = self.rules if symbols is None else self.rules[self.rules['symbol'].isin(symbols)]
+        with get_default_metrics().stage('alerts'):
+            values = rule_values(rules, history, latest)
+        margin = rules['direction'].to_numpy() * (values - rules['level'].to_numpy())
+        evaluated = ~np.isnan(margin)
+
+        with self.lock:
+            ids = rules['id'].tolist()
+            was_active = np.array([self.state.get(rule_id, {}).get('active', False) for rule_id in ids], dtype=bool)
+            last_fired = np.array([self.state.get(rule_id, {}).get('last_fired', -np.inf) for rule_id in ids], dtype='float64')
+            # A cross needs a known side to cross from: the first evaluation of an ma_cross rule only records its state
+            evaluated_before = np.array(['active' in self.state.get(rule_id, {}) for rule_id in ids], dtype=bool)
+            is_cross = rules['type'].str.startswith('ma_cross').to_numpy()
+
+            # Hysteresis: a rule switches on at margin >= 0 but only switches off once the margin drops below -hysteresis
+            with np.errstate(invalid='ignore'):
+                active = np.where(evaluated, (margin >= 0) | (was_active & (margin > -rules['hysteresis'].to_numpy())), was_active)
+            fire = active & ~was_active & (now - last_fired >= rules['cooldown'].to_numpy()) & (evaluated_before | ~is_cross)
+
+            # Rules that could not be evaluated yet (too few bars) keep no state, so their first evaluation is known as such
+            for rule_id, is_active, fired, was_evaluated in zip(ids, active, fire, evaluated):
+                if not was_evaluated and 'active' not in self.state.get(rule_id, {}):
+                    continue
+                rule_state = self.state.setdefault(rule_id, {})
+                rule_state['active'] = bool(is_active)
+                if fired:
+                    rule_state['last_fired'] = now
+            self.save_state()
+
+        fired = rules.loc[fire, ['id', 'symbol', 'type', 'threshold', 'window']].copy()
+        fired['value'] = values[fire]
+        current = history.ffill().iloc[-1] if len(history) else pd.Series(dtype='float64')
+        if latest is not None:
+            current = latest.combine_first(current)
+        fired['price'] = current.reindex(fired['symbol']).to_numpy(dtype='float64')
+        return fired.reset_index(drop=True)
+
+
+def check_levels(rules: List[dict], prices: Dict[str, float], state_path: Optional[str] = "alert_state.json", default_cooldown: float = DEFAULT_COOLDOWN, now: Optional[float] = None) -> List[dict]:
+    '''
+    Evaluates the above/below rules against a dict of current prices and returns the ones that fire now, as dicts with
+    the same fields as AlertEngine.evaluate() rows.
+
+    Uses the same state file, hysteresis and cooldown as AlertEngine, so quick checks and full runs can be mixed.
+    Window rules need price history and are left to AlertEngine.
+    '''
+    unknown = {rule.get('type') for rule in rules} - set(RULE_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown alert rule type(s): {sorted(map(str, unknown))}. Supported types are {RULE_TYPES}.")
+
+    now = time.time() if now is None else now
+    state = load_state(state_path)
+    fired = []
+    for rule in rules:
+        price = prices.get(rule['symbol'])
+        if rule['type'] not in LEVEL_RULE_TYPES or price is None:
+            continue
+        threshold = float(rule.get('threshold') or 0.0)
+        margin = (price - threshold) if rule['type'] == 'above' else (threshold - price)
+        rule_state = state.setdefault(rule_id(rule), {})
+        was_active = rule_state.get('active', False)
+        active = margin >= 0 or (was_active and margin > -float(rule.get('hysteresis') or 0.0))
+        cooldown = default_cooldown if rule.get('cooldown') is None else float(rule['cooldown'])
+
+        rule_state['active'] = active
+        if active and not was_active and now - rule_state.get('last_fired', float('-inf')) >= cooldown:
+            rule_state['last_fired'] = now
+            fired.append({'id': rule_id(rule), 'symbol': rule['symbol'], 'type': rule['type'], 'threshold': threshold, 'window': int(rule.get('window') or 1), 'value': price, 'price': price})
+    save_state(state_path, state)
+    return fired
+
+
+def describe(alert: dict) -> str:
+    if alert['type'] == 'above':
+        return f"{alert['symbol']} is at {alert['price']:.2f}, above {alert['threshold']:g}"
+    if alert['type'] == 'below':
+        return f"{alert['symbol']} is at {alert['price']:.2f}, below {alert['threshold']:g}"
+    if alert['type'] == 'pct_change':
+        return f"{alert['symbol']} moved {alert['value']:+.2f}% over {alert['window']} bars (at {alert['price']:.2f})"
+    side = 'above' if alert['type'] == 'ma_cross_above' else 'below'
+    return f"{alert['symbol']} crossed {side} its {alert['window']} bar moving average (at {alert['price']:.2f})"
@@ -0,0 +1,188 @@
+'''
+Bulk end-of-day history backfill, e.g. when a new instrument is added.
+
+The date range is split into chunks of CHUNK_DAYS calendar days per symbol. EOD data has at most one bar per day, so
+every chunk fits in a single request under marketstack's 1000 row limit, and chunks are fetched in parallel by a
+bounded thread pool. Each chunk is written to the history store as soon as it arrives and recorded in a checkpoint
+file, so an interrupted backfill (Ctrl+C, a network outage, the quota running out) resumes with the chunks still
+missing when it is run again:
+
+    backfill(store, [("Gold prices", "GLDM"), ("Silver prices", "SIVR")], start="2015-01-01")
+
+FX pairs and spot metals are backfilled from metalpriceapi's timeframe endpoint the same way, in chunks of at most
+RATE_CHUNK_DAYS days:
+
+    backfill(store, [("USD to INR", "USDINR")], start="2015-01-01", fetch=rate_fetcher(api_key), chunk_days=RATE_CHUNK_DAYS)
+
+Requests go out with the "low" priority, so with a request budget configured they never crowd out the latest quotes.
+'''
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+import marketstack
+import metalpriceapi
+from history import HistoryStore
+from metrics import get_default_metrics
+from quota import QuotaExceeded
+
+# Calendar days per request: at most one EOD bar per day keeps every chunk within the 1000 row limit
+CHUNK_DAYS = 1000
+RATE_CHUNK_DAYS = metalpriceapi.TIMEFRAME_MAX_DAYS
+DEFAULT_WORKERS = 8
+DEFAULT_YEARS = 10
+DEFAULT_CHECKPOINT = "backfill.json"
+# Seconds before a failed chunk is retried when backing off, doubled after every further failure up to a day
+RETRY_BACKOFF = 15 * 60
+MAX_RETRY_BACKOFF = 24 * 60 * 60
+
+Day = Union[str, date, datetime]
+
+
+def to_date(value: Day) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def years_ago(years: int, today: Optional[date] = None) -> date:
+    today = today or datetime.now(timezone.utc).date()
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        # 29 February
+        return today.replace(year=today.year - years, day=28)
+
+
+def date_chunks(start: Day, end: Day, days: int = CHUNK_DAYS) -> List[Tuple[str, str]]:
+    # Consecutive, non overlapping (date_from, date_to) ranges covering start to end, both inclusive
+    start, end = to_date(start), to_date(end)
+    chunks = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=days - 1), end)
+        chunks.append((start.isoformat(), chunk_end.isoformat()))
+        start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+class Checkpoint:
+    def __init__(self, path: Optional[str] = DEFAULT_CHECKPOINT):
+        self.path = path
+        self.done: Set[str] = set()
+        # key -> [failures in a row, time of the last one]
+        self.failed: Dict[str, List[float]] = {}
+        self.load()
+
+    @staticmethod
+    def key(series: str, symbol: str, date_from: str, date_to: str) -> str:
+        return f"{series}|{symbol}|{date_from}|{date_to}"
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as file:
+            data = json.load(file)
+        self.done = set(data.get('done', []))
+        self.failed = data.get('failed', {})
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({'done': sorted(self.done), 'failed': self.failed}, file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done
+
+    def mark(self, key: str):
+        self.done.add(key)
+        self.failed.pop(key, None)
+        self.save()
+
+    def mark_failed(self, key: str, now: Optional[float] = None):
+        failures = self.failed.get(key, [0, 0.0])[0] + 1
+        self.failed[key] = [failures, time.time() if now is None else now]
+        self.save()
+
+    def retry_at(self, key: str, backoff: float) -> float:
+        # When a failed chunk may be fetched again; 0 if it has not failed
+        if key not in self.failed:
+            return 0.0
+        failures, failed_at = self.failed[key]
+        return failed_at + min(backoff * 2 ** (failures - 1), MAX_RETRY_BACKOFF)
+
+
+def fetch_chunk(symbol: str, date_from: str, date_to: str, exchange: Optional[str] = None):
+    query = marketstack.EndOfDay(symbol, exchange=exchange, date_from=date_from, date_to=date_to, limit=1000).with_priority('low')
+    return query.get_data_df(paginate=False)
+
+
+def rate_fetcher(api_key: str) -> Callable:
+    # fetch for backfill(): the daily rates of an FX pair or spot metal instead of EOD bars
+    return lambda symbol, date_from, date_to, exchange=None: metalpriceapi.historical_rates([symbol], api_key, date_from, date_to, priority='low')
+
+
+def backfill(store: HistoryStore, targets: List[Tuple[str, str]], start: Day, end: Optional[Day] = None, max_workers: int = DEFAULT_WORKERS, checkpoint_path: Optional[str] = DEFAULT_CHECKPOINT, exchange: Optional[str] = None, fetch: Callable = fetch_chunk, chunk_days: int = CHUNK_DAYS, retry_backoff: Optional[float] = None) -> int:
+    '''
+    Loads the EOD bars of every (series, symbol) in targets from start to end (default today) into the store, or
+    whatever else fetch(symbol, date_from, date_to, exchange) returns for a chunk of chunk_days days.
+    Chunks recorded in the checkpoint are skipped. Returns the number of rows written.
+
+    Failed chunks are reported and left out of the checkpoint, so the next run retries them. With retry_backoff set
+    (seconds), a chunk that failed is only retried once that long has passed, doubling with every further failure; a
+    caller running backfill() on every poll uses it to stop retrying a request that keeps failing. The backfill stops
+    early when the request budget refuses low priority requests, after writing the chunks that were already being
+    fetched.
+    '''
+    end = end or datetime.now(timezone.utc).date()
+    checkpoint = Checkpoint(checkpoint_path)
+    now = time.time()
+    chunks = [(series, symbol, date_from, date_to) for series, symbol in targets for date_from, date_to in date_chunks(start, end, chunk_days) if Checkpoint.key(series, symbol, date_from, date_to) not in checkpoint]
+    if retry_backoff is not None:
+        chunks = [chunk for chunk in chunks if checkpoint.retry_at(Checkpoint.key(*chunk), retry_backoff) <= now]
+    if not chunks:
+        return 0
+
+    metrics = get_default_metrics()
+    rows = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))))
+    try:
+        futures = {executor.submit(fetch, symbol, date_from, date_to, exchange): (series, symbol, date_from, date_to) for series, symbol, date_from, date_to in chunks}
+        # Chunks are written from this thread as they complete, in whatever order that is
+        paused = False
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            series, symbol, date_from, date_to = futures[future]
+            try:
+                frame = future.result()
+            except QuotaExceeded as e:
+                metrics.inc('backfill_chunks_total', {'status': 'quota'})
+                if not paused:
+                    paused = True
+                    print(f"Backfill paused: {e}")
+                    # Chunks not started yet are dropped; the ones in flight have spent their requests, so they are
+                    # still written and checkpointed
+                    for pending in futures:
+                        pending.cancel()
+                continue
+            except Exception as e:
+                metrics.inc('backfill_chunks_total', {'status': 'failed'})
+                print(f"Exception while backfilling {symbol} from {date_from} to {date_to}: {e}")
+                checkpoint.mark_failed(Checkpoint.key(series, symbol, date_from, date_to))
+                continue
+            rows += store.backfill(series, frame)
+            checkpoint.mark(Checkpoint.key(series, symbol, date_from, date_to))
+            metrics.inc('backfill_chunks_total', {'status': 'done'})
+    finally:
+        # Nothing more is fetched if the loop was interrupted
+        executor.shutdown(wait=False, cancel_futures=True)
+    return rows
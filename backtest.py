@@ -0,0 +1,209 @@
+'''
+Replays the alert rules over the stored price history, to see how often a threshold would have fired.
+
+replay() runs every rule over every bar at once, as if the tracker had checked after each bar. It uses the same
+values, hysteresis and cooldown as AlertEngine. For each rule it reports:
+- the number of fires;
+- how many bars the rule was active (in alert);
+- the dates of the first and last fires.
+
+sweep() does the same for a grid of candidate thresholds for one rule. The rule's value series is computed once, and
+the grid is broadcast against it as a (bars x thresholds) margin matrix. Trying 50 thresholds over 10 years of bars
+therefore costs a few array operations, not 50 replays:
+
+    history = load_price_history(store, instruments)
+    replay(get_rules(config), history)
+    sweep(history, {'symbol': 'SIVR', 'type': 'above'}, [34, 36, 38, 40])
+
+The hysteresis state machine has no closed form, so it is resolved by carrying the last decisive bar forward with
+np.maximum.accumulate. A margin at or above 0 switches a rule on, and a margin at or below -hysteresis switches it off.
+As in AlertEngine, an ma_cross rule does not fire on its first evaluated bar. Only cooldowns longer than the gap between
+two fires need a loop, and that loop only visits the fires.
+'''
+
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+from alerts import DEFAULT_COOLDOWN, LEVEL_RULE_TYPES, rules_frame
+from metrics import get_default_metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+SWEEP_RULE_TYPES = LEVEL_RULE_TYPES + ['pct_change']
+DEFAULT_GRID_STEPS = 20
+
+
+def replay_values(rules: 'pd.DataFrame', history: 'pd.DataFrame') -> 'np.ndarray':
+    '''
+    Value of every rule (columns) at every row of history (rows): what rule_values() would return if history ended at
+    that row. Like there, windows count each symbol's own bars. Rows where a symbol has no bar are NaN.
+    '''
+    import numpy as np
+
+    values = np.full((len(history), len(rules)), np.nan)
+    rule_type = rules['type'].to_numpy()
+    window = rules['window'].to_numpy()
+    for symbol in dict.fromkeys(rules['symbol']):
+        if symbol not in history:
+            continue
+        which = np.flatnonzero(rules['symbol'].to_numpy() == symbol)
+        column = history[symbol].to_numpy(dtype='float64')
+        rows = np.flatnonzero(~np.isnan(column))
+        prices = column[rows]
+        n = len(prices)
+        if not n:
+            continue
+        bar = np.arange(n)[:, None]
+        w = window[which][None, :]
+        kinds = rule_type[which]
+        out = np.full((n, len(which)), np.nan)
+
+        # Level rules compare the price directly
+        is_level = np.isin(kinds, LEVEL_RULE_TYPES)
+        out[:, is_level] = prices[:, None]
+
+        # % change against the bar `window` bars back
+        is_pct = kinds == 'pct_change'
+        if is_pct.any():
+            back = bar - w[:, is_pct]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[:, is_pct] = np.where(back >= 0, (prices[:, None] / prices[np.clip(back, 0, None)] - 1.0) * 100.0, np.nan)
+
+        # Price minus its moving average, from cumulative sums
+        is_ma = np.isin(kinds, ['ma_cross_above', 'ma_cross_below'])
+        if is_ma.any():
+            sums = np.concatenate([[0.0], np.cumsum(prices)])
+            start = bar + 1 - w[:, is_ma]
+            moving_average = (sums[bar + 1] - sums[np.clip(start, 0, None)]) / w[:, is_ma]
+            out[:, is_ma] = np.where(start >= 0, prices[:, None] - moving_average, np.nan)
+
+        values[rows[:, None], which[None, :]] = out
+    return values
+
+
+def replay_margins(margin: 'np.ndarray', hysteresis: 'np.ndarray', cooldown: 'np.ndarray', times: 'np.ndarray', cross: Optional['np.ndarray'] = None):
+    '''
+    Runs the alert state machine down every column of margin (bars x rules, NaN where there is nothing to evaluate).
+    times are the bar times in seconds. Columns marked in cross (ma_cross rules) never fire on their first evaluated
+    bar, which has no side to cross from. Returns (active, fire) boolean matrices of the same shape.
+    '''
+    import numpy as np
+
+    bars, columns = margin.shape
+    with np.errstate(invalid='ignore'):
+        on = margin >= 0
+        off = margin <= -hysteresis
+    # Between a decisive bar (on or off) and the next one, a rule keeps its state
+    decisive = np.where(on | off, np.arange(bars)[:, None], -1)
+    last = np.maximum.accumulate(decisive, axis=0)
+    active = (last >= 0) & np.take_along_axis(on, np.clip(last, 0, None), axis=0)
+
+    was_active = np.vstack([np.zeros((1, columns), dtype=bool), active[:-1]])
+    fire = active & ~was_active
+    if cross is not None and cross.any():
+        columns_evaluated = np.flatnonzero(cross & (~np.isnan(margin)).any(axis=0))
+        fire[np.argmax(~np.isnan(margin[:, columns_evaluated]), axis=0), columns_evaluated] = False
+    if not fire.any():
+        return active, fire
+
+    # A fire within `cooldown` of the previous one is suppressed, while the rule still turns active
+    for column in np.flatnonzero(fire.sum(axis=0) > 1):
+        edges = np.flatnonzero(fire[:, column])
+        if (np.diff(times[edges]) >= cooldown[column]).all():
+            continue
+        last_fired = -np.inf
+        for edge in edges:
+            if times[edge] - last_fired >= cooldown[column]:
+                last_fired = times[edge]
+            else:
+                fire[edge, column] = False
+    return active, fire
+
+
+def bar_times(history: 'pd.DataFrame') -> 'np.ndarray':
+    import numpy as np
+
+    if not len(history):
+        return np.zeros(0)
+    return (history.index - history.index[0]).total_seconds().to_numpy(dtype='float64')
+
+
+def summarise(margin: 'np.ndarray', active: 'np.ndarray', fire: 'np.ndarray', dates: 'pd.Index') -> dict:
+    # Per column: bars evaluated, fires, bars in alert and the share of bars in alert, first and last fire dates
+    import numpy as np
+    import pandas as pd
+
+    evaluated = ~np.isnan(margin)
+    bars = evaluated.sum(axis=0)
+    in_alert = (active & evaluated).sum(axis=0)
+    fired = fire.any(axis=0)
+    if len(dates):
+        first_fire = dates[np.argmax(fire, axis=0)].where(fired)
+        last_fire = dates[len(dates) - 1 - np.argmax(fire[::-1], axis=0)].where(fired)
+    else:
+        first_fire = last_fire = pd.DatetimeIndex([pd.NaT] * fire.shape[1])
+    return {
+        'bars': bars,
+        'fires': fire.sum(axis=0),
+        'bars_in_alert': in_alert,
+        'time_in_alert': np.divide(in_alert, bars, out=np.zeros(len(bars)), where=bars > 0),
+        'first_fire': first_fire,
+        'last_fire': last_fire,
+        'active_now': active[-1] if len(active) else np.zeros(fire.shape[1], dtype=bool),
+    }
+
+
+def replay(rules: List[dict], history: 'pd.DataFrame', default_cooldown: float = DEFAULT_COOLDOWN) -> 'pd.DataFrame':
+    '''
+    Replays rules over history (a wide frame: one row per date, one column per symbol, as the tracker loads it) and
+    returns one row per rule: id, symbol, type, threshold, window, bars, fires, bars_in_alert, time_in_alert (share
+    of the rule's bars), first_fire, last_fire and active_now. Rules start inactive at the first bar.
+    '''
+    frame = rules_frame(rules, default_cooldown)
+    history = history.sort_index()
+    with get_default_metrics().stage('backtest'):
+        values = replay_values(frame, history)
+        margin = frame['direction'].to_numpy() * (values - frame['level'].to_numpy())
+        cross = frame['type'].str.startswith('ma_cross').to_numpy()
+        active, fire = replay_margins(margin, frame['hysteresis'].to_numpy(), frame['cooldown'].to_numpy(), bar_times(history), cross)
+    report = frame[['id', 'symbol', 'type', 'threshold', 'window']].copy()
+    for name, column in summarise(margin, active, fire, history.index).items():
+        report[name] = column
+    return report
+
+
+def default_grid(values: 'np.ndarray', steps: int = DEFAULT_GRID_STEPS) -> 'np.ndarray':
+    # Thresholds at evenly spaced quantiles of what the rule has seen, so every one of them is crossed at some point
+    import numpy as np
+
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.zeros(0)
+    return np.unique(np.round(np.quantile(values, np.linspace(0.05, 0.95, steps)), 4))
+
+
+def sweep(history: 'pd.DataFrame', rule: dict, thresholds: Optional[Iterable[float]] = None, default_cooldown: float = DEFAULT_COOLDOWN) -> 'pd.DataFrame':
+    '''
+    Replays one above, below or pct_change rule with each of thresholds (default: DEFAULT_GRID_STEPS quantiles of its
+    values) in place of its own. Returns one row per threshold with the same statistics as replay().
+    '''
+    import numpy as np
+    import pandas as pd
+
+    if rule['type'] not in SWEEP_RULE_TYPES:
+        raise ValueError(f"Only {', '.join(SWEEP_RULE_TYPES)} rules have a threshold to sweep, not {rule['type']}.")
+    frame = rules_frame([{**rule, 'id': 'sweep'}], default_cooldown)
+    history = history.sort_index()
+    with get_default_metrics().stage('backtest'):
+        values = replay_values(frame, history)[:, 0]
+        thresholds = default_grid(values) if thresholds is None else np.asarray(list(thresholds), dtype='float64')
+        # A negative pct_change threshold watches for a drop, like in rules_frame()
+        direction = np.where((rule['type'] == 'below') | ((rule['type'] == 'pct_change') & (thresholds < 0)), -1.0, 1.0)
+        margin = direction[None, :] * (values[:, None] - thresholds[None, :])
+        columns = len(thresholds)
+        active, fire = replay_margins(margin, np.repeat(frame['hysteresis'].to_numpy(), columns), np.repeat(frame['cooldown'].to_numpy(), columns), bar_times(history))
+    report = pd.DataFrame({'symbol': rule['symbol'], 'type': rule['type'], 'threshold': thresholds, 'window': int(frame['window'].iloc[0])})
+    for name, column in summarise(margin, active, fire, history.index).items():
+        report[name] = column
+    return report
@@ -0,0 +1,351 @@
+'''
+Offline benchmarks for the tracker and the marketstack client, run against the local stub server.
+
+    python benchmarks.py                              # every suite
+    python benchmarks.py decode parquet --repeat 10   # selected suites
+    python benchmarks.py --save baseline.json         # record results
+    python benchmarks.py --baseline baseline.json     # fail if anything got slower than the tolerance allows
+
+Suites:
+    main     end-to-end latency of one tracker run, with an empty and with an up to date history store
+    decode   get_data_df for 1k and 100k row responses (network + decode), decode alone and the latest bar lookup
+    parquet  history store append, full read and a 30 day query
+    quotes   QUOTE_CLIENTS concurrent consumers of the latest quotes, each calling the API vs sharing the quote server
+    catalog  syncing a 20k ticker catalog, then symbol search through the API and from the local catalog
+    valuation  INR valuation (as-of join with the USD/INR series) of 1k and 100k bars
+    backtest  replaying the alert rules over 10 years of daily bars, and a 100 threshold sweep
+    startup  wall time of `Gold tracker.py --quick` and of a full run as fresh processes, plus an -X importtime report
+'''
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import backtest
+import marketstack
+from catalog import Catalog
+from history import HistoryStore
+from http_client import Transport, set_default_transport
+from quote_server import QuoteClient, QuoteService, make_server
+from stub_server import StubData, StubServer
+from valuation import value_in_inr
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DECODE_SIZES = [1_000, 100_000]
+PARQUET_SIZES = [1_000, 100_000]
+VALUATION_SIZES = [1_000, 100_000]
+CATALOG_TICKERS = 20_000
+BACKTEST_BARS = 3_650
+SWEEP_THRESHOLDS = 100
+QUOTE_CLIENTS = 20
+# Upstream latency of the stub in the quotes suite, roughly a real API round trip
+QUOTE_LATENCY = 0.05
+# Imports listed in the startup report
+IMPORT_REPORT_SIZE = 10
+
+
+def measure(fn: Callable[[], object], repeat: int, setup: Callable[[], object] = None) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarise(name: str, samples: List[float], rows: int = None) -> dict:
+    result = {
+        'name': name,
+        'best': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'repeat': len(samples),
+    }
+    if rows:
+        result['rows_per_second'] = rows / result['median']
+    throughput = f"  {result['rows_per_second']:>12,.0f} rows/s" if rows else ""
+    print(f"{name:<40} best {result['best'] * 1000:9.2f} ms  median {result['median'] * 1000:9.2f} ms{throughput}")
+    return result
+
+
+@contextlib.contextmanager
+def working_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def write_tracker_config(stub: StubServer):
+    config = {
+        'marketstack_base_url': stub.marketstack_url,
+        'metalpriceapi_base_url': stub.metalpriceapi_url,
+        'history_dir': 'history',
+        'alert_state_path': None,
+        # Thresholds nobody reaches, so no notification is sent while benchmarking
+        'rules': [{'symbol': symbol, 'type': 'above', 'threshold': 1e9} for symbol in ('SIVR', 'GLDM', 'USDINR')],
+    }
+    with open("config.yaml", "w") as file:
+        yaml.safe_dump(config, file)
+
+
+def import_times(command: List[str], env: dict) -> List[tuple]:
+    # (cumulative seconds, module) of every top level import made by the command, slowest first
+    stderr = subprocess.run([sys.executable, "-X", "importtime", *command], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name[1:].startswith(" "):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)
+
+
+def load_tracker():
+    spec = importlib.util.spec_from_file_location("gold_tracker", os.path.join(ROOT, "Gold tracker.py"))
+    tracker = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tracker)
+    return tracker
+
+
+# Suites
+def bench_main(repeat: int) -> List[dict]:
+    tracker = load_tracker()
+    results = []
+    with StubServer() as stub, tempfile.TemporaryDirectory() as workdir, working_directory(workdir):
+        write_tracker_config(stub)
+        os.environ.setdefault("MARKETSTACK_API", "stub")
+        os.environ.setdefault("METAL_PRICE_API", "stub")
+        argv = sys.argv
+        sys.argv = ["Gold tracker.py"]
+        try:
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                cold = measure(tracker.main, repeat, setup=lambda: clear_history('history'))
+                warm = measure(tracker.main, repeat)
+        finally:
+            sys.argv = argv
+        results.append(summarise("main: empty history", cold))
+        results.append(summarise("main: up to date history", warm))
+    return results
+
+
+def clear_history(path: str):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def bench_decode(repeat: int) -> List[dict]:
+    results = []
+    for rows in DECODE_SIZES:
+        with StubServer(data=StubData(eod_rows_per_symbol=rows)) as stub:
+            marketstack.set_base_url(stub.marketstack_url)
+            marketstack.set_api_key("stub")
+            set_default_transport(Transport(pool_maxsize=marketstack.DEFAULT_MAX_WORKERS))
+            query = lambda: marketstack.EndOfDay('GLDM', limit=1000).get_data_df()
+            results.append(summarise(f"get_data_df: {rows:,} rows", measure(query, repeat), rows))
+
+            payload = [row for page in marketstack.EndOfDay('GLDM', limit=1000).iter_pages() for row in page]
+            body = json.dumps({'data': payload}).encode()
+            results.append(summarise(f"decode (json + DataFrame): {rows:,} rows", measure(lambda: pd.DataFrame(json.loads(body)['data']), repeat), rows))
+            results.append(summarise(f"decode (typed columns): {rows:,} rows", measure(lambda: marketstack.decode_frame(marketstack.loads(body)['data']), repeat), rows))
+            frame = marketstack.decode_frame(payload)
+            # Both take the whole newest row, as HistoryStore.latest() does
+            results.append(summarise(f"latest bar (sort): {rows:,} rows", measure(lambda: frame.sort_values(by='date', ascending=False).iloc[0]['close'], repeat), rows))
+            results.append(summarise(f"latest bar (argmax): {rows:,} rows", measure(lambda: marketstack.latest_bar(frame)['close'], repeat), rows))
+    return results
+
+
+def bench_parquet(repeat: int) -> List[dict]:
+    results = []
+    for rows in PARQUET_SIZES:
+        dates = pd.date_range(end="2024-05-10", periods=rows, freq="h", tz="UTC")
+        frame = pd.DataFrame({'symbol': 'GLDM', 'date': dates, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 1.0, 'volume': 1.0, 'exchange': 'ARCX'})
+        with tempfile.TemporaryDirectory() as workdir:
+            root = os.path.join(workdir, "history")
+            results.append(summarise(f"history append: {rows:,} rows", measure(lambda: HistoryStore(root).append("Gold prices", frame), repeat, setup=lambda: clear_history(root)), rows))
+            results.append(summarise(f"history read: {rows:,} rows", measure(lambda: HistoryStore(root).read("Gold prices"), repeat), rows))
+            last_30_days = lambda: HistoryStore(root).query("Gold prices", symbols=["GLDM"], start=dates[-1] - pd.Timedelta(days=30), columns=["close"])
+            results.append(summarise(f"history query, last 30 days: {rows:,} rows", measure(last_30_days, repeat)))
+    return results
+
+
+def bench_catalog(repeat: int) -> List[dict]:
+    results = []
+    with StubServer(data=StubData(tickers=CATALOG_TICKERS, exchanges=50)) as stub, tempfile.TemporaryDirectory() as workdir:
+        marketstack.set_base_url(stub.marketstack_url)
+        marketstack.set_api_key("stub")
+        set_default_transport(Transport(pool_maxsize=marketstack.DEFAULT_MAX_WORKERS))
+        path = os.path.join(workdir, "catalog.sqlite3")
+        results.append(summarise(f"catalog sync: {CATALOG_TICKERS:,} tickers", measure(lambda: Catalog(path).refresh(force=True), repeat), CATALOG_TICKERS))
+
+        catalog = Catalog(path)
+        results.append(summarise("ticker search: API", measure(lambda: marketstack.Tickers(search='GLDM0001', limit=10).get_data(paginate=False), repeat)))
+        for text in ('GLDM0001', 'silver etf'):
+            # Lookups are far below timer resolution, so each sample is 100 of them
+            samples = measure(lambda: [catalog.search_tickers(text, 10) for _ in range(100)], repeat)
+            results.append(summarise(f"ticker search: catalog, {text!r} (x100)", samples))
+        results.append(summarise("listings: catalog (x100)", measure(lambda: [catalog.listings('GLDM') for _ in range(100)], repeat)))
+        catalog.close()
+    return results
+
+
+def fan_out(fetch: Callable[[], object], clients: int) -> list:
+    # The same call made by `clients` consumers at once
+    with ThreadPoolExecutor(clients) as pool:
+        return list(pool.map(lambda _: fetch(), range(clients)))
+
+
+def bench_quotes(repeat: int) -> List[dict]:
+    results = []
+    symbols = ['GLDM', 'SIVR']
+    with StubServer(latency=QUOTE_LATENCY) as stub:
+        marketstack.set_base_url(stub.marketstack_url)
+        marketstack.set_api_key("stub")
+        set_default_transport(Transport(pool_maxsize=QUOTE_CLIENTS))
+        direct = lambda: marketstack.EndOfDay(','.join(symbols)).latest().get_data(paginate=False)
+
+        server = make_server(QuoteService(), "127.0.0.1:0")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = QuoteClient(f"127.0.0.1:{server.server_address[1]}")
+        # max_age=0 makes every round go upstream, so what is measured is the coalescing rather than the memory cache
+        cases = [("quotes: clients call the API", direct), ("quotes: clients share the quote server", lambda: client.prices(symbols, max_age=0))]
+        try:
+            for name, fetch in cases:
+                before = len(stub.requests)
+                samples = measure(lambda: fan_out(fetch, QUOTE_CLIENTS), repeat)
+                results.append(summarise(f"{name} ({QUOTE_CLIENTS} clients)", samples))
+                print(f"{'':<40} {(len(stub.requests) - before) / repeat:.1f} upstream requests per round")
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def bench_valuation(repeat: int) -> List[dict]:
+    results = []
+    for rows in VALUATION_SIZES:
+        # Hourly bars against a daily rate, so every bar has to find the rate in effect at its date
+        dates = pd.date_range(end="2024-05-10", periods=rows, freq="h", tz="UTC")
+        prices = pd.DataFrame({'symbol': 'GLDM', 'date': dates, 'close': 40.0})
+        rate_dates = pd.date_range(start=dates[0].normalize(), end=dates[-1], freq="D")
+        rates = pd.DataFrame({'date': rate_dates, 'rate': 83.0})
+        results.append(summarise(f"INR valuation: {rows:,} bars", measure(lambda: value_in_inr(prices, rates), repeat), rows))
+    return results
+
+
+def bench_backtest(repeat: int) -> List[dict]:
+    # Daily random walks with weekend gaps for the ETFs, like the stored history
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(end="2024-05-10", periods=BACKTEST_BARS, freq="D", tz="UTC")
+    history = pd.DataFrame({symbol: start + np.cumsum(rng.normal(0, start / 100, BACKTEST_BARS)) for symbol, start in [('SIVR', 30.0), ('GLDM', 50.0), ('USDINR', 83.0)]}, index=dates)
+    history.loc[history.index.weekday >= 5, ['SIVR', 'GLDM']] = np.nan
+    rules = [
+        {'symbol': 'SIVR', 'type': 'above', 'threshold': 38, 'hysteresis': 0.5},
+        {'symbol': 'GLDM', 'type': 'below', 'threshold': 45},
+        {'symbol': 'SIVR', 'type': 'pct_change', 'threshold': -3, 'window': 5},
+        {'symbol': 'USDINR', 'type': 'ma_cross_above', 'window': 20},
+    ]
+    thresholds = np.linspace(-10, 10, SWEEP_THRESHOLDS)
+    return [
+        summarise(f"backtest: replay {len(rules)} rules", measure(lambda: backtest.replay(rules, history), repeat), BACKTEST_BARS),
+        summarise(f"backtest: sweep {SWEEP_THRESHOLDS} thresholds", measure(lambda: backtest.sweep(history, rules[2], thresholds), repeat), BACKTEST_BARS * SWEEP_THRESHOLDS),
+    ]
+
+
+def bench_startup(repeat: int) -> List[dict]:
+    # Fresh interpreters, as cron/launchd would start them, so interpreter start up and imports are included
+    results = []
+    script = os.path.join(ROOT, "Gold tracker.py")
+    env = {**os.environ, 'MARKETSTACK_API': 'stub', 'METAL_PRICE_API': 'stub'}
+    commands = [
+        ("startup: bare interpreter", ["-c", "pass"]),
+        ("startup: tracker --quick", [script, "--quick"]),
+        ("startup: tracker full run", [script]),
+    ]
+    with StubServer() as stub, tempfile.TemporaryDirectory() as workdir, working_directory(workdir):
+        write_tracker_config(stub)
+        # One run first, so the full run is timed with an up to date history store
+        subprocess.run([sys.executable, script], env=env, stdout=subprocess.DEVNULL, check=True)
+        for name, command in commands:
+            run = lambda: subprocess.run([sys.executable, *command], env=env, stdout=subprocess.DEVNULL, check=True)
+            results.append(summarise(name, measure(run, repeat)))
+
+        for name, command in commands[1:]:
+            imports = import_times(command, env)
+            print(f"\n{name}: {sum(seconds for seconds, _ in imports) * 1000:.1f} ms in imports, slowest:")
+            for seconds, module in imports[:IMPORT_REPORT_SIZE]:
+                print(f"    {seconds * 1000:9.2f} ms  {module}")
+    return results
+
+
+SUITES: Dict[str, Callable[[int], List[dict]]] = {
+    'main': bench_main,
+    'decode': bench_decode,
+    'parquet': bench_parquet,
+    'valuation': bench_valuation,
+    'backtest': bench_backtest,
+    'catalog': bench_catalog,
+    'quotes': bench_quotes,
+    'startup': bench_startup,
+}
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, "r") as file:
+        baseline = {result['name']: result for result in json.load(file)}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous and result['median'] > previous['median'] * (1 + tolerance):
+            regressions.append(f"{result['name']}: {previous['median'] * 1000:.2f} ms -> {result['median'] * 1000:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker against the local stub server.")
+    parser.add_argument("suites", nargs="*", help=f"Suites to run: {', '.join(SUITES)} (default: all).")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against results saved with --save and exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%%).")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suite(s): {', '.join(sorted(unknown))}")
+
+    results = []
+    for name in args.suites or SUITES:
+        results.extend(SUITES[name](args.repeat))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
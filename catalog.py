@@ -0,0 +1,328 @@
+'''
+Local, indexed copy of the marketstack ticker and exchange catalog.
+
+refresh() syncs the tickers and exchanges lists into SQLite; after that symbol search, MIC lookups and "which
+exchanges list this ETF" are answered offline from indexes, without an API request:
+
+    catalog = Catalog("cache/catalog.sqlite3")
+    catalog.refresh()                          # only fetches lists older than max_age
+    catalog.search_tickers("gold mini")        # every word matched as a prefix of the symbol or name
+    catalog.exchange("ARCX")
+    catalog.listings("GLDM")
+
+Symbols and names are indexed with SQLite FTS5 when the SQLite build has it, and with NOCASE prefix indexes otherwise.
+A refresh can be limited to some exchanges (refresh(mics=["ARCX"])). It streams the pages into the database, rewrites
+only the rows that changed (the full text index follows through triggers) and drops tickers that are no longer
+listed. The database is in WAL mode and a refresh writes through its own connection, so lookups are never blocked.
+'''
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import marketstack
+
+DEFAULT_PATH = "cache/catalog.sqlite3"
+# Seconds before refresh() fetches a list again
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+DEFAULT_LIMIT = 20
+PAGE_SIZE = 1000
+# Sorts after any text with the same prefix, so `column >= prefix AND column < prefix + PREFIX_END` is a prefix search
+PREFIX_END = chr(0x10FFFF)
+
+TICKER_COLUMNS = ['symbol', 'mic', 'name', 'has_eod', 'has_intraday', 'country']
+EXCHANGE_COLUMNS = ['mic', 'acronym', 'name', 'country', 'country_code', 'city', 'website', 'timezone', 'currency']
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tickers (
+        symbol TEXT NOT NULL COLLATE NOCASE,
+        mic TEXT NOT NULL,
+        name TEXT COLLATE NOCASE,
+        has_eod INTEGER,
+        has_intraday INTEGER,
+        country TEXT,
+        synced_at REAL NOT NULL,
+        PRIMARY KEY (symbol, mic)
+    );
+    CREATE INDEX IF NOT EXISTS tickers_name ON tickers (name);
+    CREATE INDEX IF NOT EXISTS tickers_mic ON tickers (mic);
+    CREATE TABLE IF NOT EXISTS exchanges (
+        mic TEXT PRIMARY KEY COLLATE NOCASE,
+        acronym TEXT COLLATE NOCASE,
+        name TEXT COLLATE NOCASE,
+        country TEXT,
+        country_code TEXT,
+        city TEXT,
+        website TEXT,
+        timezone TEXT,
+        currency TEXT,
+        synced_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS exchanges_acronym ON exchanges (acronym);
+    CREATE INDEX IF NOT EXISTS exchanges_name ON exchanges (name);
+    CREATE TABLE IF NOT EXISTS syncs (
+        scope TEXT PRIMARY KEY,
+        synced_at REAL NOT NULL
+    );
+"""
+
+# External content FTS5 tables: the text lives in tickers/exchanges and the triggers keep the index in step with it
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tickers_fts USING fts5(symbol, name, content='tickers', content_rowid='rowid', prefix='1 2 3');
+    CREATE TRIGGER IF NOT EXISTS tickers_ai AFTER INSERT ON tickers BEGIN
+        INSERT INTO tickers_fts (rowid, symbol, name) VALUES (new.rowid, new.symbol, new.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS tickers_ad AFTER DELETE ON tickers BEGIN
+        INSERT INTO tickers_fts (tickers_fts, rowid, symbol, name) VALUES ('delete', old.rowid, old.symbol, old.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS tickers_au AFTER UPDATE OF symbol, name ON tickers BEGIN
+        INSERT INTO tickers_fts (tickers_fts, rowid, symbol, name) VALUES ('delete', old.rowid, old.symbol, old.name);
+        INSERT INTO tickers_fts (rowid, symbol, name) VALUES (new.rowid, new.symbol, new.name);
+    END;
+    CREATE VIRTUAL TABLE IF NOT EXISTS exchanges_fts USING fts5(mic, acronym, name, country, city, content='exchanges', content_rowid='rowid', prefix='1 2 3');
+    CREATE TRIGGER IF NOT EXISTS exchanges_ai AFTER INSERT ON exchanges BEGIN
+        INSERT INTO exchanges_fts (rowid, mic, acronym, name, country, city) VALUES (new.rowid, new.mic, new.acronym, new.name, new.country, new.city);
+    END;
+    CREATE TRIGGER IF NOT EXISTS exchanges_ad AFTER DELETE ON exchanges BEGIN
+        INSERT INTO exchanges_fts (exchanges_fts, rowid, mic, acronym, name, country, city) VALUES ('delete', old.rowid, old.mic, old.acronym, old.name, old.country, old.city);
+    END;
+    CREATE TRIGGER IF NOT EXISTS exchanges_au AFTER UPDATE OF mic, acronym, name, country, city ON exchanges BEGIN
+        INSERT INTO exchanges_fts (exchanges_fts, rowid, mic, acronym, name, country, city) VALUES ('delete', old.rowid, old.mic, old.acronym, old.name, old.country, old.city);
+        INSERT INTO exchanges_fts (rowid, mic, acronym, name, country, city) VALUES (new.rowid, new.mic, new.acronym, new.name, new.country, new.city);
+    END;
+"""
+
+
+def ticker_row(row: dict) -> Optional[tuple]:
+    exchange = row.get('stock_exchange') or {}
+    if not row.get('symbol') or not exchange.get('mic'):
+        return None
+    flag = lambda value: None if value is None else int(bool(value))
+    return (row['symbol'], exchange['mic'], row.get('name'), flag(row.get('has_eod')), flag(row.get('has_intraday')), row.get('country') or exchange.get('country'))
+
+
+def exchange_row(row: dict) -> Optional[tuple]:
+    if not row.get('mic'):
+        return None
+    return (row['mic'], row.get('acronym'), row.get('name'), row.get('country'), row.get('country_code'), row.get('city'), row.get('website'), (row.get('timezone') or {}).get('timezone'), (row.get('currency') or {}).get('code'))
+
+
+def match_query(text: str) -> str:
+    # Every word of the search text as a quoted prefix term, so punctuation in symbols ("BRK.B") cannot break the syntax
+    words = ''.join(char if char.isalnum() else ' ' for char in text).split()
+    return ' AND '.join(f'"{word}"*' for word in words)
+
+
+
+
+class Catalog:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = self.connect()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: searches fall back to the prefix indexes
+            self.fts = False
+        self.connection.commit()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # Syncing
+    def synced_at(self, scope: str) -> Optional[float]:
+        with self.lock:
+            row = self.connection.execute("SELECT synced_at FROM syncs WHERE scope = ?", (scope,)).fetchone()
+        return row['synced_at'] if row else None
+
+    def is_stale(self, scopes: List[str], max_age: float) -> bool:
+        # A list is fresh if any of the scopes covering it was synced within max_age (e.g. a full tickers sync covers every exchange)
+        synced = [synced_at for synced_at in map(self.synced_at, scopes) if synced_at is not None]
+        return not synced or time.time() - max(synced) >= max_age
+
+    def refresh(self, mics: Optional[List[str]] = None, max_age: float = DEFAULT_MAX_AGE, force: bool = False) -> Dict[str, int]:
+        '''
+        Syncs the exchanges and the tickers (of every exchange, or only of `mics`) fetched more than max_age seconds ago.
+        Returns the number of rows added or changed and removed per list.
+        '''
+        counts = {}
+        if force or self.is_stale(['exchanges'], max_age):
+            counts['exchanges'] = self.sync_exchanges()
+        if mics is None:
+            if force or self.is_stale(['tickers'], max_age):
+                counts['tickers'] = self.sync_tickers()
+        else:
+            for mic in mics:
+                if force or self.is_stale(['tickers', f'tickers:{mic}'], max_age):
+                    counts[f'tickers:{mic}'] = self.sync_tickers(mic)
+        return counts
+
+    def sync_exchanges(self) -> int:
+        query = marketstack.Exchanges(limit=PAGE_SIZE).with_priority('low')
+        return self.sync('exchanges', EXCHANGE_COLUMNS, ['mic'], (exchange_row(row) for row in query.iter_rows()), 'exchanges')
+
+    def sync_tickers(self, mic: Optional[str] = None) -> int:
+        query = marketstack.Tickers(exchange=mic, limit=PAGE_SIZE).with_priority('low')
+        rows = (ticker_row(row) for row in query.iter_rows())
+        if mic is None:
+            return self.sync('tickers', TICKER_COLUMNS, ['symbol', 'mic'], rows, 'tickers')
+        return self.sync('tickers', TICKER_COLUMNS, ['symbol', 'mic'], (row for row in rows if row and row[1] == mic), f'tickers:{mic}', ('mic = ?', [mic]))
+
+    def sync(self, table: str, columns: List[str], key: List[str], rows: Iterable[Optional[tuple]], scope: str, where: tuple = ('1', [])) -> int:
+        '''
+        Streams rows into a staging table, then upserts the ones that are new or changed and deletes the rows matching
+        `where` that the API no longer returned, all in one transaction. Returns the number of rows written or deleted.
+        '''
+        started = time.time()
+        values = [name for name in columns if name not in key]
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(f"CREATE TEMP TABLE incoming AS SELECT {', '.join(columns)} FROM {table} WHERE 0")
+                insert = f"INSERT INTO incoming VALUES ({', '.join('?' * len(columns))})"
+                batch = []
+                for row in rows:
+                    if row is not None:
+                        batch.append(row)
+                    if len(batch) >= PAGE_SIZE:
+                        connection.executemany(insert, batch)
+                        batch = []
+                connection.executemany(insert, batch)
+
+                # "WHERE true" keeps SQLite from reading ON CONFLICT as part of the SELECT
+                changed = connection.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}, synced_at) SELECT {', '.join(columns)}, ? FROM incoming WHERE true "
+                    f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET {', '.join(f'{name} = excluded.{name}' for name in values)}, synced_at = excluded.synced_at "
+                    f"WHERE {' OR '.join(f'{table}.{name} IS NOT excluded.{name}' for name in values)}",
+                    (started,),
+                ).rowcount
+                # Unchanged rows only get their sync time bumped, which leaves the full text index alone
+                connection.execute(f"UPDATE {table} SET synced_at = ? WHERE synced_at < ? AND ({', '.join(key)}) IN (SELECT {', '.join(key)} FROM incoming)", (started, started))
+                condition, params = where
+                removed = connection.execute(f"DELETE FROM {table} WHERE synced_at < ? AND {condition}", [started, *params]).rowcount
+                connection.execute("INSERT OR REPLACE INTO syncs (scope, synced_at) VALUES (?, ?)", (scope, started))
+                connection.execute("DROP TABLE incoming")
+        finally:
+            connection.close()
+        return changed + removed
+
+    # Lookups
+    def select(self, sql: str, params: Iterable) -> List[dict]:
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, list(params))]
+
+    def search_tickers(self, text: str, limit: int = DEFAULT_LIMIT, mic: Optional[str] = None) -> List[dict]:
+        '''
+        Symbols starting with the text, in symbol order (so an exact match comes first), then tickers with a word of
+        their name starting with every word of the text. Name matches are not ranked: scoring every match of a short
+        prefix costs milliseconds on a full catalog, walking the index in order costs microseconds.
+        '''
+        text = text.strip()
+        if not text:
+            return []
+        columns = ', '.join(f"t.{name}" for name in TICKER_COLUMNS)
+        exchange_filter, exchange_params = (" AND t.mic = ?", [mic]) if mic else ("", [])
+
+        # A range on the NOCASE primary key, read in index order
+        rows = self.select(f"SELECT {columns} FROM tickers t WHERE t.symbol >= ? AND t.symbol < ?{exchange_filter} ORDER BY t.symbol LIMIT ?", [text, text + PREFIX_END, *exchange_params, limit])
+        if len(rows) >= limit:
+            return rows
+
+        seen = {(row['symbol'], row['mic']) for row in rows}
+        if self.fts:
+            query = match_query(text)
+            if not query:
+                return rows
+            names = self.select(f"SELECT {columns} FROM tickers_fts JOIN tickers t ON t.rowid = tickers_fts.rowid WHERE tickers_fts MATCH ?{exchange_filter} LIMIT ?", [query, *exchange_params, limit + len(rows)])
+        else:
+            names = self.select(f"SELECT {columns} FROM tickers t WHERE t.name >= ? AND t.name < ?{exchange_filter} ORDER BY t.name LIMIT ?", [text, text + PREFIX_END, *exchange_params, limit + len(rows)])
+        rows.extend(row for row in names if (row['symbol'], row['mic']) not in seen)
+        return rows[:limit]
+
+    def search_exchanges(self, text: str, limit: int = DEFAULT_LIMIT) -> List[dict]:
+        columns = ', '.join(f"e.{name}" for name in EXCHANGE_COLUMNS)
+        if self.fts:
+            query = match_query(text)
+            if not query:
+                return []
+            sql = f"SELECT {columns} FROM exchanges_fts JOIN exchanges e ON e.rowid = exchanges_fts.rowid WHERE exchanges_fts MATCH ? ORDER BY e.mic = ? DESC, e.acronym = ? DESC, rank LIMIT ?"
+            return self.select(sql, [query, text.strip(), text.strip(), limit])
+
+        text = text.strip()
+        ranges = ' OR '.join(f"(e.{name} >= ? AND e.{name} < ?)" for name in ('mic', 'acronym', 'name'))
+        sql = f"SELECT {columns} FROM exchanges e WHERE {ranges} ORDER BY e.mic = ? DESC, e.mic LIMIT ?"
+        return self.select(sql, [text, text + PREFIX_END] * 3 + [text, limit])
+
+    def exchange(self, mic: str) -> Optional[dict]:
+        rows = self.select(f"SELECT {', '.join(EXCHANGE_COLUMNS)} FROM exchanges WHERE mic = ?", [mic])
+        return rows[0] if rows else None
+
+    def ticker(self, symbol: str, mic: Optional[str] = None) -> Optional[dict]:
+        rows = self.select(f"SELECT {', '.join(TICKER_COLUMNS)} FROM tickers WHERE symbol = ?{' AND mic = ?' if mic else ''} ORDER BY mic LIMIT 1", [symbol, *([mic] if mic else [])])
+        return rows[0] if rows else None
+
+    def listings(self, symbol: str) -> List[dict]:
+        # Every exchange listing the symbol, with the exchange's details
+        sql = (
+            "SELECT t.symbol, t.name, t.mic, e.acronym, e.name AS exchange_name, e.country, e.city, e.timezone, e.currency "
+            "FROM tickers t LEFT JOIN exchanges e ON e.mic = t.mic WHERE t.symbol = ? ORDER BY t.mic"
+        )
+        return self.select(sql, [symbol])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync and search the local marketstack ticker and exchange catalog.")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--base-url", help="marketstack API base URL, e.g. a local stub server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    refresh = commands.add_parser("refresh", help="Fetch the lists older than --max-age.")
+    refresh.add_argument("--mic", nargs="+", help="Only refresh the tickers of these exchanges.")
+    refresh.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE, help="Seconds.")
+    refresh.add_argument("--force", action="store_true")
+    for name, description in (("search", "Search tickers by symbol or name."), ("exchanges", "Search exchanges by MIC, acronym, name or place.")):
+        command = commands.add_parser(name, help=description)
+        command.add_argument("text", nargs="+")
+        command.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    commands.add_parser("listings", help="Exchanges listing a symbol.").add_argument("symbol")
+    args = parser.parse_args()
+
+    if args.base_url:
+        marketstack.set_base_url(args.base_url)
+    # The tracker's .env names the key MARKETSTACK_API
+    if os.getenv("MARKETSTACK_API"):
+        marketstack.set_api_key(os.environ["MARKETSTACK_API"])
+
+    catalog = Catalog(args.path)
+    if args.command == "refresh":
+        counts = catalog.refresh(args.mic, args.max_age, args.force)
+        print("\n".join(f"{scope}: {count} rows added, changed or removed" for scope, count in counts.items()) or "Catalog is up to date.")
+    elif args.command == "search":
+        for row in catalog.search_tickers(" ".join(args.text), args.limit):
+            print(f"{row['symbol']:<12} {row['mic']:<6} {row['name']}")
+    elif args.command == "exchanges":
+        for row in catalog.search_exchanges(" ".join(args.text), args.limit):
+            print(f"{row['mic']:<6} {row['acronym'] or '':<10} {row['name']} ({row['city']}, {row['country']})")
+    else:
+        for row in catalog.listings(args.symbol):
+            print(f"{row['symbol']:<12} {row['mic']:<6} {row['exchange_name'] or ''} ({row['country'] or ''})")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+'''
+Append-only parquet history for the tracked series ("Gold prices", "Silver prices", "USD to INR").
+
+Each series is a parquet dataset partitioned by symbol and year:
+
+    history/Gold prices/symbol=GLDM/year=2024/part-20240510T201500-1a2b3c4d.parquet
+
+A run only writes the rows it has not seen before, as new part files in the partitions they belong to, so existing
+history is never rewritten. Rows inside a file are sorted by date and written in row groups with min/max statistics;
+partitions that collect many small parts are compacted into one sorted file. manifest.json records the last stored date
+per series and symbol, which is all that is needed to ask the API for the delta since the previous run.
+
+Rewriting files (upserts, compaction, migrating an unpartitioned store) goes through a journal in history/.journal:
+the replacement files are written there first, then an entry naming them and the files they replace, and only then are
+files moved. An interrupted rewrite is finished the next time the store is opened, so old and new rows never end up side
+by side.
+
+query() only opens the partitions of the requested symbols and years, skips row groups whose date statistics fall
+outside the range, reads only the requested columns and memory maps the files:
+
+    store.query("Gold prices", symbols=["GLDM"], start="2024-04-10", columns=["close"])
+'''
+
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Union
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+import marketstack
+from metrics import get_default_metrics
+
+MANIFEST_FILE = "manifest.json"
+JOURNAL_DIR = ".journal"
+# How far back to seed a series that has no history yet.
+DEFAULT_INITIAL_DAYS = 365
+# Columns that are always stored as float64, so part files written on different days share one schema.
+NUMERIC_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'adj_high', 'adj_low', 'adj_close', 'adj_open', 'adj_volume', 'split_factor', 'dividend', 'rate', 'close_inr']
+# Partition keys, taken from the directory names (symbol=<symbol>/year=<year>) rather than stored in the files.
+PARTITIONING = ds.partitioning(pa.schema([('symbol', pa.string()), ('year', pa.int32())]), flavor='hive')
+# Rows per row group. Smaller groups let date range queries skip more of a large (intraday) partition.
+ROW_GROUP_SIZE = 16_384
+# A partition holding more part files than this is compacted into one file after an append.
+MAX_PARTS_PER_PARTITION = 32
+
+Timestamp = Union[str, datetime, pd.Timestamp]
+
+
+def to_utc(value: Optional[Timestamp]) -> Optional[pd.Timestamp]:
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+
+def partition_files(partition: str) -> List[str]:
+    return [os.path.join(partition, name) for name in sorted(os.listdir(partition)) if name.endswith(".parquet")]
+
+
+def part_name() -> str:
+    return f"part-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+
+
+class HistoryStore:
+    def __init__(self, root: str = "history"):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        os.makedirs(root, exist_ok=True)
+        self.manifest = self.load_manifest()
+        # Series can be appended to from several polling threads at once; the manifest is shared between them. Readers
+        # take the lock too, as upserts replace part files. Reentrant, since writers query what is already stored.
+        self.lock = threading.RLock()
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+        self.journal_dir = os.path.join(root, JOURNAL_DIR)
+        self.recover()
+        self.migrate()
+
+    # Manifest
+    def load_manifest(self) -> Dict[str, Dict[str, str]]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, "r") as file:
+            return json.load(file)
+
+    def save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def last_date(self, series: str, symbol: str) -> Optional[pd.Timestamp]:
+        last = self.manifest.get(series, {}).get(symbol)
+        return pd.Timestamp(last) if last else None
+
+    def first_date(self, series: str, symbol: str) -> Optional[pd.Timestamp]:
+        # Only the dates of the earliest year's partition are read
+        with self.lock:
+            for partition in self.partitions(series, [symbol]):
+                parts = partition_files(partition)
+                if parts:
+                    return self.read_parts(parts, columns=['date'])['date'].min()
+        return None
+
+    # Layout
+    def series_dir(self, series: str) -> str:
+        return os.path.join(self.root, series)
+
+    def partition_dir(self, series: str, symbol: str, year: int) -> str:
+        return os.path.join(self.series_dir(series), f"symbol={quote(symbol, safe='')}", f"year={year}")
+
+    def partitions(self, series: str, symbols: Optional[List[str]] = None, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None) -> List[str]:
+        # Partition directories of the given symbols whose year overlaps [start, end]; the pruning happens on names only
+        directory = self.series_dir(series)
+        if not os.path.isdir(directory):
+            return []
+        wanted = set(symbols) if symbols is not None else None
+        partitions = []
+        for symbol_dir in sorted(os.listdir(directory)):
+            if not symbol_dir.startswith("symbol=") or (wanted is not None and unquote(symbol_dir[len("symbol="):]) not in wanted):
+                continue
+            for year_dir in sorted(os.listdir(os.path.join(directory, symbol_dir))):
+                if not year_dir.startswith("year="):
+                    continue
+                year = int(year_dir[len("year="):])
+                if (start is None or year >= start.year) and (end is None or year <= end.year):
+                    partitions.append(os.path.join(directory, symbol_dir, year_dir))
+        return partitions
+
+    def part_files(self, series: str) -> List[str]:
+        return [part for partition in self.partitions(series) for part in partition_files(partition)]
+
+    def migrate(self):
+        '''
+        Part files written before the store was partitioned sit directly in the series directory. They are moved into
+        partitions through the journal, so the flat files are only deleted together with the new ones appearing. Rows
+        already stored (by a migration interrupted before it was journaled) are skipped, so migrating twice is harmless.
+        '''
+        for series in os.listdir(self.root):
+            directory = self.series_dir(series)
+            if series.startswith('.') or not os.path.isdir(directory):
+                continue
+            flat_parts = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".parquet"))
+            if not flat_parts:
+                continue
+            df = self.normalise(pd.concat([pd.read_parquet(part) for part in flat_parts], ignore_index=True)).drop_duplicates(subset=['symbol', 'date'], keep='last')
+            df = self.unstored_rows(series, df)
+            self.commit_files(self.stage_partitions(series, df), flat_parts)
+            if not df.empty:
+                self.advance_manifest(series, df)
+
+    # Journal
+    def staging_path(self) -> str:
+        # Files written here are invisible to queries until a journal entry moves them into a partition
+        os.makedirs(self.journal_dir, exist_ok=True)
+        return os.path.join(self.journal_dir, f"{uuid.uuid4().hex}.parquet.tmp")
+
+    def commit_files(self, written: Dict[str, str], removed: List[str]):
+        '''
+        Moves complete staged files (staging path -> final path) into place and deletes the files they replace, as one
+        step that survives interruption: the journal entry is written before anything visible changes.
+        '''
+        entry = {'written': sorted(written.items()), 'removed': sorted(removed)}
+        path = os.path.join(self.journal_dir, f"{uuid.uuid4().hex}.json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(entry, file)
+        os.replace(path + ".tmp", path)
+        self.apply_journal(path)
+
+    def apply_journal(self, path: str):
+        # Idempotent, so an entry that was partly applied before a crash can simply be applied again
+        with open(path, "r") as file:
+            entry = json.load(file)
+        for staged, final in entry['written']:
+            if os.path.exists(staged):
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(staged, final)
+        for part in entry['removed']:
+            if os.path.exists(part):
+                os.remove(part)
+        os.remove(path)
+
+    def recover(self):
+        # Finishes the rewrites a crash interrupted, and drops staged files no journal entry got to refer to
+        if not os.path.isdir(self.journal_dir):
+            return
+        names = sorted(os.listdir(self.journal_dir))
+        for name in names:
+            if name.endswith(".json"):
+                self.apply_journal(os.path.join(self.journal_dir, name))
+        for name in names:
+            if name.endswith(".tmp") and os.path.exists(os.path.join(self.journal_dir, name)):
+                os.remove(os.path.join(self.journal_dir, name))
+
+    # Writing
+
+    def normalise(self, df: pd.DataFrame) -> pd.DataFrame:
+        if 'symbol' not in df or 'date' not in df:
+            raise ValueError("History rows must have 'symbol' and 'date' columns.")
+        df = df.copy()
+        df['date'] = pd.to_datetime(df['date'], utc=True).astype("datetime64[ns, UTC]")
+        df['symbol'] = df['symbol'].astype(str)
+        for column in df.columns:
+            if column in NUMERIC_COLUMNS:
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+            elif column not in ('date', 'symbol'):
+                df[column] = df[column].astype('string')
+        return df
+
+    def append(self, series: str, df: pd.DataFrame) -> int:
+        if df is None or df.empty:
+            return 0
+
+        df = self.normalise(df).drop_duplicates(subset=['symbol', 'date'], keep='last')
+
+        with self.lock:
+            # Only keep rows newer than what is already stored for each symbol
+            last_dates = self.manifest.get(series, {})
+            stored_until = pd.to_datetime(df['symbol'].map(last_dates), utc=True)
+            # Rows written by a run that died before it moved the manifest forward are stored already
+            return self.store_rows(series, self.unstored_rows(series, df[stored_until.isna() | (df['date'] > stored_until)]))
+
+    def backfill(self, series: str, df: pd.DataFrame) -> int:
+        '''
+        Stores rows from any date range, including ones older than the last stored date, which append() skips. Rows
+        whose symbol and date are already stored are dropped, so writing the same range twice is harmless.
+        '''
+        if df is None or df.empty:
+            return 0
+
+        df = self.normalise(df).drop_duplicates(subset=['symbol', 'date'], keep='last')
+
+        with self.lock:
+            return self.store_rows(series, self.unstored_rows(series, df))
+
+    def unstored_rows(self, series: str, df: pd.DataFrame) -> pd.DataFrame:
+        # Rows of a normalised frame whose symbol and date are not in the store yet
+        if df.empty:
+            return df
+        stored = self.query(series, [str(symbol) for symbol in df['symbol'].unique()], start=df['date'].min(), end=df['date'].max(), columns=[])
+        if stored.empty:
+            return df
+        keys = pd.MultiIndex.from_arrays([df['symbol'].astype(str), df['date']])
+        return df[~keys.isin(pd.MultiIndex.from_arrays([stored['symbol'].astype(str), stored['date']]))]
+
+    def store_rows(self, series: str, df: pd.DataFrame) -> int:
+        # Writes rows that are not stored yet and moves the manifest forward. Called with the lock held.
+        if df.empty:
+            return 0
+
+        df = df.sort_values(by=['symbol', 'date'])
+        written = self.stage_partitions(series, df)
+        self.commit_files(written, [])
+        for partition in sorted({os.path.dirname(final) for final in written.values()}):
+            if len(os.listdir(partition)) > MAX_PARTS_PER_PARTITION:
+                self.compact_partition(partition)
+        self.advance_manifest(series, df)
+        return len(df)
+
+    def upsert(self, series: str, df: pd.DataFrame) -> int:
+        '''
+        Stores rows, replacing the stored rows with the same symbol and date. The partitions the rows fall in are
+        rewritten, so this suits small series updated in place, such as the day's FX rate.
+        '''
+        if df is None or df.empty:
+            return 0
+
+        df = self.normalise(df).drop_duplicates(subset=['symbol', 'date'], keep='last')
+        with self.lock:
+            written, removed = {}, []
+            for (symbol, year), rows in df.groupby(['symbol', df['date'].dt.year], sort=False):
+                partition = self.partition_dir(series, symbol, year)
+                parts = partition_files(partition) if os.path.isdir(partition) else []
+                rows = rows.drop(columns=['symbol'])
+                if parts:
+                    stored = self.read_parts(parts)
+                    rows = pd.concat([stored[~stored['date'].isin(rows['date'])], rows], ignore_index=True)
+                staged = self.staging_path()
+                self.write_part(staged, pa.Table.from_pandas(rows, preserve_index=False))
+                written[staged] = os.path.join(partition, part_name())
+                removed.extend(parts)
+            self.commit_files(written, removed)
+            self.advance_manifest(series, df)
+        return len(df)
+
+    def advance_manifest(self, series: str, df: pd.DataFrame):
+        # The manifest only moves forward; called with the lock held
+        series_manifest = self.manifest.setdefault(series, {})
+        for symbol, last in df.groupby('symbol')['date'].max().items():
+            stored_until = self.last_date(series, symbol)
+            if stored_until is None or last > stored_until:
+                series_manifest[symbol] = last.isoformat()
+        self.save_manifest()
+
+    def write_part(self, path: str, table: pa.Table):
+        # Date first and sorted, so every row group's date statistics cover a narrow, ordered range
+        table = table.sort_by('date').select(['date'] + [name for name in table.column_names if name != 'date'])
+        # Written under a temporary name and renamed, so a crash never leaves a truncated part file behind
+        with get_default_metrics().stage('parquet_write'):
+            pq.write_table(table.replace_schema_metadata(None), path + ".tmp", row_group_size=ROW_GROUP_SIZE, write_statistics=True, sorting_columns=[pq.SortingColumn(0)])
+        os.replace(path + ".tmp", path)
+
+    def read_parts(self, parts: List[str], columns: Optional[List[str]] = None) -> pd.DataFrame:
+        # Part files of one partition, without the partition columns pyarrow may add from the path
+        table = pa.concat_tables([pq.read_table(part, columns=columns, memory_map=True, partitioning=None) for part in parts], promote_options='permissive')
+        return table.to_pandas()
+
+    def stage_partitions(self, series: str, df: pd.DataFrame) -> Dict[str, str]:
+        # One new part file per symbol and year in df, staged in the journal: staged file -> final path, for commit_files()
+        written = {}
+        for (symbol, year), rows in df.groupby(['symbol', df['date'].dt.year], sort=False):
+            staged = self.staging_path()
+            self.write_part(staged, pa.Table.from_pandas(rows.drop(columns=['symbol']), preserve_index=False))
+            written[staged] = os.path.join(self.partition_dir(series, symbol, year), part_name())
+        return written
+
+    def compact_partition(self, partition: str):
+        parts = partition_files(partition)
+        if len(parts) <= 1:
+            return
+        tables = [pq.read_table(part, memory_map=True) for part in parts]
+        # Journaled, so a crash can not leave the compacted file next to the parts it holds
+        staged = self.staging_path()
+        self.write_part(staged, pa.concat_tables(tables, promote_options='permissive'))
+        self.commit_files({staged: os.path.join(partition, f"part-compacted-{uuid.uuid4().hex[:8]}.parquet")}, parts)
+
+    def compact(self, series: str):
+        # Merge the part files of every partition of a series into one sorted file per partition
+        with self.lock:
+            for partition in self.partitions(series):
+                self.compact_partition(partition)
+
+    # Reading
+    def query(self, series: str, symbols: Optional[List[str]] = None, start: Optional[Timestamp] = None, end: Optional[Timestamp] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        '''
+        Rows of a series for the given symbols with start <= date <= end (all optional), sorted by symbol and date.
+
+        columns limits the value columns read; symbol and date are always returned.
+        '''
+        start, end = to_utc(start), to_utc(end)
+        with self.lock:
+            return self.read_dataset(series, symbols, start, end, columns)
+
+    def read_dataset(self, series: str, symbols: Optional[List[str]], start: Optional[pd.Timestamp], end: Optional[pd.Timestamp], columns: Optional[List[str]]) -> pd.DataFrame:
+        # The part files are listed and read in one go, so a concurrent rewrite can not remove them in between
+        parts = [part for partition in self.partitions(series, symbols, start, end) for part in partition_files(partition)]
+        if not parts:
+            return pd.DataFrame()
+
+        # Parts written at different times can differ in their columns, so the dataset gets the union of their schemas
+        schema = pa.unify_schemas([pq.read_schema(part, memory_map=True).remove_metadata() for part in parts] + [PARTITIONING.schema], promote_options='permissive')
+        base_dir = os.path.abspath(self.series_dir(series))
+        dataset = ds.dataset([os.path.abspath(part) for part in parts], schema=schema, format='parquet', filesystem=self.filesystem, partitioning=PARTITIONING, partition_base_dir=base_dir)
+
+        condition = None
+        if start is not None:
+            condition = ds.field('date') >= pa.scalar(start, type=schema.field('date').type)
+        if end is not None:
+            before_end = ds.field('date') <= pa.scalar(end, type=schema.field('date').type)
+            condition = before_end if condition is None else condition & before_end
+        names = ['symbol', 'date'] + [name for name in (columns if columns is not None else schema.names) if name in schema.names and name not in ('symbol', 'date', 'year')]
+
+        with get_default_metrics().stage('parquet_read'):
+            data = dataset.to_table(columns=names, filter=condition).to_pandas()
+        # A (symbol, date) is stored once; duplicates left by older versions of the store must not reach the callers
+        return data.drop_duplicates(subset=['symbol', 'date'], keep='last').sort_values(by=['symbol', 'date']).reset_index(drop=True)
+
+    def read(self, series: str) -> pd.DataFrame:
+        return self.query(series)
+
+    def latest(self, series: str, symbol: str) -> Optional[pd.Series]:
+        # The manifest knows the newest date, so only the row group holding it is read
+        data = self.query(series, [symbol], start=self.last_date(series, symbol))
+        if data.empty:
+            return None
+        return marketstack.latest_bar(data)
+
+    # Delta fetching
+    def delta_start(self, series: str, symbol: str, initial_days: int = DEFAULT_INITIAL_DAYS) -> str:
+        last = self.last_date(series, symbol)
+        if last is None:
+            start = datetime.now(timezone.utc).date() - timedelta(days=initial_days)
+        else:
+            start = last.date() + timedelta(days=1)
+        return start.strftime("%Y-%m-%d")
+
+    def update_eod(self, series_symbols: Dict[str, str], initial_days: int = DEFAULT_INITIAL_DAYS) -> Dict[str, pd.DataFrame]:
+        # Fetch only the bars after the last stored date for every series, using one batched EndOfDay request.
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        date_from = min(self.delta_start(series, symbol, initial_days) for series, symbol in series_symbols.items())
+        if date_from > today:
+            return {series: pd.DataFrame() for series in series_symbols}
+
+        frames = marketstack.EndOfDay.batch(list(series_symbols.values()), date_from=date_from, date_to=today)
+        new_rows = {}
+        for series, symbol in series_symbols.items():
+            self.append(series, frames[symbol])
+            new_rows[series] = frames[symbol]
+        return new_rows
+
+    def record_rate(self, series: str, symbol: str, rate: float, date: Optional[datetime] = None):
+        # One row per day holding the day's latest rate, so every poll after the first one of the day updates it
+        date = date or datetime.now(timezone.utc)
+        row = pd.DataFrame([{'symbol': symbol, 'date': date.strftime("%Y-%m-%d"), 'rate': rate}])
+        return self.upsert(series, row)
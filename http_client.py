@@ -0,0 +1,96 @@
+'''
+Shared HTTP transport used by marketstack.py and the tracker.
+
+A Transport keeps one keep-alive connection pool per host, applies connect/read timeouts to every request and retries
+429/5xx responses and dropped connections with jittered exponential backoff. Callers can pass their own Transport, or
+use the process wide default returned by get_default_transport().
+'''
+
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class Transport:
+    def __init__(self, connect_timeout: float = 3.05, read_timeout: float = 15.0, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0, pool_connections: int = 10, pool_maxsize: int = 10, session: Optional[requests.Session] = None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = session or requests.Session()
+        #Retries are handled in get() so they can be jittered and can honour Retry-After.
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def backoff(self, attempt: int) -> float:
+        #"Full jitter" backoff, so several workers retrying at once don't hit the API in lockstep.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def retry_delay(self, response: requests.Response, attempt: int) -> float:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(self.backoff_max, float(retry_after))
+        return self.backoff(attempt)
+
+    def get(self, url: str, params: Optional[dict] = None, before_attempt: Optional[Callable[[], object]] = None, **kwargs) -> requests.Response:
+        #before_attempt is called before every attempt, retries included, e.g. to count each one against the request budget.
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if before_attempt is not None:
+                before_attempt()
+            try:
+                response = self.session.get(url, params=params, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                #Recorded by the metrics layer
+                response.retries = attempt
+                return response
+
+            delay = self.retry_delay(response, attempt)
+            response.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_default_transport: Optional[Transport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> Transport:
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+
+def set_default_transport(transport: Transport):
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
@@ -20,6 +20,13 @@ def set_api_key(api_key):
 
     os.environ['MARKETSTACK_API_KEY'] = api_key
 
+marketstack_base_url = os.getenv("MARKETSTACK_BASE_URL", "http://api.marketstack.com/v1/")
+
+def set_base_url(base_url):
+    #Points the client at another server, e.g. the local stub server used by the benchmarks.
+    global marketstack_base_url
+    marketstack_base_url = base_url if base_url.endswith('/') else base_url + '/'
+
 '''
 ########################################################################################################################
 Don't touch anything beneath this line. All you need to do is add your API Key to your environment variables.
@@ -28,24 +35,132 @@ Don't touch anything beneath this line. All you need to do is add your API Key t
 
 #TODO - Add chainable function calls for the features 
 
+import json
 import requests
-import pandas as pd
-from typing import Optional, List, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Optional, List, Union, Iterator, Tuple, Dict
 from datetime import datetime
 
+#numpy and pandas are only imported by the functions that build DataFrames, so fetching a few rows with get_data() stays cheap to start up.
+if TYPE_CHECKING:
+    import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from http_client import Transport, get_default_transport
+from metrics import get_default_metrics
+from quota import get_default_budget
+from response_cache import ResponseCache, get_default_cache
+
 ARG_EXCEPTIONS = ['self', '__class__']
 
+# Number of pages fetched at the same time when traversing a paginated response.
+DEFAULT_MAX_WORKERS = 4
+# Marketstack accepts at most this many comma separated symbols in a single request.
+MAX_SYMBOLS_PER_REQUEST = 100
+
+#Column types used when decoding price rows. Columns not listed here are left as they come.
+FLOAT_COLUMNS = {'open', 'high', 'low', 'close', 'last', 'adj_open', 'adj_high', 'adj_low', 'adj_close', 'split_factor', 'dividend', 'mid', 'ask_price', 'bid_price'}
+INT_COLUMNS = {'volume', 'adj_volume', 'ask_size', 'bid_size'}
+CATEGORY_COLUMNS = {'symbol', 'exchange'}
+DATE_COLUMNS = {'date'}
+#Bar sizes accepted by the intraday endpoint.
+INTRADAY_INTERVALS = ['1min', '5min', '10min', '15min', '30min', '1hour', '3hour', '6hour', '12hour', '24hour']
+
 def prep_args(args:dict, only_keys:List[str] =None):
     if only_keys:
         return {key: value for key, value in args.items() if key in only_keys and key not in ARG_EXCEPTIONS}
     else:
         return {key: value for key, value in args.items() if key not in ARG_EXCEPTIONS}
 
+def remaining_offsets(first_response: dict, max_pages: Optional[int] = None) -> Tuple[int, List[int]]:
+    #Works out the page size and the offsets still to fetch after the first page of a paginated response.
+    pagination = first_response['pagination']
+    if not isinstance(first_response.get('data'), list):
+        return 0, []
+
+    first_offset = int(pagination.get('offset') or 0)
+    page_size = int(pagination.get('limit') or len(first_response['data']) or 1)
+    total = int(pagination.get('total') or 0)
+    offsets = list(range(first_offset + page_size, total, page_size))
+    if max_pages is not None:
+        offsets = offsets[:max(max_pages - 1, 0)]
+    return page_size, offsets
+
+def loads(body: bytes):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+def parse_dates(values: List[str]) -> 'pd.DatetimeIndex':
+    import numpy as np
+    import pandas as pd
+
+    #Marketstack dates are always UTC ("2024-05-10T00:00:00+0000"), which NumPy parses several times faster than pandas once the offset is cut off.
+    if values and all(isinstance(value, str) and value.endswith('+0000') for value in values):
+        return pd.DatetimeIndex(np.array([value[:19] for value in values], dtype='datetime64[ns]')).tz_localize('UTC')
+    return pd.to_datetime(values, format='ISO8601', utc=True)
+
+def decode_frame(rows: List[dict]) -> 'pd.DataFrame':
+    #Builds typed columns straight from the API rows instead of going through pd.DataFrame(list_of_dicts) and converting afterwards.
+    import numpy as np
+    import pandas as pd
+
+    if not rows:
+        return pd.DataFrame()
+
+    with get_default_metrics().stage('decode'):
+        #Optional fields such as dividend or split_factor may only be present in some rows
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        data = {}
+        for column in columns:
+            values = [row.get(column) for row in rows]
+            if column in FLOAT_COLUMNS:
+                data[column] = np.array(values, dtype='float64')
+            elif column in INT_COLUMNS:
+                numbers = np.array(values, dtype='float64')
+                data[column] = numbers.astype('int64') if not np.isnan(numbers).any() else pd.array(numbers, dtype='Int64')
+            elif column in DATE_COLUMNS:
+                data[column] = parse_dates(values)
+            elif column in CATEGORY_COLUMNS:
+                data[column] = pd.Categorical(values)
+            else:
+                data[column] = values
+        return pd.DataFrame(data)
+
+def latest_bar(df: 'pd.DataFrame') -> Optional['pd.Series']:
+    #Newest row of a price frame in one O(n) pass, without sorting. Positional, so a repeated index still gives one row.
+    if df.empty:
+        return None
+    return df.iloc[df['date'].argmax()]
+
+def latest_bars(df: 'pd.DataFrame') -> 'pd.DataFrame':
+    #Newest row per symbol, without sorting.
+    if df.empty:
+        return df
+    dates = df['date'].reset_index(drop=True)
+    return df.iloc[dates.groupby(df['symbol'].to_numpy()).idxmax().to_numpy()].reset_index(drop=True)
+
+def split_by_symbol(frames: List['pd.DataFrame'], symbols: List[str]) -> Dict[str, 'pd.DataFrame']:
+    #Splits the frames of a multi-symbol request into one date sorted frame per requested symbol.
+    import pandas as pd
+
+    data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if data.empty or 'symbol' not in data:
+        return {symbol: pd.DataFrame() for symbol in symbols}
+
+    grouped = {str(symbol): frame.sort_values(by='date').reset_index(drop=True) for symbol, frame in data.groupby('symbol', sort=False, observed=True)}
+    return {symbol: grouped.get(symbol, pd.DataFrame()) for symbol in symbols}
+
 class MarketStack:
-    def __init__(self, endpoint: str, symbols: Optional[str] = None, exchange: Optional[str] = None, sort: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, limit: Optional[str] = None, offset: Optional[str] = None, search: Optional[str] = None):
-        self.base_url = "http://api.marketstack.com/v1/"
-        self.url = f"http://api.marketstack.com/v1/{self.validate_endpoint(endpoint)}"
+    def __init__(self, endpoint: str, symbols: Optional[str] = None, exchange: Optional[str] = None, sort: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, limit: Optional[str] = None, offset: Optional[str] = None, search: Optional[str] = None, interval: Optional[str] = None):
+        self.base_url = marketstack_base_url
+        self.url = f"{self.base_url}{self.validate_endpoint(endpoint)}"
         self.endpoint = endpoint
+        self.transport: Optional[Transport] = None
+        self.cache: Optional[ResponseCache] = None
+        self.priority: Optional[str] = None
         #define parameters for API call. Making sure the API Key is always included.
         self.params = {
             'access_key': marketstack_api_key
@@ -77,6 +192,8 @@ class MarketStack:
             self.params['offset'] = self.validate_offset(offset)
         if search:
             self.params['search'] = self.validate_search(search)
+        if interval:
+            self.params['interval'] = self.validate_interval(interval)
 
     #Feature Functions
     def latest(self):
@@ -106,6 +223,24 @@ class MarketStack:
         else:
             raise ValueError(f'Endpoint Feature: "{feature}" is not supported for the "{self.endpoint}" endpoint.')
 
+    def with_transport(self, transport: Transport):
+        self.transport = transport
+        return self
+
+    def with_cache(self, cache: ResponseCache):
+        self.cache = cache
+        return self
+
+    def with_priority(self, priority: str):
+        #Priority used by the request budget: 'high', 'normal' or 'low'. Latest quotes default to 'high'.
+        self.priority = priority
+        return self
+
+    def request_priority(self):
+        if self.priority:
+            return self.priority
+        return 'high' if self.url.endswith('/latest') else 'normal'
+
     #Helpers
     def reset_url(self):
         self.url = self.base_url + self.validate_endpoint(self.endpoint)
@@ -147,6 +282,11 @@ class MarketStack:
             raise ValueError("Sort parameter must be 'asc' or 'desc'.")
         return sort
 
+    def validate_interval(self, interval):
+        if interval not in INTRADAY_INTERVALS:
+            raise ValueError(f"Interval parameter must be one of {INTRADAY_INTERVALS}.")
+        return interval
+
     def validate_limit(self, limit):
         if not 1 <= limit <= 1000:
             raise ValueError("Limit parameter must be between 1 and 1000.")
@@ -158,17 +298,34 @@ class MarketStack:
         return offset
         
     def validate_search(self, search):
-        searchable_endpoints = ["tickers", "exchange"]
+        searchable_endpoints = ["tickers", "exchanges"]
         if self.endpoint not in searchable_endpoints:
             raise ValueError(f'Search is not supported for the "{self.endpoint}" endpoint. Search is only supported for the following endpoints: {searchable_endpoints}')
-        self.params['search'] = search
+        return search
 
     
     #Request Functions
-    def request(self):
+    def request(self, params: Optional[dict] = None):
         assert marketstack_api_key != "YOUR_API_KEY", "Please update your API Key."
-        response = requests.get(self.url, self.params)
-        return response
+        params = self.params if params is None else params
+        transport = self.transport or get_default_transport()
+        cache = self.cache or get_default_cache()
+        budget = get_default_budget()
+
+        def acquire():
+            budget.acquire('marketstack', marketstack_api_key, self.request_priority())
+
+        def send():
+            #Only requests that actually reach the API count against the quota, cache hits are free. Every retry counts.
+            return transport.get(self.url, params, before_attempt=acquire if budget is not None else None)
+
+        fetch = send if cache is None else lambda: cache.fetch(self.url, params, send)
+        return get_default_metrics().instrument('marketstack', self.metrics_endpoint(), fetch, cached=cache is not None)
+
+    def metrics_endpoint(self) -> str:
+        #Endpoint label for the metrics, with symbols and dates in the path replaced so the number of labels stays small.
+        segments = [segment for segment in self.url[len(self.base_url):].split('/') if segment]
+        return '/'.join(segment if index == 0 or segment in self.feature_support or segment == 'latest' else ':param' for index, segment in enumerate(segments))
     
     def get_http_response_code(self):
         api_response = self.request()
@@ -178,29 +335,72 @@ class MarketStack:
         api_response = self.request()
         return api_response.json()
 
-    def get_data(self):
+    def fetch_json(self, params: Optional[dict] = None):
         try:
-            raw_response = self.request()
+            raw_response = self.request(params)
             raw_response.raise_for_status()  # Raises an HTTPError if the status is 4xx, 5xx
         except requests.exceptions.HTTPError as http_err:
-            api_response = raw_response.json()
+            api_response = loads(raw_response.content)
             error_message = f"HTTP error occurred: {http_err} - {api_response.get('error', {}).get('message', 'No error message')}"
             raise ValueError(error_message) from http_err
         except requests.exceptions.RequestException as err:
             # Handle random errors
             raise SystemExit(f"Request error occurred: {err}") from err
 
-        api_response = raw_response.json()
+        return loads(raw_response.content)
+
+    def iter_offset_pages(self, max_workers: int = DEFAULT_MAX_WORKERS, max_pages: Optional[int] = None) -> Iterator[Tuple[int, list]]:
+        api_response = self.fetch_json()
+        if not api_response.get('pagination'):
+            yield 0, [api_response]
+            return
+
+        yield int(api_response['pagination'].get('offset') or 0), api_response['data']
+        yield from self.__iter_remaining_pages(api_response, max_workers, max_pages)
+
+    def iter_pages(self, max_workers: int = DEFAULT_MAX_WORKERS, max_pages: Optional[int] = None) -> Iterator[list]:
+        for _, page in self.iter_offset_pages(max_workers, max_pages):
+            yield page
+
+    def iter_rows(self, max_workers: int = DEFAULT_MAX_WORKERS, max_pages: Optional[int] = None) -> Iterator[dict]:
+        for page in self.iter_pages(max_workers, max_pages):
+            yield from page
+
+    def get_data(self, paginate: bool = True, max_workers: int = DEFAULT_MAX_WORKERS):
+        api_response = self.fetch_json()
 
         #Check for pagination key in response. If it exists, the 'data' key will be a list of dictionaries. If not the response will just be the one dictionary.
-        if api_response.get('pagination'):
-            #TODO - Add support for pagination traversal
+        if not api_response.get('pagination'):
+            return api_response
+        if not paginate:
             return api_response['data']
-        
-        return api_response
-    
-    def get_data_df(self):
-        data = self.get_data()
+
+        pages = dict(self.__iter_remaining_pages(api_response, max_workers))
+        pages[int(api_response['pagination'].get('offset') or 0)] = api_response['data']
+
+        #Pages arrive out of order, so they are put back in offset order before being flattened.
+        return [row for offset in sorted(pages) for row in pages[offset]]
+
+    def __iter_remaining_pages(self, first_response: dict, max_workers: int, max_pages: Optional[int] = None) -> Iterator[Tuple[int, list]]:
+        #The first page tells us how many rows there are in total. The remaining offsets are fetched concurrently and yielded as they arrive.
+        page_size, offsets = remaining_offsets(first_response, max_pages)
+        if not offsets:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(offsets))))
+        try:
+            futures = {executor.submit(self.fetch_json, {**self.params, 'limit': page_size, 'offset': offset}): offset for offset in offsets}
+            for future in as_completed(futures):
+                yield futures[future], future.result().get('data', [])
+        finally:
+            #Stop outstanding requests if the consumer stops iterating early.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_data_df(self, paginate: bool = True, max_workers: int = DEFAULT_MAX_WORKERS):
+        data = self.get_data(paginate, max_workers)
+        if isinstance(data, list):
+            return decode_frame(data)
+        import pandas as pd
         df = pd.DataFrame(data)
         return df
 
@@ -210,8 +410,27 @@ class EndOfDay(MarketStack):
         args = prep_args(locals())
         super().__init__('eod', **args)
 
+    @classmethod
+    def batch_queries(cls, symbols: List[str], latest: bool = False, exchange: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List['EndOfDay']:
+        queries = []
+        for start in range(0, len(symbols), MAX_SYMBOLS_PER_REQUEST):
+            chunk = ','.join(symbols[start:start + MAX_SYMBOLS_PER_REQUEST])
+            if latest:
+                queries.append(cls(chunk, exchange=exchange).latest())
+            else:
+                queries.append(cls(chunk, exchange=exchange, date_from=date_from, date_to=date_to, limit=1000))
+        return queries
+
+    @classmethod
+    def batch(cls, symbols: List[str], latest: bool = False, exchange: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, 'pd.DataFrame']:
+        #Fetch several symbols with as few requests as possible and split the result into one date sorted frame per symbol.
+        symbols = list(dict.fromkeys(symbols))
+        frames = [query.get_data_df(max_workers=max_workers) for query in cls.batch_queries(symbols, latest, exchange, date_from, date_to)]
+
+        return split_by_symbol(frames, symbols)
+
 class Intraday(MarketStack):
-    def __init__(self, symbols: str, exchange: Optional[str] = None, sort: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, limit: Optional[str] = None, offset: Optional[str] = None):
+    def __init__(self, symbols: str, exchange: Optional[str] = None, sort: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, limit: Optional[str] = None, offset: Optional[str] = None, interval: Optional[str] = None):
         args = prep_args(locals())
         super().__init__('intraday', **args)
 
@@ -0,0 +1,253 @@
+'''
+Async counterpart of the marketstack.py client.
+
+The classes keep the same builder API as their synchronous versions (.latest(), .historical(), .symbol().eod(), ...),
+only get_data and get_data_df are awaitable. All requests go through one AsyncClient, which owns a single aiohttp
+connection pool and a semaphore limiting how many requests are in flight at once, so hundreds of queries can be fanned
+out from one event loop:
+
+    async with AsyncClient(max_concurrency=20) as client:
+        frames = await asyncio.gather(*(AsyncEndOfDay(symbol).with_client(client).latest().get_data_df() for symbol in symbols))
+'''
+
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import aiohttp
+import pandas as pd
+
+import marketstack
+from http_client import RETRY_STATUS_CODES
+from marketstack import Currencies, Dividends, EndOfDay, Exchanges, Intraday, Splits, Tickers, TimeZones, decode_frame, loads, remaining_offsets, split_by_symbol
+from metrics import get_default_metrics
+from quota import get_default_budget
+
+
+class AsyncClient:
+    def __init__(self, max_concurrency: int = 10, connect_timeout: float = 3.05, read_timeout: float = 15.0, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0, limit_per_host: int = 0):
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limit_per_host = limit_per_host
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.closer: Optional[asyncio.Task] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        #The session and the semaphore belong to the event loop they were created in, so a client used again from a
+        #later asyncio.run() starts new ones instead of failing on the closed loop.
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.loop is not loop:
+            self.release_session()
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.limit_per_host)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.loop = loop
+            self.closer = loop.create_task(self.close_with_loop(self.session))
+        return self.session
+
+    @staticmethod
+    async def close_with_loop(session: aiohttp.ClientSession):
+        #asyncio.run() cancels the tasks still pending when its coroutine returns, so this closes the session while
+        #its loop is still running, instead of leaving it to be garbage collected with its connections open.
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await session.close()
+
+    def release_session(self):
+        #A session left over from another event loop is closed in that loop if it still runs (in another thread);
+        #otherwise it was closed by close_with_loop when its loop finished.
+        session, loop = self.session, self.loop
+        self.session = self.semaphore = self.loop = self.closer = None
+        if session is None or session.closed or loop is None or loop.is_closed():
+            return
+        if loop.is_running() and loop is not asyncio.get_running_loop():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def get_json(self, url: str, params: Optional[dict] = None, endpoint: Optional[str] = None, before_attempt: Optional[Callable[[], object]] = None):
+        #Returns (status, payload). 429/5xx responses and dropped connections are retried with jittered backoff.
+        #Requests are recorded in the metrics under `endpoint` when one is given. before_attempt is called (in a worker
+        #thread, as it may block on a file lock) before every attempt, like Transport.get's.
+        params = {name: str(value) for name, value in (params or {}).items()}
+        metrics = get_default_metrics() if endpoint else None
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            if before_attempt is not None:
+                await asyncio.to_thread(before_attempt)
+            try:
+                session = self.get_session()
+                async with self.semaphore:
+                    async with session.get(url, params=params) as response:
+                        status = response.status
+                        body = await response.read()
+                        payload = loads(body)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                if attempt == self.max_retries:
+                    if metrics:
+                        metrics.observe_request('marketstack', endpoint, time.perf_counter() - start, retries=attempt, error=err)
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            if status not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                if metrics:
+                    metrics.observe_request('marketstack', endpoint, time.perf_counter() - start, status=status, size=len(body), retries=attempt)
+                return status, payload
+            await asyncio.sleep(self.backoff(attempt))
+
+    async def close(self):
+        session, closer = self.session, self.closer
+        self.session = self.semaphore = self.loop = self.closer = None
+        if closer is not None:
+            closer.cancel()
+        if session is not None:
+            await session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_default_client: Optional[AsyncClient] = None
+
+
+def get_default_client() -> AsyncClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = AsyncClient()
+    return _default_client
+
+
+def set_default_client(client: AsyncClient):
+    global _default_client
+    _default_client = client
+
+
+class AsyncMarketStackMixin:
+    client: Optional[AsyncClient] = None
+
+    def with_client(self, client: AsyncClient):
+        self.client = client
+        return self
+
+    #The synchronous request functions inherited from MarketStack would bypass the client
+    def request(self, params: Optional[dict] = None):
+        raise TypeError(f"{type(self).__name__} is asynchronous; use await .fetch_json() or .get_data().")
+
+    def iter_offset_pages(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} is asynchronous; use async for ... in .iter_pages().")
+
+    def budget_hook(self) -> Optional[Callable[[], None]]:
+        #Every attempt counts against the request budget, as in MarketStack.request()
+        budget = get_default_budget()
+        if budget is None:
+            return None
+        return lambda: budget.acquire('marketstack', marketstack.marketstack_api_key, self.request_priority())
+
+    #Request Functions
+    async def fetch_json(self, params: Optional[dict] = None):
+        assert marketstack.marketstack_api_key != "YOUR_API_KEY", "Please update your API Key."
+        client = self.client or get_default_client()
+        try:
+            status, api_response = await client.get_json(self.url, self.params if params is None else params, self.metrics_endpoint(), self.budget_hook())
+        except aiohttp.ClientError as err:
+            raise SystemExit(f"Request error occurred: {err}") from err
+
+        if status >= 400:
+            error = api_response.get('error', {}) if isinstance(api_response, dict) else {}
+            raise ValueError(f"HTTP error occurred: {status} - {error.get('message', 'No error message')}")
+        return api_response
+
+    async def get_http_response_code(self):
+        client = self.client or get_default_client()
+        status, _ = await client.get_json(self.url, self.params, before_attempt=self.budget_hook())
+        return status
+
+    async def get_api_response(self):
+        client = self.client or get_default_client()
+        _, api_response = await client.get_json(self.url, self.params, before_attempt=self.budget_hook())
+        return api_response
+
+    async def iter_pages(self, max_pages: Optional[int] = None) -> AsyncIterator[list]:
+        api_response = await self.fetch_json()
+        if not api_response.get('pagination'):
+            yield [api_response]
+            return
+
+        yield api_response['data']
+        page_size, offsets = remaining_offsets(api_response, max_pages)
+        tasks = [asyncio.ensure_future(self.fetch_json({**self.params, 'limit': page_size, 'offset': offset})) for offset in offsets]
+        try:
+            for page in asyncio.as_completed(tasks):
+                yield (await page).get('data', [])
+        finally:
+            #A consumer that stops early leaves pages in flight; they are cancelled rather than left running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def iter_rows(self, max_pages: Optional[int] = None) -> AsyncIterator[dict]:
+        async for page in self.iter_pages(max_pages):
+            for row in page:
+                yield row
+
+    async def get_data(self, paginate: bool = True):
+        api_response = await self.fetch_json()
+
+        #Check for pagination key in response. If it exists, the 'data' key will be a list of dictionaries. If not the response will just be the one dictionary.
+        if not api_response.get('pagination'):
+            return api_response
+        if not paginate:
+            return api_response['data']
+
+        page_size, offsets = remaining_offsets(api_response, None)
+        pages = await asyncio.gather(*(self.fetch_json({**self.params, 'limit': page_size, 'offset': offset}) for offset in offsets))
+        return api_response['data'] + [row for page in pages for row in page.get('data', [])]
+
+    async def get_data_df(self, paginate: bool = True):
+        data = await self.get_data(paginate)
+        if isinstance(data, list):
+            return decode_frame(data)
+        df = pd.DataFrame(data)
+        return df
+
+
+class AsyncEndOfDay(AsyncMarketStackMixin, EndOfDay):
+    @classmethod
+    async def batch(cls, symbols: List[str], latest: bool = False, exchange: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, client: Optional[AsyncClient] = None) -> Dict[str, pd.DataFrame]:
+        symbols = list(dict.fromkeys(symbols))
+        queries = cls.batch_queries(symbols, latest, exchange, date_from, date_to)
+        frames = await asyncio.gather(*(query.with_client(client or get_default_client()).get_data_df() for query in queries))
+        return split_by_symbol(list(frames), symbols)
+
+class AsyncIntraday(AsyncMarketStackMixin, Intraday):
+    pass
+
+class AsyncSplits(AsyncMarketStackMixin, Splits):
+    pass
+
+class AsyncDividends(AsyncMarketStackMixin, Dividends):
+    pass
+
+class AsyncCurrencies(AsyncMarketStackMixin, Currencies):
+    pass
+
+class AsyncTimeZones(AsyncMarketStackMixin, TimeZones):
+    pass
+
+class AsyncTickers(AsyncMarketStackMixin, Tickers):
+    pass
+
+class AsyncExchanges(AsyncMarketStackMixin, Exchanges):
+    pass
@@ -0,0 +1,183 @@
+'''
+metalpriceapi client: every FX rate and spot metal price the tracker follows from one request.
+
+The `latest` endpoint returns the rates of any number of currencies against one base currency, and spot metals are
+quoted as currencies (XAU, XAG, XPT, XPD in troy ounces). latest_rates() takes the pairs wanted, asks for all of their
+currencies against USD in a single request and derives each pair from it, so USDINR, USDEUR and XAUUSD cost one
+request together instead of one /convert request each:
+
+    rates = latest_rates(["USDINR", "USDEUR", "XAUUSD"], api_key)
+    rates["XAUUSD"]             # 2358.49 (USD per ounce of gold)
+    record_rates(store, rates, {"USDINR": "USD to INR"})
+
+historical_rates() seeds past rates from the `timeframe` endpoint, one row per pair and day, at most
+TIMEFRAME_MAX_DAYS days per request.
+'''
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Union
+
+from http_client import Transport, get_default_transport
+from metrics import get_default_metrics
+from quota import get_default_budget
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from history import HistoryStore
+
+DEFAULT_BASE_URL = "https://api.metalpriceapi.com/v1/"
+# Every pair is derived from the rates against this currency
+BASE_CURRENCY = "USD"
+METALS = {'XAU': "Gold", 'XAG': "Silver", 'XPT': "Platinum", 'XPD': "Palladium"}
+# Longest date range one `timeframe` request may cover
+TIMEFRAME_MAX_DAYS = 365
+
+metalpriceapi_base_url = DEFAULT_BASE_URL
+
+
+def set_base_url(base_url: str):
+    # Points the client at another server, e.g. the local stub server
+    global metalpriceapi_base_url
+    metalpriceapi_base_url = base_url.rstrip('/') + '/'
+
+
+def split_pair(symbol: str) -> tuple:
+    # "USDINR" -> ("USD", "INR"): the price of one USD in INR
+    if len(symbol) != 6 or not symbol.isalpha():
+        raise ValueError(f"{symbol} is not a currency pair such as USDINR or XAUUSD.")
+    return symbol[:3].upper(), symbol[3:].upper()
+
+
+def series_name(symbol: str) -> str:
+    # History store series of pairs nobody configured a series for: "USD to EUR", "Gold spot (USD)"
+    base, quote = split_pair(symbol)
+    if base in METALS:
+        return f"{METALS[base]} spot ({quote})"
+    return f"{base} to {quote}"
+
+
+@dataclass(frozen=True)
+class Rate:
+    symbol: str
+    base: str
+    quote: str
+    # Units of quote per unit of base
+    rate: float
+    date: datetime
+
+    @property
+    def is_metal(self) -> bool:
+        return self.base in METALS or self.quote in METALS
+
+
+@dataclass(frozen=True)
+class Rates:
+    # The pairs derived from one `latest` response, all as of its timestamp
+    date: datetime
+    rates: Dict[str, Rate] = field(default_factory=dict)
+
+    def __getitem__(self, symbol: str) -> float:
+        return self.rates[symbol].rate
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.rates
+
+    def __iter__(self):
+        return iter(self.rates.values())
+
+    def __len__(self) -> int:
+        return len(self.rates)
+
+    def get(self, symbol: str, default: Optional[float] = None) -> Optional[float]:
+        return self.rates[symbol].rate if symbol in self.rates else default
+
+    def prices(self) -> Dict[str, float]:
+        return {symbol: rate.rate for symbol, rate in self.rates.items()}
+
+
+def budget_hook(api_key: str, priority: str):
+    # Counts every attempt of a request, retries included, against the metalpriceapi budget
+    budget = get_default_budget()
+    if budget is None:
+        return None
+    return lambda: budget.acquire('metalpriceapi', api_key, priority)
+
+
+def fetch(endpoint: str, params: dict, api_key: str, priority: str, transport: Optional[Transport] = None) -> dict:
+    url = metalpriceapi_base_url + endpoint
+    params = {'api_key': api_key, **params}
+    response = get_default_metrics().instrument('metalpriceapi', endpoint, lambda: (transport or get_default_transport()).get(url, params=params, before_attempt=budget_hook(api_key, priority)))
+    data = response.json()
+    if response.status_code != 200 or not data.get('success') or 'rates' not in data:
+        raise ValueError(f"metalpriceapi error: {data.get('error', data)}")
+    return data
+
+
+def fetch_latest(api_key: str, currencies: Iterable[str], base: str = BASE_CURRENCY, priority: str = 'high', transport: Optional[Transport] = None) -> dict:
+    # The raw `latest` response: {"success": true, "base": "USD", "timestamp": ..., "rates": {"INR": 83.52, ...}}
+    return fetch("latest", {'base': base, 'currencies': ','.join(sorted(set(currencies)))}, api_key, priority, transport)
+
+
+def fetch_timeframe(api_key: str, currencies: Iterable[str], start_date: str, end_date: str, base: str = BASE_CURRENCY, priority: str = 'low', transport: Optional[Transport] = None) -> dict:
+    # The raw `timeframe` response: {"success": true, "base": "USD", "rates": {"2024-05-10": {"INR": 83.52, ...}, ...}}
+    params = {'base': base, 'currencies': ','.join(sorted(set(currencies))), 'start_date': start_date, 'end_date': end_date}
+    return fetch("timeframe", params, api_key, priority, transport)
+
+
+def derive_pairs(base: str, quoted: Dict[str, float], symbols: Iterable[str], date: datetime) -> Dict[str, Rate]:
+    # Derives each pair from the rates against base: price of A in B = rate(B) / rate(A)
+    against_base = {base: 1.0, **{currency: value for currency, value in quoted.items() if len(currency) == 3 and value}}
+    rates = {}
+    for symbol in symbols:
+        pair_base, quote = split_pair(symbol)
+        if pair_base in against_base and quote in against_base:
+            rates[symbol] = Rate(symbol, pair_base, quote, against_base[quote] / against_base[pair_base], date)
+    return rates
+
+
+def parse_rates(data: dict, symbols: Iterable[str]) -> Rates:
+    date = datetime.fromtimestamp(data['timestamp'], timezone.utc) if data.get('timestamp') else datetime.now(timezone.utc)
+    return Rates(date, derive_pairs(data.get('base', BASE_CURRENCY), data['rates'], symbols, date))
+
+
+def latest_rates(symbols: Iterable[str], api_key: str, priority: str = 'high', transport: Optional[Transport] = None) -> Rates:
+    '''
+    Latest rate of every pair in symbols (e.g. USDINR, XAUUSD) from one `latest` request. Pairs the response has no
+    rates for are left out of the result.
+    '''
+    symbols = list(dict.fromkeys(symbols))
+    currencies = {currency for symbol in symbols for currency in split_pair(symbol)} - {BASE_CURRENCY}
+    if not currencies:
+        return Rates(datetime.now(timezone.utc))
+    return parse_rates(fetch_latest(api_key, currencies, priority=priority, transport=transport), symbols)
+
+
+def historical_rates(symbols: Iterable[str], api_key: str, start: Union[str, datetime], end: Union[str, datetime], priority: str = 'low', transport: Optional[Transport] = None) -> 'pd.DataFrame':
+    '''
+    Daily rate of every pair in symbols from start to end (both inclusive, at most TIMEFRAME_MAX_DAYS days apart) from
+    one `timeframe` request. Returns symbol, date (UTC midnight) and rate, like record_rates() stores them.
+    '''
+    import pandas as pd
+
+    symbols = list(dict.fromkeys(symbols))
+    currencies = {currency for symbol in symbols for currency in split_pair(symbol)} - {BASE_CURRENCY}
+    start, end = (value if isinstance(value, str) else value.strftime("%Y-%m-%d") for value in (start, end))
+    if not currencies:
+        return pd.DataFrame(columns=['symbol', 'date', 'rate'])
+    data = fetch_timeframe(api_key, currencies, start[:10], end[:10], priority=priority, transport=transport)
+    base = data.get('base', BASE_CURRENCY)
+    rows = []
+    for day, quoted in sorted(data['rates'].items()):
+        date = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        rows.extend({'symbol': rate.symbol, 'date': date, 'rate': rate.rate} for rate in derive_pairs(base, quoted or {}, symbols, date).values())
+    return pd.DataFrame(rows, columns=['symbol', 'date', 'rate'])
+
+
+def record_rates(store: 'HistoryStore', rates: Rates, series: Optional[Dict[str, str]] = None) -> int:
+    # Records every rate in its series (from `series`, else series_name()); one row per pair and day
+    written = 0
+    for rate in rates:
+        written += store.record_rate((series or {}).get(rate.symbol) or series_name(rate.symbol), rate.symbol, rate.rate, rate.date)
+    return written
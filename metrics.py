@@ -0,0 +1,238 @@
+'''
+Instrumentation for the API clients and the tracker's processing stages.
+
+Every upstream request is recorded per API and endpoint: a latency histogram, response bytes, status codes, retries,
+errors and response cache results. The request budget reports quota usage, and stage() times (and optionally profiles)
+decoding, alert evaluation and parquet I/O. Everything lives in one process wide registry, which can be exported as a
+Prometheus text file (for node_exporter's textfile collector) or as a JSON snapshot:
+
+    metrics = get_default_metrics()
+    with metrics.stage('decode'):
+        ...
+    metrics.write("metrics.prom")    # or "metrics.json"
+'''
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+# cProfile and pstats are only imported once a stage is actually profiled
+if TYPE_CHECKING:
+    import pstats
+
+PREFIX = "tracker_"
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HELP = {
+    'api_requests_total': ('counter', "Upstream API requests by final status (or exception type)."),
+    'api_request_duration_seconds': ('histogram', "Upstream API request latency, including retries and cache lookups."),
+    'api_response_bytes_total': ('counter', "Bytes of upstream API response bodies."),
+    'api_retries_total': ('counter', "Retried attempts of upstream API requests."),
+    'api_errors_total': ('counter', "Upstream API requests that failed with a 4xx/5xx status or an exception."),
+    'api_cache_total': ('counter', "Response cache results: hit, stale (served because the API failed) or miss."),
+    'quota_used_requests': ('gauge', "Requests counted against this month's API quota."),
+    'quota_remaining_requests': ('gauge', "Requests left in this month's API quota."),
+    'quota_rejections_total': ('counter', "Requests refused by the request budget."),
+    'stage_duration_seconds': ('histogram', "Time spent in a processing stage (decode, alerts, parquet I/O)."),
+    'notifications_total': ('counter', "Notifications handed to each sink, by outcome."),
+    'notifications_dropped_total': ('counter', "Alerts not notified: repeats within the repeat interval or a full queue."),
+    'quote_lookups_total': ('counter', "Quote server lookups answered from memory (hit) or upstream (miss)."),
+    'quote_coalesced_total': ('counter', "Quote lookups that waited for an identical upstream request already in flight."),
+    'backfill_chunks_total': ('counter', "Backfill date range chunks by outcome: done, failed or stopped by the quota."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels: Optional[dict]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in (labels or {}).items()))
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else f"{bound:g}"), total
+
+
+class Metrics:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, profile_stages: Iterable[str] = (), profile_dir: Optional[str] = None):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        # Stages run under cProfile, with their stats accumulated per stage
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir
+        self.profiles: Dict[str, 'pstats.Stats'] = {}
+        self.profiling = threading.local()
+
+    # Primitives
+    def inc(self, name: str, labels: Optional[dict] = None, value: float = 1):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, labels: Optional[dict], value: float):
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name: str, labels: Optional[dict], value: float):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    # API requests
+    def observe_request(self, api: str, endpoint: str, seconds: float, status: Optional[int] = None, size: int = 0, retries: int = 0, cache: Optional[str] = None, error: Optional[BaseException] = None):
+        labels = {'api': api, 'endpoint': endpoint}
+        outcome = type(error).__name__ if error is not None else str(status)
+        self.inc('api_requests_total', {**labels, 'status': outcome})
+        self.observe('api_request_duration_seconds', labels, seconds)
+        if size:
+            self.inc('api_response_bytes_total', labels, size)
+        if retries:
+            self.inc('api_retries_total', labels, retries)
+        if error is not None or (status is not None and status >= 400):
+            self.inc('api_errors_total', {**labels, 'kind': outcome})
+        if cache:
+            self.inc('api_cache_total', {**labels, 'result': cache})
+
+    def instrument(self, api: str, endpoint: str, fetch: Callable[[], object], cached: bool = False):
+        '''
+        Calls fetch() (which returns a requests.Response) and records it. Transport marks responses with the number of
+        retries and ResponseCache marks the ones it served; cached says whether a cache was consulted at all.
+        '''
+        start = time.perf_counter()
+        try:
+            response = fetch()
+        except Exception as err:
+            self.observe_request(api, endpoint, time.perf_counter() - start, error=err)
+            raise
+        from_cache = getattr(response, 'from_cache', False)
+        cache = ('stale' if getattr(response, 'stale', False) else 'hit') if from_cache else ('miss' if cached else None)
+        self.observe_request(api, endpoint, time.perf_counter() - start, status=response.status_code, size=0 if from_cache else len(response.content), retries=getattr(response, 'retries', 0), cache=cache)
+        return response
+
+    # Quota
+    def record_quota(self, api: str, used: int, limit: int):
+        self.set_gauge('quota_used_requests', {'api': api}, used)
+        self.set_gauge('quota_remaining_requests', {'api': api}, max(limit - used, 0))
+
+    # Stages
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        # Profiles are per thread, and cProfile cannot be nested, so only the outermost profiled stage is profiled
+        profile = None
+        if name in self.profile_stages and not getattr(self.profiling, 'active', False):
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.profiling.active = True
+            except ValueError:
+                # Another profiler (or debugger) is already running in this thread
+                profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_duration_seconds', {'stage': name}, time.perf_counter() - start)
+            if profile is not None:
+                profile.disable()
+                self.profiling.active = False
+                import pstats
+                with self.lock:
+                    if name in self.profiles:
+                        self.profiles[name].add(profile)
+                    else:
+                        self.profiles[name] = pstats.Stats(profile)
+
+    def dump_profiles(self, directory: Optional[str] = None):
+        # One <stage>.prof per profiled stage, readable with `python -m pstats` or snakeviz
+        directory = directory or self.profile_dir
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            for name, stats in self.profiles.items():
+                stats.dump_stats(os.path.join(directory, f"{name}.prof"))
+
+    # Export
+    def snapshot(self) -> dict:
+        with self.lock:
+            metrics = {}
+            for (name, labels), value in sorted(self.counters.items()) + sorted(self.gauges.items()):
+                metrics.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metrics.setdefault(name, []).append({'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum, 'buckets': dict(histogram.cumulative())})
+        return {'time': time.time(), 'metrics': metrics}
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, samples in self.snapshot()['metrics'].items():
+            kind, description = HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {PREFIX}{name} {description}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for sample in samples:
+                if 'buckets' in sample:
+                    for bound, count in sample['buckets'].items():
+                        lines.append(f"{PREFIX}{name}_bucket{format_labels({**sample['labels'], 'le': bound})} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(sample['labels'])} {sample['sum']:.6f}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(sample['labels'])} {sample['count']}")
+                else:
+                    lines.append(f"{PREFIX}{name}{format_labels(sample['labels'])} {format_value(sample['value'])}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        # JSON for *.json paths, Prometheus text format otherwise. Written atomically, so a scraper never sees half a file.
+        content = json.dumps(self.snapshot(), indent=2) if path.endswith(".json") else self.prometheus()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+        self.dump_profiles()
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+_default_metrics = Metrics()
+
+
+def get_default_metrics() -> Metrics:
+    return _default_metrics
+
+
+def set_default_metrics(metrics: Metrics):
+    global _default_metrics
+    _default_metrics = metrics
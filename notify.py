@@ -0,0 +1,211 @@
+'''
+Alert notifications, delivered from a background thread.
+
+notify() only puts the alert on a queue, so a slow or hanging backend never delays price polling. The worker thread
+collects everything that arrives within `coalesce_seconds` of the first alert and sends it as one notification (several
+instruments breaching in the same tick become a single digest), drops repeats of the same alert within
+`repeat_interval` seconds, and hands the result to every sink:
+
+    mac      macOS Notification Center (mac_notifications, imported on first use)
+    stdout   printed
+    log      the "tracker.alerts" logger
+    webhook  JSON POST of {"text", "title", "message", "alerts"}, which Slack/Discord style webhooks accept
+    memory   kept in a list, for tests and benchmarks
+'''
+
+import logging
+import queue
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from http_client import Transport, get_default_transport
+from metrics import get_default_metrics
+
+DEFAULT_COALESCE_SECONDS = 1.0
+DEFAULT_REPEAT_INTERVAL = 300
+DEFAULT_MAX_QUEUE = 1000
+SINK_NAMES = ['mac', 'stdout', 'log', 'webhook', 'memory']
+
+
+# Sinks
+class MacSink:
+    def send(self, title: str, message: str, alerts: List[dict]):
+        from mac_notifications import client
+
+        client.create_notification(title=title, subtitle=message)
+
+
+class StdoutSink:
+    def send(self, title: str, message: str, alerts: List[dict]):
+        print(f"{title}\n{message}")
+
+
+class LogSink:
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger("tracker.alerts")
+
+    def send(self, title: str, message: str, alerts: List[dict]):
+        self.logger.warning("%s: %s", title, message.replace("\n", "; "))
+
+
+class WebhookSink:
+    def __init__(self, url: str, transport: Optional[Transport] = None):
+        self.url = url
+        self.transport = transport
+
+    def send(self, title: str, message: str, alerts: List[dict]):
+        transport = self.transport or get_default_transport()
+        payload = {'text': f"{title}\n{message}", 'title': title, 'message': message, 'alerts': alerts}
+        response = transport.session.post(self.url, json=payload, timeout=transport.timeout)
+        response.raise_for_status()
+
+
+class MemorySink:
+    def __init__(self):
+        self.sent: List[dict] = []
+
+    def send(self, title: str, message: str, alerts: List[dict]):
+        self.sent.append({'title': title, 'message': message, 'alerts': alerts})
+
+
+def default_sink_names() -> List[str]:
+    return ['mac'] if sys.platform == 'darwin' else ['stdout']
+
+
+def build_sinks(names: Optional[List[str]] = None, webhook_url: Optional[str] = None) -> list:
+    sinks = []
+    for name in names or default_sink_names():
+        if name == 'mac':
+            sinks.append(MacSink())
+        elif name == 'stdout':
+            sinks.append(StdoutSink())
+        elif name == 'log':
+            sinks.append(LogSink())
+        elif name == 'webhook':
+            if not webhook_url:
+                raise ValueError("The webhook notification sink needs notify_webhook_url.")
+            sinks.append(WebhookSink(webhook_url))
+        elif name == 'memory':
+            sinks.append(MemorySink())
+        else:
+            raise ValueError(f"Unknown notification sink {name!r}. Supported sinks are {SINK_NAMES}.")
+    return sinks
+
+
+# Dispatcher
+_STOP = object()
+
+
+class Dispatcher:
+    def __init__(self, sinks: list, coalesce_seconds: float = DEFAULT_COALESCE_SECONDS, repeat_interval: float = DEFAULT_REPEAT_INTERVAL, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.sinks = sinks
+        self.coalesce_seconds = coalesce_seconds
+        self.repeat_interval = repeat_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.last_sent: Dict[str, float] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="notify", daemon=True)
+                self.thread.start()
+        return self
+
+    def notify(self, key: str, title: str, message: str, alert: Optional[dict] = None) -> bool:
+        # Never blocks. Returns False if the queue is full and the notification was dropped.
+        self.start()
+        try:
+            self.queue.put_nowait({'key': key, 'title': title, 'message': message, 'alert': alert or {}, 'time': time.time()})
+            return True
+        except queue.Full:
+            get_default_metrics().inc('notifications_dropped_total', {'reason': 'queue_full'})
+            return False
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+            batch = [item]
+            stopping = False
+            # Everything arriving shortly after the first alert goes into the same digest
+            deadline = time.monotonic() + self.coalesce_seconds
+            while not stopping:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            try:
+                self.dispatch(batch)
+            finally:
+                for _ in range(len(batch) + stopping):
+                    self.queue.task_done()
+            if stopping:
+                return
+
+    def dispatch(self, batch: List[dict]):
+        now = time.time()
+        # Only the newest notification per key, and none for keys sent within repeat_interval
+        latest = {item['key']: item for item in batch}
+        fresh = [item for key, item in latest.items() if now - self.last_sent.get(key, float('-inf')) >= self.repeat_interval]
+        dropped = len(batch) - len(fresh)
+        if dropped:
+            get_default_metrics().inc('notifications_dropped_total', {'reason': 'repeat'}, dropped)
+        if not fresh:
+            return
+        for item in fresh:
+            self.last_sent[item['key']] = now
+
+        if len(fresh) == 1:
+            title, message = fresh[0]['title'], fresh[0]['message']
+        else:
+            title = f"🚨 {len(fresh)} alerts"
+            message = "\n".join(item['message'] for item in fresh)
+        alerts = [item['alert'] for item in fresh]
+        for sink in self.sinks:
+            name = type(sink).__name__
+            try:
+                sink.send(title, message, alerts)
+                get_default_metrics().inc('notifications_total', {'sink': name, 'status': 'sent'})
+            except Exception as e:
+                get_default_metrics().inc('notifications_total', {'sink': name, 'status': 'failed'})
+                print(f"Exception while sending notification with {name}: {e}")
+
+    def flush(self):
+        # Blocks until everything queued so far has been handed to the sinks
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def close(self, timeout: Optional[float] = 30.0):
+        # Sends what is still queued without waiting out the coalescing window, then stops the worker
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+
+_default_dispatcher: Optional[Dispatcher] = None
+_default_dispatcher_lock = threading.Lock()
+
+
+def get_default_dispatcher() -> Dispatcher:
+    global _default_dispatcher
+    with _default_dispatcher_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = Dispatcher(build_sinks())
+        return _default_dispatcher
+
+
+def set_default_dispatcher(dispatcher: Dispatcher):
+    global _default_dispatcher
+    with _default_dispatcher_lock:
+        _default_dispatcher = dispatcher
@@ -0,0 +1,211 @@
+'''
+Request budgeting for the marketstack and metalpriceapi quotas.
+
+RequestBudget counts every upstream call per API and key for the current calendar month, and persists the counts so
+they survive restarts (keys are stored hashed). The daemon, the quote server, backfills and cron runs share one file:
+counts are re-read before they are checked, and incremented under an exclusive file lock, so no process overwrites
+another's requests. Each acquire() also goes through a per-second token bucket. Requests
+have a priority: "high" (latest quotes) always goes first, "low" (backfills) is spaced out across the rest of the month
+as the remaining budget gets close to the reserve, and paused once only the reserve is left.
+'''
+
+import calendar
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from metrics import get_default_metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: counts are still re-read before every update, but not locked between processes
+    fcntl = None
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+DEFAULT_LIMITS = {
+    'marketstack': {'monthly': 10000, 'per_second': 5, 'reserve': 0.1},
+    'metalpriceapi': {'monthly': 10000, 'per_second': 5, 'reserve': 0.1},
+}
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def key_id(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or '').encode()).hexdigest()[:12]
+
+
+def seconds_left_in_month(now: Optional[datetime] = None) -> float:
+    now = now or datetime.now(timezone.utc)
+    last_day = calendar.monthrange(now.year, now.month)[1]
+    end = now.replace(day=last_day, hour=23, minute=59, second=59, microsecond=0)
+    return max((end - now).total_seconds(), 1.0)
+
+
+class RequestBudget:
+    def __init__(self, path: Optional[str] = "quota.json", limits: Optional[Dict[str, dict]] = None):
+        self.path = path
+        limits = limits or {}
+        self.limits = {api: {**DEFAULT_LIMITS.get(api, {}), **limits.get(api, {})} for api in {**DEFAULT_LIMITS, **limits}}
+        self.counts = self.load()
+        self.condition = threading.Condition()
+        self.waiting = {priority: 0 for priority in PRIORITIES}
+        self.tokens = {api: float(limit['per_second']) for api, limit in self.limits.items()}
+        self.refilled_at = {api: time.monotonic() for api in self.limits}
+        self.last_low_priority = {}
+
+    # Persistence
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.counts, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        # Picks up the requests other processes made since this one last looked
+        if self.path:
+            self.counts = self.load()
+
+    @contextlib.contextmanager
+    def locked(self):
+        # Exclusive across processes for a read-increment-write of the counts
+        if not self.path:
+            yield
+            return
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Accounting
+    def month_entry(self, api: str, api_key: Optional[str]) -> dict:
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+        entry = self.counts.setdefault(api, {}).setdefault(key_id(api_key), {'month': month, 'count': 0})
+        if entry['month'] != month:
+            entry.update(month=month, count=0)
+        return entry
+
+    def used(self, api: str, api_key: Optional[str]) -> int:
+        with self.condition:
+            self.refresh()
+            return self.month_entry(api, api_key)['count']
+
+    def remaining(self, api: str, api_key: Optional[str]) -> int:
+        with self.condition:
+            self.refresh()
+            return max(self.limits[api]['monthly'] - self.month_entry(api, api_key)['count'], 0)
+
+    def reserve(self, api: str) -> float:
+        return self.limits[api]['monthly'] * self.limits[api].get('reserve', 0.0)
+
+    def suggested_interval(self, api: str, api_key: Optional[str], requests_per_poll: int = 1, reserve: bool = True) -> float:
+        # Poll interval that spreads what is left of this month's budget (minus the reserve) evenly until month end
+        spendable = self.remaining(api, api_key) - (self.reserve(api) if reserve else 0)
+        if spendable <= 0:
+            return seconds_left_in_month()
+        return seconds_left_in_month() * requests_per_poll / spendable
+
+    # Rate limiting
+    def refill(self, api: str):
+        now = time.monotonic()
+        per_second = float(self.limits[api]['per_second'])
+        self.tokens[api] = min(per_second, self.tokens[api] + (now - self.refilled_at[api]) * per_second)
+        self.refilled_at[api] = now
+
+    def higher_priority_waiting(self, priority: str) -> bool:
+        return any(self.waiting[other] for other, rank in PRIORITIES.items() if rank < PRIORITIES[priority])
+
+    def acquire(self, api: str, api_key: Optional[str], priority: str = 'normal', block: bool = True, max_wait: float = 60.0) -> bool:
+        '''
+        Reserves one request against the budget, waiting for the per-second bucket if needed. Every attempt of a
+        request counts, retries included.
+
+        Raises QuotaExceeded when the monthly budget is spent, when only the reserve is left for a low priority request,
+        or when a paced low priority request would have to wait longer than max_wait. With block=False, returns False
+        instead of waiting.
+        '''
+        if priority not in PRIORITIES:
+            raise ValueError(f"Priority must be one of {list(PRIORITIES)}.")
+
+        with self.condition:
+            self.refresh()
+            remaining = self.limits[api]['monthly'] - self.month_entry(api, api_key)['count']
+            if remaining <= 0:
+                self.reject(api, priority)
+
+            if priority == 'low' and remaining <= self.reserve(api):
+                get_default_metrics().inc('quota_rejections_total', {'api': api, 'priority': priority})
+                raise QuotaExceeded(f"Only the reserved {api} budget is left; low priority requests are paused until next month.")
+
+            # Low priority requests are paced across the rest of the month once the budget is getting tight
+            if priority == 'low' and remaining <= 2 * self.reserve(api) and api in self.last_low_priority:
+                wait = self.last_low_priority[api] + self.suggested_interval(api, api_key) - time.monotonic()
+                if wait > 0:
+                    if not block:
+                        return False
+                    if wait > max_wait:
+                        get_default_metrics().inc('quota_rejections_total', {'api': api, 'priority': priority})
+                        raise QuotaExceeded(f"{api} budget is low; the next low priority request is due in {wait:.0f}s.")
+                    self.condition.wait(wait)
+
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    self.refill(api)
+                    if self.tokens[api] >= 1 and not self.higher_priority_waiting(priority):
+                        break
+                    if not block:
+                        return False
+                    self.condition.wait(max((1 - self.tokens[api]) / self.limits[api]['per_second'], 0.01))
+            finally:
+                self.waiting[priority] -= 1
+
+            # Other processes may have spent the rest of the budget while this one waited
+            with self.locked():
+                entry = self.month_entry(api, api_key)
+                if entry['count'] >= self.limits[api]['monthly']:
+                    self.reject(api, priority)
+                entry['count'] += 1
+                self.save()
+            self.tokens[api] -= 1
+            get_default_metrics().record_quota(api, entry['count'], self.limits[api]['monthly'])
+            if priority == 'low':
+                self.last_low_priority[api] = time.monotonic()
+            self.condition.notify_all()
+            return True
+
+    def reject(self, api: str, priority: str):
+        get_default_metrics().inc('quota_rejections_total', {'api': api, 'priority': priority})
+        raise QuotaExceeded(f"Monthly {api} quota of {self.limits[api]['monthly']} requests is used up.")
+
+
+_default_budget: Optional[RequestBudget] = None
+
+
+def get_default_budget() -> Optional[RequestBudget]:
+    return _default_budget
+
+
+def set_default_budget(budget: Optional[RequestBudget]):
+    global _default_budget
+    _default_budget = budget
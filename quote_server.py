@@ -0,0 +1,341 @@
+'''
+Local quote service: one upstream request per quote, however many processes want it.
+
+QuoteService keeps the latest quote of every symbol in memory for `max_age` seconds. Misses go upstream through a
+SingleFlight, so concurrent requests for the same symbols share one call instead of each making their own, and the
+ETFs missing from a request are fetched together in one batched EndOfDay(...).latest() request. FX symbols (USDINR,
+XAUUSD) are fetched together too, by the fx_fetcher the service is given.
+
+The service is served over a small HTTP API, on a TCP port or a Unix socket:
+
+    GET /quotes?symbols=GLDM,SIVR,USDINR[&max_age=30]   {"quotes": {"GLDM": {"price": ..., ...}}, "errors": {}}
+    GET /health                                         {"status": "ok", "quotes": 3}
+    GET /metrics                                        the process metrics in Prometheus text format
+
+    python "Gold tracker.py" --serve                    # listens on quote_server_address
+    QuoteClient("127.0.0.1:8765").prices(["GLDM", "USDINR"])
+    QuoteClient("/tmp/gold-tracker.sock").prices(["GLDM"])
+
+The client only uses the standard library, so consumers such as quick checks stay cheap to start.
+'''
+
+import errno
+import http.client
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, quote, urlparse
+
+import marketstack
+from metrics import get_default_metrics
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+DEFAULT_MAX_AGE = 60.0
+DEFAULT_CLIENT_TIMEOUT = 5.0
+REQUEST_QUEUE_SIZE = 128
+
+
+class SingleFlight:
+    '''
+    Merges concurrent calls for the same keys. The first caller for a key fetches it; callers arriving while that
+    fetch is running wait for its result instead of starting their own.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight: Dict[Hashable, Future] = {}
+
+    def futures(self, keys: Iterable[Hashable], fetch: Callable[[List[Hashable]], dict]) -> Dict[Hashable, Future]:
+        '''
+        Returns a future per key. Keys nobody is fetching yet are fetched by this call, all in one fetch(keys) that
+        returns {key: value}, before it returns; the other futures complete when their owner's fetch does.
+        '''
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            own = [key for key in keys if key not in self.in_flight]
+            for key in own:
+                self.in_flight[key] = Future()
+            futures = {key: self.in_flight[key] for key in keys}
+        if len(own) < len(keys):
+            get_default_metrics().inc('quote_coalesced_total', value=len(keys) - len(own))
+
+        if own:
+            try:
+                results = fetch(own)
+            except BaseException as e:
+                # Waiters get the error too; interrupts still stop this thread
+                for key in own:
+                    futures[key].set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+            else:
+                for key in own:
+                    if key in results:
+                        futures[key].set_result(results[key])
+                    else:
+                        futures[key].set_exception(LookupError(f"No result for {key}."))
+            finally:
+                with self.lock:
+                    for key in own:
+                        del self.in_flight[key]
+        return futures
+
+    def do(self, key: Hashable, fn: Callable[[], object]):
+        return self.futures([key], lambda keys: {key: fn()})[key].result()
+
+
+class QuoteService:
+    def __init__(self, fx_symbols: Iterable[str] = (), fx_fetcher: Optional[Callable[[List[str]], Dict[str, float]]] = None, max_age: float = DEFAULT_MAX_AGE):
+        # fx_fetcher(symbols) returns {symbol: rate} for the FX symbols, all in one upstream request
+        self.fx_symbols = set(fx_symbols) if fx_fetcher is not None else set()
+        self.fx_fetcher = fx_fetcher
+        self.max_age = max_age
+        self.quotes: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+
+    def get(self, symbols: Iterable[str], max_age: Optional[float] = None) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        '''
+        Latest quote per symbol, from memory when it is younger than max_age (default: the service's) and from
+        upstream otherwise. When upstream fails, the last known quote is returned marked stale. Returns (quotes, errors).
+        '''
+        max_age = self.max_age if max_age is None else max_age
+        symbols = list(dict.fromkeys(symbols))
+        quotes = self.cached(symbols, max_age)
+        missing = [symbol for symbol in symbols if symbol not in quotes]
+        get_default_metrics().inc('quote_lookups_total', {'result': 'hit'}, len(quotes))
+        if not missing:
+            return quotes, {}
+        get_default_metrics().inc('quote_lookups_total', {'result': 'miss'}, len(missing))
+
+        futures = {}
+        etfs = [symbol for symbol in missing if symbol not in self.fx_symbols]
+        if etfs:
+            futures.update(self.flight.futures(etfs, lambda keys: self.fetch(keys, max_age, self.fetch_etfs)))
+        fx = [symbol for symbol in missing if symbol in self.fx_symbols]
+        if fx:
+            futures.update(self.flight.futures(fx, lambda keys: self.fetch(keys, max_age, self.fetch_fx)))
+
+        errors = {}
+        for symbol in missing:
+            try:
+                quotes[symbol] = futures[symbol].result()
+            except Exception as e:
+                with self.lock:
+                    last = self.quotes.get(symbol)
+                if last is not None:
+                    quotes[symbol] = {**last, 'stale': True}
+                else:
+                    errors[symbol] = str(e)
+        return quotes, errors
+
+    def cached(self, symbols: List[str], max_age: float) -> Dict[str, dict]:
+        now = time.time()
+        with self.lock:
+            return {symbol: self.quotes[symbol] for symbol in symbols if symbol in self.quotes and now - self.quotes[symbol]['fetched_at'] <= max_age}
+
+    def fetch(self, symbols: List[str], max_age: float, fetch: Callable[[List[str]], Dict[str, dict]]) -> Dict[str, dict]:
+        # A flight for these symbols may have finished between the caller's cache lookup and this one starting
+        quotes = self.cached(symbols, max_age)
+        missing = [symbol for symbol in symbols if symbol not in quotes]
+        if missing:
+            quotes.update(fetch(missing))
+        return quotes
+
+    def store(self, quotes: Dict[str, dict]) -> Dict[str, dict]:
+        with self.lock:
+            self.quotes.update(quotes)
+        return quotes
+
+    def fetch_etfs(self, symbols: List[str]) -> Dict[str, dict]:
+        fetched_at = time.time()
+        quotes = {}
+        for query in marketstack.EndOfDay.batch_queries(symbols, latest=True):
+            try:
+                rows = query.get_data(paginate=False)
+            except SystemExit as e:
+                # fetch_json reports network errors as SystemExit, which must not end a request thread
+                raise ConnectionError(str(e)) from e
+            for row in rows:
+                quotes[row['symbol']] = {'symbol': row['symbol'], 'price': row['close'], 'date': row['date'], 'source': 'marketstack', 'fetched_at': fetched_at}
+        return self.store(quotes)
+
+    def fetch_fx(self, symbols: List[str]) -> Dict[str, dict]:
+        # Symbols missing from the result fail with a LookupError in SingleFlight
+        fetched_at = time.time()
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        rates = self.fx_fetcher(symbols)
+        return self.store({symbol: {'symbol': symbol, 'price': rate, 'date': date, 'source': 'fx', 'fetched_at': fetched_at} for symbol, rate in rates.items() if symbol in symbols})
+
+
+# HTTP API
+class QuoteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+        service: QuoteService = self.server.service
+
+        if parsed.path == '/quotes':
+            symbols = [symbol.strip() for symbol in query.get('symbols', '').split(',') if symbol.strip()]
+            if not symbols:
+                return self.send_json(400, {'error': "symbols is required, e.g. /quotes?symbols=GLDM,USDINR"})
+            try:
+                max_age = float(query['max_age']) if 'max_age' in query else None
+            except ValueError:
+                return self.send_json(400, {'error': "max_age must be a number of seconds."})
+            quotes, errors = service.get(symbols, max_age)
+            return self.send_json(200, {'quotes': quotes, 'errors': errors})
+        if parsed.path == '/health':
+            return self.send_json(200, {'status': 'ok', 'quotes': len(service.quotes)})
+        if parsed.path == '/metrics':
+            return self.send_body(200, get_default_metrics().prometheus().encode(), "text/plain; version=0.0.4")
+        return self.send_json(404, {'error': f"Unknown path {parsed.path}."})
+
+    def send_json(self, status: int, payload: dict):
+        self.send_body(status, json.dumps(payload).encode(), "application/json")
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class QuoteHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many local clients connect at the same moment when a poll interval comes round
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, address: Tuple[str, int], service: QuoteService):
+        super().__init__(address, QuoteHandler)
+        self.service = service
+
+
+def remove_stale_socket(path: str):
+    '''
+    A socket file left behind by a server that is gone would make bind() fail, so it is removed. Anything else at the
+    path is an error: a file that is not a socket, or the socket of a quote server that is still listening.
+    '''
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(errno.EEXIST, "Not a socket, refusing to replace it", path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, "Another quote server is listening on this socket", path)
+
+
+class QuoteUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, path: str, service: QuoteService):
+        remove_stale_socket(path)
+        # Only a socket this server bound is removed when it closes
+        self.bound = False
+        super().__init__(path, QuoteHandler)
+        self.service = service
+
+    def server_bind(self):
+        super().server_bind()
+        self.bound = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) style client address
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+    def server_close(self):
+        super().server_close()
+        if self.bound and os.path.exists(self.server_address):
+            os.remove(self.server_address)
+            self.bound = False
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    # "host:port", or a filesystem path for a Unix socket
+    if '/' in address:
+        return address
+    host, _, port = address.rpartition(':')
+    return (host or "127.0.0.1", int(port))
+
+
+def make_server(service: QuoteService, address: str = DEFAULT_ADDRESS) -> socketserver.BaseServer:
+    parsed = parse_address(address)
+    if isinstance(parsed, str):
+        return QuoteUnixServer(parsed, service)
+    return QuoteHTTPServer(parsed, service)
+
+
+# Client
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = DEFAULT_CLIENT_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class QuoteClient:
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = DEFAULT_CLIENT_TIMEOUT):
+        self.address = parse_address(address)
+        self.timeout = timeout
+
+    def connection(self) -> http.client.HTTPConnection:
+        if isinstance(self.address, str):
+            return UnixHTTPConnection(self.address, self.timeout)
+        return http.client.HTTPConnection(*self.address, timeout=self.timeout)
+
+    def get(self, path: str) -> dict:
+        connection = self.connection()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            payload = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise ValueError(f"Quote server error {response.status}: {payload.get('error', 'no message')}")
+        return payload
+
+    def quotes(self, symbols: List[str], max_age: Optional[float] = None) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        path = "/quotes?symbols=" + quote(','.join(symbols), safe=',')
+        if max_age is not None:
+            path += f"&max_age={max_age:g}"
+        payload = self.get(path)
+        return payload['quotes'], payload['errors']
+
+    def prices(self, symbols: List[str], max_age: Optional[float] = None, stale: bool = False) -> Dict[str, float]:
+        # Stale quotes (the last known ones, served when upstream failed) are left out unless stale is set, so callers
+        # can get those symbols from elsewhere
+        quotes, _ = self.quotes(symbols, max_age)
+        return {symbol: item['price'] for symbol, item in quotes.items() if stale or not item.get('stale')}
+
+    def health(self) -> dict:
+        return self.get("/health")
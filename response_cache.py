@@ -0,0 +1,194 @@
+'''
+On-disk response cache for MarketStack requests.
+
+Responses are stored in SQLite, keyed on the URL plus the query parameters (without the access_key, so rotating keys
+does not invalidate the cache). How long an entry stays fresh depends on the endpoint: bars for dates in the past never
+change and are kept forever, "latest" data only for a few seconds. The cache is bounded in size and evicts the least
+recently used entries first. When the API errors, or the request budget refuses the request, an expired entry is served
+instead of failing.
+'''
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from quota import QuotaExceeded
+
+# Seconds an entry stays fresh. 'latest' applies to any URL ending in /latest, the rest are keyed on the endpoint.
+DEFAULT_TTLS = {
+    'latest': 30,
+    'eod': 300,
+    'intraday': 60,
+    'splits': 24 * 3600,
+    'dividends': 24 * 3600,
+    'tickers': 24 * 3600,
+    'exchanges': 24 * 3600,
+    'currencies': 7 * 24 * 3600,
+    'timezones': 7 * 24 * 3600,
+}
+DEFAULT_TTL = 60
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+# Upstream statuses that are answered with a stale entry when one exists.
+STALE_STATUS_CODES = {429, 500, 502, 503, 504}
+IGNORED_PARAMS = {'access_key', 'api_key'}
+
+DATE_SEGMENT = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+class ResponseCache:
+    def __init__(self, path: str = "cache/responses.sqlite3", max_bytes: int = DEFAULT_MAX_BYTES, ttls: Optional[dict] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+
+    # Keys and TTLs
+    def key(self, url: str, params: Optional[dict] = None) -> str:
+        params = {name: value for name, value in (params or {}).items() if name not in IGNORED_PARAMS}
+        raw = url + "?" + json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def ttl_for(self, url: str, params: Optional[dict] = None) -> Optional[float]:
+        #Returns None for responses that can be cached forever.
+        params = params or {}
+        segments = [segment for segment in urlparse(url).path.split('/') if segment]
+        if segments and segments[0] == 'v1':
+            segments = segments[1:]
+
+        if segments and segments[-1] == 'latest':
+            return self.ttls['latest']
+
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        dated = [segment[:10] for segment in segments if DATE_SEGMENT.match(segment)]
+        if params.get('date_to'):
+            dated.append(str(params['date_to'])[:10])
+        if dated and max(dated) < today:
+            return None
+
+        endpoint = segments[0] if segments else ''
+        return self.ttls.get(endpoint, DEFAULT_TTL)
+
+    # Storage
+    def get(self, key: str, allow_stale: bool = False) -> Optional[requests.Response]:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT url, status, headers, body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            url, status, headers, body, expires_at = row
+            if expires_at is not None and expires_at < now and not allow_stale:
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+        return build_response(url, status, json.loads(headers), body)
+
+    def set(self, key: str, url: str, response: requests.Response, ttl: Optional[float]):
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        headers = json.dumps({name: value for name, value in response.headers.items() if name.lower() == 'content-type'})
+        body = response.content
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, url, status, headers, body, stored_at, expires_at, last_access, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, response.status_code, headers, body, now, expires_at, now, len(body)),
+            )
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        #Drops least recently used entries until the cache fits in max_bytes. Callers hold the lock.
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    # Request wrapper
+    def fetch(self, url: str, params: Optional[dict], send: Callable[[], requests.Response]) -> requests.Response:
+        key = self.key(url, params)
+        ttl = self.ttl_for(url, params)
+
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            response = send()
+        except (requests.exceptions.RequestException, QuotaExceeded):
+            stale = self.get(key, allow_stale=True)
+            if stale is not None:
+                stale.stale = True
+                return stale
+            raise
+
+        if response.status_code in STALE_STATUS_CODES:
+            stale = self.get(key, allow_stale=True)
+            if stale is not None:
+                stale.stale = True
+                return stale
+        elif response.status_code == 200 and ttl != 0:
+            self.set(key, url, response, ttl)
+        return response
+
+
+def build_response(url: str, status: int, headers: dict, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = 'utf-8'
+    response._content = body
+    response.from_cache = True
+    return response
+
+
+_default_cache: Optional[ResponseCache] = None
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    return _default_cache
+
+
+def set_default_cache(cache: Optional[ResponseCache]):
+    global _default_cache
+    _default_cache = cache
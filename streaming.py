@@ -0,0 +1,262 @@
+'''
+Streaming intraday bars with rolling statistics kept up to date bar by bar.
+
+Every symbol gets a SymbolStream: fixed size NumPy ring buffers holding its last `capacity` bars, plus running sums and
+monotonic min/max queues. Pushing a bar updates the rolling VWAP, moving averages, min/max and volatility in O(1)
+(amortised), so a process can stream for months with constant memory and never recomputes over a DataFrame.
+
+    stream = IntradayStream(['GLDM', 'SIVR'], interval='1min', capacity=390, ma_windows=(20, 50))
+    stream.warm_up()            # last `capacity` bars, one request
+    while True:
+        stream.poll()           # Intraday(...).latest(), one request for every symbol
+        print(stream.stats())
+
+Windows are counted in bars. VWAP, min/max and volatility cover the whole buffer, moving averages their own window.
+'''
+
+import math
+from collections import deque
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import marketstack
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_CAPACITY = 390  # one US session of 1 minute bars
+DEFAULT_MA_WINDOWS = (20, 50)
+
+
+def to_nanoseconds(date: str) -> int:
+    # Marketstack dates are UTC ("2024-05-10T14:30:00+0000"); anything else goes through pandas
+    if date.endswith('+0000'):
+        return int(np.datetime64(date[:19], 'ns').astype('int64'))
+    import pandas as pd
+    return pd.Timestamp(date).tz_convert('UTC').value
+
+
+def bar_price(row: dict) -> Optional[float]:
+    # `last` is the live trade price; it is empty outside market hours, when `close` is the latest price
+    price = row.get('last')
+    if price is None:
+        price = row.get('close')
+    return None if price is None else float(price)
+
+
+class SymbolStream:
+    def __init__(self, symbol: str, capacity: int = DEFAULT_CAPACITY, ma_windows: Iterable[int] = DEFAULT_MA_WINDOWS):
+        ma_windows = sorted(set(int(window) for window in ma_windows))
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2 bars.")
+        if ma_windows and not 1 <= ma_windows[0] <= ma_windows[-1] <= capacity:
+            raise ValueError(f"Moving average windows must be between 1 and the capacity ({capacity} bars).")
+
+        self.symbol = symbol
+        self.capacity = capacity
+        self.ma_windows = ma_windows
+        self.dates = np.zeros(capacity, dtype='int64')
+        self.prices = np.full(capacity, np.nan)
+        self.volumes = np.zeros(capacity)
+        # returns[i] is the log return into the bar in slot i
+        self.returns = np.zeros(capacity)
+        self.count = 0
+        self.ma_sums = {window: 0.0 for window in self.ma_windows}
+        self.pv_sum = 0.0
+        self.volume_sum = 0.0
+        self.return_sum = 0.0
+        self.return_sq_sum = 0.0
+        # (sequence number, price), decreasing for the max queue and increasing for the min queue
+        self.max_queue: deque = deque()
+        self.min_queue: deque = deque()
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def slot(self, age: int) -> int:
+        # Slot of the bar `age` bars before the newest one
+        return (self.count - 1 - age) % self.capacity
+
+    @property
+    def last_date(self) -> Optional[int]:
+        return int(self.dates[self.slot(0)]) if self.count else None
+
+    def push(self, date: int, price: float, volume: float = 0.0) -> bool:
+        '''
+        Adds a bar (date in nanoseconds since the epoch, UTC) and updates every statistic.
+
+        Bars at or before the newest one are ignored, so the same latest bar can be pushed on every poll. Returns
+        whether the bar was added.
+        '''
+        if self.count and date <= self.dates[self.slot(0)]:
+            return False
+        if price is None or math.isnan(price):
+            return False
+        price = float(price)
+        volume = 0.0 if volume is None or math.isnan(volume) else float(volume)
+
+        capacity = self.capacity
+        sequence = self.count
+        slot = sequence % capacity
+        full = sequence >= capacity
+
+        # Everything leaving a window is subtracted before the slot is overwritten
+        for window in self.ma_windows:
+            self.ma_sums[window] += price
+            if sequence >= window:
+                self.ma_sums[window] -= self.prices[(sequence - window) % capacity]
+        self.pv_sum += price * volume
+        self.volume_sum += volume
+        if full:
+            self.pv_sum -= self.prices[slot] * self.volumes[slot]
+            self.volume_sum -= self.volumes[slot]
+
+        log_return = math.log(price / self.prices[self.slot(0)]) if sequence else 0.0
+        self.return_sum += log_return
+        self.return_sq_sum += log_return * log_return
+        if full:
+            # The bar after the evicted one becomes the oldest, and the return into it now starts outside the window
+            oldest = (slot + 1) % capacity
+            self.return_sum -= self.returns[oldest]
+            self.return_sq_sum -= self.returns[oldest] * self.returns[oldest]
+
+        self.dates[slot] = date
+        self.prices[slot] = price
+        self.volumes[slot] = volume
+        self.returns[slot] = log_return
+        self.count += 1
+
+        while self.max_queue and self.max_queue[-1][1] <= price:
+            self.max_queue.pop()
+        self.max_queue.append((sequence, price))
+        while self.min_queue and self.min_queue[-1][1] >= price:
+            self.min_queue.pop()
+        self.min_queue.append((sequence, price))
+        expired = sequence - capacity
+        while self.max_queue[0][0] <= expired:
+            self.max_queue.popleft()
+        while self.min_queue[0][0] <= expired:
+            self.min_queue.popleft()
+
+        # Running sums pick up floating point drift; recomputing them once per buffer length keeps it bounded and
+        # still costs O(1) per bar on average
+        if self.count % capacity == 0:
+            self.resync()
+        return True
+
+    def window(self, size: Optional[int] = None) -> np.ndarray:
+        # Indices of the last `size` bars, oldest first
+        size = len(self) if size is None else min(size, len(self))
+        return (self.count - size + np.arange(size)) % self.capacity
+
+    def resync(self):
+        index = self.window()
+        for window in self.ma_windows:
+            self.ma_sums[window] = float(self.prices[index[-window:]].sum())
+        self.pv_sum = float(np.dot(self.prices[index], self.volumes[index]))
+        self.volume_sum = float(self.volumes[index].sum())
+        returns = self.returns[index[1:]]
+        self.return_sum = float(returns.sum())
+        self.return_sq_sum = float(np.dot(returns, returns))
+
+    # Statistics
+    @property
+    def price(self) -> float:
+        return float(self.prices[self.slot(0)]) if self.count else math.nan
+
+    def moving_average(self, window: int) -> float:
+        if window not in self.ma_sums:
+            raise ValueError(f"No {window} bar moving average is kept; windows are {self.ma_windows}.")
+        return self.ma_sums[window] / window if self.count >= window else math.nan
+
+    @property
+    def vwap(self) -> float:
+        return self.pv_sum / self.volume_sum if self.volume_sum > 0 else math.nan
+
+    @property
+    def high(self) -> float:
+        return self.max_queue[0][1] if self.count else math.nan
+
+    @property
+    def low(self) -> float:
+        return self.min_queue[0][1] if self.count else math.nan
+
+    @property
+    def volatility(self) -> float:
+        # Sample standard deviation of the log returns between the bars in the window, per bar
+        n = len(self) - 1
+        if n < 2:
+            return math.nan
+        mean = self.return_sum / n
+        return math.sqrt(max(self.return_sq_sum / n - mean * mean, 0.0) * n / (n - 1))
+
+    def stats(self) -> dict:
+        stats = {
+            'symbol': self.symbol,
+            'date': np.datetime64(self.last_date, 'ns') if self.count else None,
+            'price': self.price,
+            'bars': len(self),
+            'vwap': self.vwap,
+            'low': self.low,
+            'high': self.high,
+            'volatility': self.volatility,
+        }
+        for window in self.ma_windows:
+            stats[f'ma_{window}'] = self.moving_average(window)
+        return stats
+
+    def series(self) -> 'pd.Series':
+        # Prices in the buffer, oldest first, indexed by date
+        import pandas as pd
+
+        index = self.window()
+        return pd.Series(self.prices[index], index=pd.to_datetime(self.dates[index], utc=True), name=self.symbol)
+
+
+class IntradayStream:
+    def __init__(self, symbols: List[str], interval: Optional[str] = None, capacity: int = DEFAULT_CAPACITY, ma_windows: Iterable[int] = DEFAULT_MA_WINDOWS, exchange: Optional[str] = None):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.interval = interval
+        self.exchange = exchange
+        self.streams: Dict[str, SymbolStream] = {symbol: SymbolStream(symbol, capacity, ma_windows) for symbol in self.symbols}
+
+    def update(self, rows: Iterable[dict]) -> List[str]:
+        # Pushes API rows, in date order, into their symbol's stream. Returns the symbols that got a new bar.
+        updated = []
+        bars: List[Tuple[int, str, float, Optional[float]]] = []
+        for row in rows:
+            price = bar_price(row)
+            if row.get('symbol') in self.streams and price is not None and row.get('date'):
+                bars.append((to_nanoseconds(row['date']), row['symbol'], price, row.get('volume')))
+        for date, symbol, price, volume in sorted(bars):
+            if self.streams[symbol].push(date, price, volume) and symbol not in updated:
+                updated.append(symbol)
+        return updated
+
+    def query(self, **params) -> marketstack.Intraday:
+        return marketstack.Intraday(','.join(self.symbols), exchange=self.exchange, interval=self.interval, **params)
+
+    def warm_up(self) -> List[str]:
+        # Fills the buffers with the most recent bars, so the statistics are meaningful from the first poll
+        capacity = max(stream.capacity for stream in self.streams.values())
+        rows = self.query(limit=min(capacity * len(self.symbols), 1000)).get_data(paginate=False)
+        return self.update(rows)
+
+    def poll(self) -> List[str]:
+        return self.update(self.query().latest().get_data(paginate=False))
+
+    def stats(self) -> Dict[str, dict]:
+        return {symbol: stream.stats() for symbol, stream in self.streams.items()}
+
+    def latest_prices(self) -> Dict[str, float]:
+        return {symbol: stream.price for symbol, stream in self.streams.items() if stream.count}
+
+    def frame(self) -> 'pd.DataFrame':
+        # Wide frame of the buffered prices (one column per symbol), e.g. for AlertEngine.evaluate()
+        import pandas as pd
+
+        columns = [stream.series() for stream in self.streams.values() if stream.count]
+        if not columns:
+            return pd.DataFrame()
+        return pd.concat(columns, axis=1).sort_index()
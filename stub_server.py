@@ -0,0 +1,319 @@
+'''
+Local stand-in for the marketstack and metalpriceapi APIs, for benchmarks and offline runs.
+
+Responses are replayed from the recorded payloads in fixtures/. List endpoints (eod, intraday, tickers, exchanges) are
+grown from the recorded rows to any size, so paginated and very large responses can be served, and honour the symbols,
+date_from/date_to, exchange (tickers), search, limit and offset parameters; metalpriceapi's latest and timeframe honour
+base and currencies, and timeframe serves deterministic daily rates around the recorded ones. Latency and errors can be
+injected:
+
+    with StubServer(latency=0.02, error_rate=0.1) as stub:
+        marketstack.set_base_url(stub.marketstack_url)
+        ...
+
+Run `python stub_server.py` to keep one running on a fixed port.
+'''
+
+import argparse
+import copy
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Generated history ends today, so delta fetches against the stub behave like they do against the live API.
+END_DATE = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+MAX_LIMIT = 1000
+METALS = ('XAU', 'XAG', 'XPT', 'XPD')
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def business_days(end: datetime, count: int) -> List[datetime]:
+    days = []
+    day = end
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= timedelta(days=1)
+    return days
+
+
+class StubData:
+    # Generates deterministic API rows from the recorded fixtures.
+    def __init__(self, eod_rows_per_symbol: int = 260, intraday_rows_per_symbol: int = 7 * 260, tickers: int = 2, exchanges: int = 2):
+        self.eod_template = load_fixture("eod")['data']
+        self.intraday_template = load_fixture("intraday")['data']
+        self.convert = load_fixture("convert")
+        self.latest = load_fixture("latest")
+        self.eod_rows_per_symbol = eod_rows_per_symbol
+        self.intraday_rows_per_symbol = intraday_rows_per_symbol
+        self.tickers = self.grow(load_fixture("tickers")['data'], tickers, 'symbol', 'name')
+        self.exchanges = self.grow(load_fixture("exchanges")['data'], exchanges, 'mic', 'name')
+        self.cache: Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def grow(self, rows: List[dict], count: int, key: str, name_key: str) -> List[dict]:
+        grown = [copy.deepcopy(row) for row in rows[:count]]
+        for index in range(len(grown), count):
+            row = copy.deepcopy(rows[index % len(rows)])
+            row[key] = f"{row[key]}{index:05d}"
+            row[name_key] = f"{row[name_key]} {index:05d}"
+            grown.append(row)
+        return grown
+
+    def template(self, templates: List[dict], symbol: str) -> dict:
+        for row in templates:
+            if row['symbol'] == symbol:
+                return row
+        return {**templates[zlib.crc32(symbol.encode()) % len(templates)], 'symbol': symbol}
+
+    def series(self, kind: str, symbol: str) -> List[dict]:
+        # Newest first, like the API's default sort
+        with self.lock:
+            if (kind, symbol) in self.cache:
+                return self.cache[(kind, symbol)]
+
+        rng = random.Random(zlib.crc32(f"{kind}:{symbol}".encode()))
+        if kind == 'eod':
+            template = self.template(self.eod_template, symbol)
+            stamps = business_days(END_DATE, self.eod_rows_per_symbol)
+        else:
+            template = self.template(self.intraday_template, symbol)
+            stamps = [day.replace(hour=hour) for day in business_days(END_DATE, self.intraday_rows_per_symbol // 7 + 1) for hour in range(20, 13, -1)][:self.intraday_rows_per_symbol]
+
+        rows = []
+        close = template['close']
+        for stamp in stamps:
+            change = rng.gauss(0, 0.01)
+            row = dict(template)
+            row.update(
+                symbol=symbol,
+                date=stamp.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+                close=round(close, 4),
+                open=round(close * (1 - change / 2), 4),
+                high=round(close * (1 + abs(change)), 4),
+                low=round(close * (1 - abs(change)), 4),
+                volume=float(int(template['volume'] * rng.uniform(0.5, 1.5))),
+            )
+            if 'adj_close' in row:
+                row.update(adj_close=row['close'], adj_open=row['open'], adj_high=row['high'], adj_low=row['low'], adj_volume=row['volume'])
+            if 'last' in row:
+                row['last'] = row['close']
+            rows.append(row)
+            close /= (1 + change)
+
+        with self.lock:
+            self.cache[(kind, symbol)] = rows
+        return rows
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: 'StubServer'
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+        segments = [segment for segment in parsed.path.split('/') if segment]
+        self.server.record(parsed.path, query)
+
+        if self.server.latency or self.server.jitter:
+            time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+
+        status = self.server.injected_error()
+        if status:
+            return self.send_json(status, {"error": {"code": "stub_error", "message": f"Injected {status} error."}})
+
+        if segments[:1] == ['v1']:
+            segments = segments[1:]
+        if not segments:
+            return self.send_json(404, {"error": {"code": "not_found", "message": "Unknown endpoint."}})
+
+        if segments[0] == 'convert':
+            return self.send_json(200, self.server.data.convert)
+        if segments[0] == 'latest':
+            return self.send_json(200, self.latest(query))
+        if segments[0] == 'timeframe':
+            return self.send_json(200, self.timeframe(query))
+        if segments[0] in ('eod', 'intraday'):
+            return self.send_json(200, self.prices(segments, query))
+        if segments[0] == 'tickers':
+            tickers = self.server.data.tickers
+            if query.get('exchange'):
+                tickers = [row for row in tickers if row['stock_exchange']['mic'] == query['exchange']]
+            return self.send_json(200, self.paginate(self.search(tickers, query, 'symbol'), query))
+        if segments[0] == 'exchanges':
+            return self.send_json(200, self.paginate(self.search(self.server.data.exchanges, query, 'mic'), query))
+        return self.send_json(404, {"error": {"code": "not_found", "message": f"Endpoint {segments[0]} is not replayed by the stub server."}})
+
+    def prices(self, segments: List[str], query: dict) -> dict:
+        kind = segments[0]
+        symbols = [symbol for symbol in query.get('symbols', '').split(',') if symbol]
+        series = [self.server.data.series(kind, symbol) for symbol in symbols]
+
+        if segments[-1] == 'latest':
+            return self.paginate([rows[0] for rows in series if rows], query)
+
+        date_from, date_to = query.get('date_from'), query.get('date_to')
+        if len(segments) > 1:
+            date_from = date_to = segments[1][:10]
+
+        rows = [row for rows in series for row in rows]
+        if date_from:
+            rows = [row for row in rows if row['date'][:10] >= date_from[:10]]
+        if date_to:
+            rows = [row for row in rows if row['date'][:10] <= date_to[:10]]
+        rows.sort(key=lambda row: row['date'], reverse=query.get('sort', 'desc') == 'desc')
+        return self.paginate(rows, query)
+
+    def usd_rates(self) -> Dict[str, float]:
+        recorded = self.server.data.latest
+        return {'USD': 1.0, **{currency: rate for currency, rate in recorded['rates'].items() if len(currency) == 3}}
+
+    def rebase(self, rates: Dict[str, float], base: str, query: dict) -> Dict[str, float]:
+        # rates against USD, rebased to `base` and limited to `currencies`
+        currencies = [currency.upper() for currency in query.get('currencies', '').split(',') if currency] or sorted(rates)
+        rebased = {currency: rates[currency] / rates[base] for currency in currencies if currency in rates and currency != base}
+        # Like the live API, metals also come as the price of one unit in the base currency
+        rebased.update({base + currency: 1 / rate for currency, rate in list(rebased.items()) if currency in METALS})
+        return rebased
+
+    def latest(self, query: dict) -> dict:
+        # The recorded USD rates, as of now
+        rates = self.usd_rates()
+        base = query.get('base', self.server.data.latest['base']).upper()
+        if base not in rates:
+            return {"success": False, "error": {"statusCode": 400, "message": f"Unknown base currency {base}."}}
+        return {"success": True, "base": base, "timestamp": int(time.time()), "rates": self.rebase(rates, base, query)}
+
+    def timeframe(self, query: dict) -> dict:
+        # One set of rates per day from start_date to end_date, each within a percent of the recorded ones
+        rates = self.usd_rates()
+        base = query.get('base', self.server.data.latest['base']).upper()
+        if base not in rates:
+            return {"success": False, "error": {"statusCode": 400, "message": f"Unknown base currency {base}."}}
+        try:
+            start = datetime.strptime(query['start_date'], "%Y-%m-%d")
+            end = datetime.strptime(query['end_date'], "%Y-%m-%d")
+        except (KeyError, ValueError):
+            return {"success": False, "error": {"statusCode": 400, "message": "start_date and end_date are required (YYYY-MM-DD)."}}
+        if not start <= end <= start + timedelta(days=364):
+            return {"success": False, "error": {"statusCode": 400, "message": "The timeframe must cover 1 to 365 days."}}
+        days = {}
+        while start <= end:
+            day = start.strftime("%Y-%m-%d")
+            rng = random.Random(zlib.crc32(day.encode()))
+            days[day] = self.rebase({currency: rate * (1 + rng.uniform(-0.01, 0.01)) for currency, rate in rates.items() if currency != 'USD'} | {'USD': 1.0}, base, query)
+            start += timedelta(days=1)
+        return {"success": True, "base": base, "start_date": query['start_date'], "end_date": query['end_date'], "rates": days}
+
+    def search(self, rows: List[dict], query: dict, key: str) -> List[dict]:
+        search = query.get('search', '').lower()
+        if not search:
+            return rows
+        return [row for row in rows if search in row[key].lower() or search in row['name'].lower()]
+
+    def paginate(self, rows: List[dict], query: dict) -> dict:
+        limit = min(int(query.get('limit', 100)), MAX_LIMIT)
+        offset = int(query.get('offset', 0))
+        page = rows[offset:offset + limit]
+        return {"pagination": {"limit": limit, "offset": offset, "count": len(page), "total": len(rows)}, "data": page}
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503, data: Optional[StubData] = None):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.data = data or StubData()
+        self.requests: List[tuple] = []
+        self.forced_errors: List[int] = []
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    # Both APIs are served from the same root
+    marketstack_url = url
+    metalpriceapi_url = url
+
+    def record(self, path: str, query: dict):
+        with self.lock:
+            self.requests.append((path, query))
+
+    def fail_next(self, count: int = 1, status: Optional[int] = None):
+        with self.lock:
+            self.forced_errors.extend([status or self.error_status] * count)
+
+    def injected_error(self) -> Optional[int]:
+        with self.lock:
+            if self.forced_errors:
+                return self.forced_errors.pop(0)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded marketstack and metalpriceapi responses locally.")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, up to this many seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status.")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    server = StubServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status)
+    print(f"Stub API listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# The modules are flat files in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def store(tmp_path):
+    from history import HistoryStore
+
+    return HistoryStore(str(tmp_path / "history"))
+
+
+@pytest.fixture
+def tracker():
+    # "Gold tracker.py" has a space in its name, so it cannot be imported normally
+    spec = importlib.util.spec_from_file_location("gold_tracker", os.path.join(ROOT, "Gold tracker.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def stub():
+    # A stub server both APIs point at for the test, with the previous settings restored afterwards
+    import marketstack
+    import metalpriceapi
+    from stub_server import StubServer
+
+    with StubServer() as stub:
+        urls, api_key = (marketstack.marketstack_base_url, metalpriceapi.metalpriceapi_base_url), marketstack.marketstack_api_key
+        marketstack.set_base_url(stub.marketstack_url)
+        metalpriceapi.set_base_url(stub.metalpriceapi_url)
+        marketstack.set_api_key("test")
+        yield stub
+        marketstack.set_base_url(urls[0])
+        metalpriceapi.set_base_url(urls[1])
+        marketstack.set_api_key(api_key)
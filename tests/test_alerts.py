@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from alerts import AlertEngine, rule_values, rules_frame
+
+
+def gappy_history():
+    # SIVR trades on weekdays only, USDINR every day, so SIVR has NaN rows in the joined frame
+    dates = pd.date_range("2024-01-01", periods=14, freq="D", tz="UTC")
+    history = pd.DataFrame({'SIVR': np.arange(14, dtype='float64') + 20, 'USDINR': np.full(14, 83.0)}, index=dates)
+    history.loc[history.index.weekday >= 5, 'SIVR'] = np.nan
+    return history
+
+
+def test_moving_average_needs_window_bars_of_the_symbol():
+    history = gappy_history()
+    rules = rules_frame([{'symbol': 'SIVR', 'type': 'ma_cross_above', 'window': 11}, {'symbol': 'SIVR', 'type': 'ma_cross_above', 'window': 10}])
+    # 14 rows but only 10 SIVR bars
+    values = rule_values(rules, history)
+    assert np.isnan(values[0])
+    assert values[1] == history['SIVR'].dropna().iloc[-1] - history['SIVR'].dropna().mean()
+
+
+def test_ma_cross_does_not_fire_on_first_evaluation():
+    dates = pd.date_range("2024-01-01", periods=4, freq="D", tz="UTC")
+    engine = AlertEngine([{'symbol': 'GLDM', 'type': 'ma_cross_above', 'window': 2, 'cooldown': 0}], state_path=None)
+
+    # Too few bars to evaluate, then already above the average: neither is a cross
+    assert engine.evaluate(pd.DataFrame({'GLDM': [40.0]}, index=dates[:1]), now=1).empty
+    assert engine.evaluate(pd.DataFrame({'GLDM': [40.0, 41.0]}, index=dates[:2]), now=2).empty
+    # Below the average, then back above it: a cross
+    assert engine.evaluate(pd.DataFrame({'GLDM': [40.0, 41.0, 39.0]}, index=dates[:3]), now=3).empty
+    fired = engine.evaluate(pd.DataFrame({'GLDM': [40.0, 41.0, 39.0, 42.0]}, index=dates), now=4)
+    assert fired['id'].tolist() == ["GLDM ma_cross_above 2"]
+
+
+def test_level_rule_fires_on_first_evaluation():
+    engine = AlertEngine([{'symbol': 'GLDM', 'type': 'above', 'threshold': 30}], state_path=None)
+    fired = engine.evaluate(pd.DataFrame({'GLDM': [40.0]}, index=pd.date_range("2024-01-01", periods=1, tz="UTC")), now=1)
+    assert fired['price'].tolist() == [40.0]
@@ -0,0 +1,33 @@
+import threading
+import time
+
+import pandas as pd
+
+from backfill import Checkpoint, backfill
+from quota import QuotaExceeded
+
+
+def test_chunks_in_flight_when_the_quota_runs_out_are_kept(store, tmp_path):
+    started, spent = threading.Event(), threading.Event()
+
+    def fetch(symbol, date_from, date_to, exchange=None):
+        # Like the request budget: once it is spent, every request is refused
+        if spent.is_set():
+            raise QuotaExceeded("monthly budget spent")
+        if date_from == "2024-01-01":
+            started.wait(5)
+            spent.set()
+            raise QuotaExceeded("monthly budget spent")
+        # This chunk's request went out before the budget ran out, and its response arrives afterwards
+        started.set()
+        spent.wait(5)
+        time.sleep(0.1)
+        dates = pd.date_range(date_from, date_to, freq="D", tz="UTC")
+        return pd.DataFrame({'symbol': symbol, 'date': dates, 'close': 40.0})
+
+    checkpoint_path = str(tmp_path / "backfill.json")
+    rows = backfill(store, [("Gold prices", "GLDM")], "2024-01-01", "2024-01-20", max_workers=2, checkpoint_path=checkpoint_path, fetch=fetch, chunk_days=5)
+
+    assert rows == 5
+    assert store.query("Gold prices", ["GLDM"])['date'].min() == pd.Timestamp("2024-01-06", tz="UTC")
+    assert Checkpoint(checkpoint_path).done == {Checkpoint.key("Gold prices", "GLDM", "2024-01-06", "2024-01-10")}
@@ -0,0 +1,56 @@
+import copy
+
+import pytest
+
+from catalog import Catalog
+
+
+def listing(template, symbol, name, mic):
+    row = copy.deepcopy(template)
+    row.update({'symbol': symbol, 'name': name})
+    row['stock_exchange'].update({'mic': mic})
+    return row
+
+
+@pytest.fixture
+def catalog(stub, tmp_path):
+    # GLDM and SIVR from the recorded tickers, plus a few more gold tickers on two exchanges
+    gldm = stub.data.tickers[0]
+    stub.data.tickers += [
+        listing(gldm, "GLD", "SPDR Gold Shares", "ARCX"),
+        listing(gldm, "IAU", "iShares Gold Trust", "ARCX"),
+        listing(gldm, "GOLD", "Barrick Gold Corp", "XNYS"),
+    ]
+    stub.data.exchanges.append({**stub.data.exchanges[0], 'mic': "XNYS", 'acronym': "NYSE", 'name': "New York Stock Exchange"})
+    catalog = Catalog(str(tmp_path / "catalog.sqlite3"))
+    yield catalog
+    catalog.close()
+
+
+def symbols(rows):
+    return [row['symbol'] for row in rows]
+
+
+def test_synced_catalog_is_searched_offline(stub, catalog):
+    assert catalog.refresh() == {'exchanges': 3, 'tickers': 5}
+    assert catalog.fts
+
+    stub.requests.clear()
+    assert catalog.refresh() == {}
+    # Symbol prefixes first, in symbol order, then every word of the text as a prefix of a word of the name
+    assert symbols(catalog.search_tickers("gl")) == ["GLD", "GLDM"]
+    gold = catalog.search_tickers("gold")
+    assert symbols(gold[:1]) == ["GOLD"] and sorted(symbols(gold[1:])) == ["GLD", "GLDM", "IAU"]
+    assert symbols(catalog.search_tickers("gold mini")) == ["GLDM"]
+    assert symbols(catalog.search_tickers("gold", mic="XNYS")) == ["GOLD"]
+    assert symbols(catalog.search_tickers("gold", limit=2)) == ["GOLD", symbols(gold)[1]]
+    # An exact acronym ranks first among the exchanges matching the text
+    assert [row['mic'] for row in catalog.search_exchanges("nyse")] == ["XNYS", "ARCX"]
+    assert [(row['mic'], row['city']) for row in catalog.listings("GLDM")] == [("ARCX", "New York")]
+    assert not stub.requests
+
+    # A ticker delisted since the last sync leaves the full text index too
+    stub.data.tickers = [row for row in stub.data.tickers if row['symbol'] != "IAU"]
+    assert catalog.refresh(force=True) == {'exchanges': 0, 'tickers': 1}
+    assert "IAU" not in symbols(catalog.search_tickers("gold"))
+    assert catalog.ticker("IAU") is None
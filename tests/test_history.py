@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+from history import HistoryStore
+
+
+def test_record_rate_keeps_the_latest_rate_of_the_day(store):
+    morning = datetime(2024, 5, 10, 8, tzinfo=timezone.utc)
+    evening = datetime(2024, 5, 10, 18, tzinfo=timezone.utc)
+    store.record_rate("USD to INR", "USDINR", 83.1, morning)
+    store.record_rate("USD to INR", "USDINR", 83.4, evening)
+    store.record_rate("USD to INR", "USDINR", 83.6, datetime(2024, 5, 11, tzinfo=timezone.utc))
+
+    rates = store.query("USD to INR", ["USDINR"])
+    assert rates['rate'].tolist() == [83.4, 83.6]
+    assert store.last_date("USD to INR", "USDINR") == pd.Timestamp("2024-05-11", tz="UTC")
+
+
+def test_interrupted_rewrite_is_finished_on_open(store):
+    store.record_rate("USD to INR", "USDINR", 83.1, datetime(2024, 5, 10, tzinfo=timezone.utc))
+    old_parts = store.part_files("USD to INR")
+
+    # A rewrite that got as far as its journal entry before the process died
+    staged = store.staging_path()
+    replacement = pd.DataFrame({'date': pd.to_datetime(["2024-05-10"], utc=True), 'rate': [83.9]})
+    store.write_part(staged, pa.Table.from_pandas(replacement, preserve_index=False))
+    entry = {'written': [[staged, old_parts[0] + ".new.parquet"]], 'removed': old_parts}
+    with open(os.path.join(store.journal_dir, "interrupted.json"), "w") as file:
+        json.dump(entry, file)
+    orphan = store.staging_path()
+    open(orphan, "w").close()
+
+    reopened = HistoryStore(store.root)
+    assert reopened.query("USD to INR", ["USDINR"])['rate'].tolist() == [83.9]
+    assert os.listdir(reopened.journal_dir) == []
+
+
+def flat_store(root):
+    # A store from before partitioning: part files directly in the series directory
+    directory = os.path.join(root, "Gold prices")
+    os.makedirs(directory)
+    dates = pd.date_range("2023-12-30", periods=4, freq="D", tz="UTC")
+    pd.DataFrame({'symbol': 'GLDM', 'date': dates[:2], 'close': [40.0, 41.0]}).to_parquet(os.path.join(directory, "part-1.parquet"))
+    pd.DataFrame({'symbol': 'GLDM', 'date': dates[2:], 'close': [42.0, 43.0]}).to_parquet(os.path.join(directory, "part-2.parquet"))
+    return directory
+
+
+def test_migration_moves_flat_parts_into_partitions(tmp_path):
+    directory = flat_store(str(tmp_path))
+    store = HistoryStore(str(tmp_path))
+    assert store.query("Gold prices", ["GLDM"])['close'].tolist() == [40.0, 41.0, 42.0, 43.0]
+    assert not [name for name in os.listdir(directory) if name.endswith(".parquet")]
+    assert store.last_date("Gold prices", "GLDM") == pd.Timestamp("2024-01-02", tz="UTC")
+
+
+def test_interrupted_migration_does_not_duplicate_rows(tmp_path):
+    directory = flat_store(str(tmp_path))
+    flat_parts = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    saved = {part: open(part, "rb").read() for part in flat_parts}
+    HistoryStore(str(tmp_path))
+
+    # The flat files came back, as if the process died after writing partitions but before deleting them
+    for part, data in saved.items():
+        with open(part, "wb") as file:
+            file.write(data)
+    store = HistoryStore(str(tmp_path))
+    assert store.query("Gold prices", ["GLDM"])['close'].tolist() == [40.0, 41.0, 42.0, 43.0]
+    assert not [name for name in os.listdir(directory) if name.endswith(".parquet")]
+
+
+def test_compaction_keeps_every_row(store):
+    for day in range(1, 4):
+        store.append("Gold prices", pd.DataFrame({'symbol': ['GLDM'], 'date': [datetime(2024, 5, day, tzinfo=timezone.utc)], 'close': [40.0 + day]}))
+    store.compact("Gold prices")
+    assert len(store.part_files("Gold prices")) == 1
+    assert store.query("Gold prices", ["GLDM"])['close'].tolist() == [41.0, 42.0, 43.0]
+    assert os.listdir(store.journal_dir) == []
+
+
+def test_rows_written_before_a_crash_are_not_stored_twice(store, tracker):
+    rows = pd.DataFrame({'symbol': 'GLDM', 'date': pd.date_range("2024-05-01", periods=3, freq="D", tz="UTC"), 'close': [40.0, 41.0, 42.0]})
+    store.append("Gold prices", rows)
+    # The run died after writing its part files but before moving the manifest forward
+    store.manifest["Gold prices"]["GLDM"] = "2024-05-01T00:00:00+00:00"
+    store.save_manifest()
+
+    reopened = HistoryStore(store.root)
+    assert reopened.append("Gold prices", rows) == 0
+    stored = reopened.query("Gold prices", ["GLDM"])
+    assert stored['close'].tolist() == [40.0, 41.0, 42.0]
+    assert len(tracker.load_price_history(reopened, [{'symbol': 'GLDM', 'series': 'Gold prices', 'kind': 'etf'}])) == 3
+
+
+def test_query_drops_duplicate_rows(store):
+    row = pd.DataFrame({'date': pd.to_datetime(["2024-05-01"], utc=True), 'close': [40.0]})
+    partition = store.partition_dir("Gold prices", "GLDM", 2024)
+    os.makedirs(partition)
+    for name in ("part-a.parquet", "part-b.parquet"):
+        store.write_part(os.path.join(partition, name), pa.Table.from_pandas(row, preserve_index=False))
+    assert len(store.query("Gold prices", ["GLDM"])) == 1
+
+
+def test_queries_during_concurrent_upserts_see_whole_partitions(store):
+    store.record_rate("USD to INR", "USDINR", 83.0, datetime(2024, 5, 1, tzinfo=timezone.utc))
+    stop, errors = threading.Event(), []
+
+    def poll():
+        # Like the daemon's FX thread: every poll rewrites the day's row
+        day = 0
+        while not stop.is_set():
+            store.record_rate("USD to INR", "USDINR", 83.0 + day / 100, datetime(2024, 5, 1 + day % 20, tzinfo=timezone.utc))
+            day += 1
+
+    writer = threading.Thread(target=poll)
+    writer.start()
+    try:
+        deadline = time.monotonic() + 1.5
+        while time.monotonic() < deadline:
+            try:
+                rates = store.query("USD to INR", ["USDINR"])
+                assert not rates['date'].duplicated().any()
+            except Exception as e:
+                errors.append(e)
+    finally:
+        stop.set()
+        writer.join()
+    assert not errors
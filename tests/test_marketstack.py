@@ -0,0 +1,26 @@
+import pandas as pd
+
+import marketstack
+
+
+def test_decode_frame_keeps_fields_only_some_rows_have():
+    rows = [
+        {'symbol': 'GLDM', 'date': "2024-05-08T00:00:00+0000", 'close': 46.1},
+        {'symbol': 'GLDM', 'date': "2024-05-09T00:00:00+0000", 'close': 46.3, 'dividend': 0.2, 'split_factor': 1.0},
+        {'symbol': 'GLDM', 'date': "2024-05-10T00:00:00+0000", 'close': 46.5},
+    ]
+    frame = marketstack.decode_frame(rows)
+    assert {'dividend', 'split_factor'} <= set(frame.columns)
+    assert frame['dividend'].iloc[1] == 0.2
+    assert frame['dividend'].isna().sum() == 2
+
+
+def test_latest_bar_is_one_row_with_a_repeated_index():
+    dates = pd.to_datetime(["2024-05-10", "2024-05-08", "2024-05-09"], utc=True)
+    frame = pd.DataFrame({'symbol': ['GLDM', 'SIVR', 'GLDM'], 'date': dates, 'close': [46.5, 29.0, 46.3]}, index=[0, 0, 0])
+    bar = marketstack.latest_bar(frame)
+    assert isinstance(bar, pd.Series)
+    assert bar['close'] == 46.5
+    bars = marketstack.latest_bars(frame)
+    assert list(bars['symbol']) == ['GLDM', 'SIVR']
+    assert list(bars['close']) == [46.5, 29.0]
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from marketstack_async import AsyncClient, AsyncEndOfDay, get_default_client
+
+
+def test_default_client_survives_a_second_event_loop(stub):
+    async def latest():
+        return await AsyncEndOfDay("GLDM").latest().get_data(paginate=False)
+
+    first = asyncio.run(latest())
+    second = asyncio.run(latest())
+    assert first == second and first[0]['symbol'] == "GLDM"
+    asyncio.run(get_default_client().close())
+
+
+def test_closed_client_can_be_reused(stub):
+    client = AsyncClient()
+
+    async def latest():
+        rows = await AsyncEndOfDay("SIVR").with_client(client).latest().get_data(paginate=False)
+        await client.close()
+        return rows
+
+    assert asyncio.run(latest()) == asyncio.run(latest())
+
+
+def test_sync_request_functions_raise():
+    query = AsyncEndOfDay("GLDM")
+    with pytest.raises(TypeError):
+        query.request()
+    with pytest.raises(TypeError):
+        next(query.iter_offset_pages())
+
+
+def test_session_is_closed_when_its_event_loop_finishes(stub):
+    client = AsyncClient()
+    sessions = []
+
+    async def latest():
+        rows = await AsyncEndOfDay("GLDM").with_client(client).latest().get_data(paginate=False)
+        sessions.append(client.session)
+        return rows
+
+    asyncio.run(latest())
+    assert sessions[0].closed
+    asyncio.run(latest())
+    assert sessions[1] is not sessions[0] and sessions[1].closed
+
+
+def test_stopping_early_cancels_the_pages_in_flight(stub):
+    client = AsyncClient()
+    # Slow enough that the other pages are still in flight when the consumer stops
+    stub.latency = 0.1
+
+    async def two_pages():
+        pages = AsyncEndOfDay("GLDM", limit=10).with_client(client).iter_pages()
+        received = []
+        async for page in pages:
+            received.append(page)
+            if len(received) == 2:
+                break
+        await pages.aclose()
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task() and task is not client.closer]
+        await client.close()
+        return received, pending
+
+    received, pending = asyncio.run(two_pages())
+    assert [len(page) for page in received] == [10, 10]
+    assert pending == []
@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from metalpriceapi import derive_pairs, latest_rates
+
+
+def test_latest_rates_derives_every_pair_from_one_request(stub):
+    rates = latest_rates(["USDINR", "INRUSD", "XAUUSD", "XAUINR", "USDZZZ"], "test")
+
+    assert [path for path, _ in stub.requests] == ["/v1/latest"]
+    assert stub.requests[0][1]['currencies'] == "INR,XAU,ZZZ"
+    assert rates["USDINR"] == 83.52
+    # The inverted pair and the cross are derived from the same rates against USD
+    assert rates["INRUSD"] == pytest.approx(1 / 83.52)
+    assert rates["XAUUSD"] == pytest.approx(1 / 0.000424)
+    assert rates["XAUINR"] == pytest.approx(83.52 / 0.000424)
+    assert rates.rates["XAUUSD"].is_metal and not rates.rates["USDINR"].is_metal
+    # The response has no ZZZ rate, so that pair is left out rather than failing the others
+    assert "USDZZZ" not in rates and rates.get("USDZZZ") is None
+    assert len(rates) == 4
+
+
+def test_pairs_without_a_rate_are_left_out():
+    date = datetime(2024, 5, 10, tzinfo=timezone.utc)
+    pairs = derive_pairs("USD", {'INR': 83.52, 'EUR': 0.0, 'USDXAU': 2358.49}, ["INRUSD", "EURINR", "XAUUSD", "INREUR"], date)
+    assert list(pairs) == ["INRUSD"]
+    assert (pairs["INRUSD"].base, pairs["INRUSD"].quote, pairs["INRUSD"].date) == ("INR", "USD", date)
+
+
+def test_symbols_that_are_not_pairs_are_rejected(stub):
+    with pytest.raises(ValueError):
+        latest_rates(["USDINR", "GOLD"], "test")
+    assert not stub.requests
@@ -0,0 +1,39 @@
+from notify import Dispatcher, MemorySink
+
+
+def test_alerts_in_one_window_become_one_digest():
+    sink = MemorySink()
+    dispatcher = Dispatcher([sink], coalesce_seconds=0.2)
+    dispatcher.notify("GLDM above", "GLDM", "GLDM above 46", {'id': 'GLDM above'})
+    dispatcher.notify("SIVR below", "SIVR", "SIVR below 28", {'id': 'SIVR below'})
+    dispatcher.close()
+
+    assert len(sink.sent) == 1
+    assert sink.sent[0]['title'] == "🚨 2 alerts"
+    assert sink.sent[0]['message'] == "GLDM above 46\nSIVR below 28"
+    assert [alert['id'] for alert in sink.sent[0]['alerts']] == ['GLDM above', 'SIVR below']
+
+
+def test_repeats_within_the_interval_are_dropped():
+    sink = MemorySink()
+    dispatcher = Dispatcher([sink], coalesce_seconds=0, repeat_interval=60)
+    dispatcher.notify("GLDM above", "GLDM", "GLDM above 46")
+    dispatcher.flush()
+    dispatcher.notify("GLDM above", "GLDM", "GLDM above 46")
+    dispatcher.notify("SIVR below", "SIVR", "SIVR below 28")
+    dispatcher.close()
+
+    assert [sent['message'] for sent in sink.sent] == ["GLDM above 46", "SIVR below 28"]
+
+
+def test_a_failing_sink_does_not_stop_the_others():
+    class BrokenSink:
+        def send(self, title, message, alerts):
+            raise ConnectionError("webhook down")
+
+    sink = MemorySink()
+    dispatcher = Dispatcher([BrokenSink(), sink], coalesce_seconds=0)
+    dispatcher.notify("GLDM above", "GLDM", "GLDM above 46")
+    dispatcher.close()
+
+    assert [sent['message'] for sent in sink.sent] == ["GLDM above 46"]
@@ -0,0 +1,70 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+import marketstack
+from http_client import Transport
+from marketstack_async import AsyncClient, AsyncEndOfDay
+from quota import QuotaExceeded, RequestBudget, set_default_budget
+
+LIMITS = {'marketstack': {'monthly': 1000, 'per_second': 1000}}
+
+
+def spend(path, requests):
+    budget = RequestBudget(path, limits=LIMITS)
+    for _ in range(requests):
+        budget.acquire('marketstack', "key")
+
+
+def test_processes_sharing_the_file_keep_each_others_counts(tmp_path):
+    path = str(tmp_path / "quota.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=spend, args=(path, 25)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert RequestBudget(path, limits=LIMITS).used('marketstack', "key") == 100
+
+
+def test_budget_spent_by_another_process_is_refused(tmp_path):
+    path = str(tmp_path / "quota.json")
+    limits = {'marketstack': {'monthly': 3, 'per_second': 1000, 'reserve': 0}}
+    first, second = RequestBudget(path, limits=limits), RequestBudget(path, limits=limits)
+    for _ in range(3):
+        first.acquire('marketstack', "key")
+    with pytest.raises(QuotaExceeded):
+        second.acquire('marketstack', "key")
+
+
+def test_retried_attempts_count(stub, tmp_path):
+    budget = RequestBudget(str(tmp_path / "quota.json"), limits=LIMITS)
+    set_default_budget(budget)
+    stub.fail_next(2, 503)
+    query = marketstack.EndOfDay("GLDM").latest().with_transport(Transport(backoff_base=0.001))
+    try:
+        assert query.get_data(paginate=False)[0]['symbol'] == "GLDM"
+    finally:
+        set_default_budget(None)
+    assert budget.used('marketstack', "test") == 3
+
+
+def test_async_requests_count_every_attempt(stub, tmp_path):
+    budget = RequestBudget(str(tmp_path / "quota.json"), limits=LIMITS)
+    set_default_budget(budget)
+    stub.fail_next(1, 503)
+    client = AsyncClient(backoff_base=0)
+
+    async def pages():
+        # 260 bars in pages of 100: the first request, then two pages fetched concurrently
+        async with client:
+            return await AsyncEndOfDay("GLDM", limit=100).with_client(client).get_data()
+
+    try:
+        rows = asyncio.run(pages())
+    finally:
+        set_default_budget(None)
+    assert len(rows) == 260
+    assert budget.used('marketstack', "test") == len(stub.requests) == 3 + 1
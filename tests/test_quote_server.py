@@ -0,0 +1,100 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+import pytest
+
+from quote_server import QuoteClient, QuoteService, SingleFlight, make_server
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to about 100 characters, which pytest's tmp_path can exceed
+    directory = tempfile.mkdtemp()
+    yield os.path.join(directory, "quotes.sock")
+    shutil.rmtree(directory)
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def test_a_regular_file_at_the_address_is_not_removed(socket_path):
+    with open(socket_path, "w") as file:
+        file.write("not a socket")
+    with pytest.raises(FileExistsError):
+        make_server(QuoteService(), socket_path)
+    assert open(socket_path).read() == "not a socket"
+
+
+def test_a_running_server_keeps_its_socket(socket_path):
+    server = serve(make_server(QuoteService(), socket_path))
+    try:
+        with pytest.raises(OSError):
+            make_server(QuoteService(), socket_path)
+        assert QuoteClient(socket_path).health()['status'] == "ok"
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not os.path.exists(socket_path)
+
+
+def test_the_socket_of_a_server_that_is_gone_is_replaced(socket_path):
+    left_behind = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    left_behind.bind(socket_path)
+    left_behind.close()
+
+    server = serve(make_server(QuoteService(), socket_path))
+    try:
+        assert QuoteClient(socket_path).health()['status'] == "ok"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stale_quotes_are_not_returned_as_prices(socket_path):
+    rates = iter([{'USDINR': 83.1}])
+    service = QuoteService(['USDINR'], lambda symbols: next(rates), max_age=0)
+    server = serve(make_server(service, socket_path))
+    try:
+        client = QuoteClient(socket_path)
+        assert client.prices(['USDINR']) == {'USDINR': 83.1}
+        # Upstream now fails, so the server only has the last known quote
+        quotes, _ = client.quotes(['USDINR'])
+        assert quotes['USDINR']['stale']
+        assert client.prices(['USDINR']) == {}
+        assert client.prices(['USDINR'], stale=True) == {'USDINR': 83.1}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_concurrent_calls_for_the_same_keys_share_one_fetch():
+    flight, started, release = SingleFlight(), threading.Semaphore(0), threading.Event()
+    calls = []
+
+    def fetch(keys):
+        calls.append(keys)
+        started.release()
+        release.wait(5)
+        return {key: key.lower() for key in keys}
+
+    results = {}
+    first = threading.Thread(target=lambda: results.update(first={key: future.result() for key, future in flight.futures(['GLDM', 'SIVR'], fetch).items()}))
+    first.start()
+    started.acquire(timeout=5)
+    # GLDM is in flight, so the second call only fetches USDINR and waits for GLDM
+    second = threading.Thread(target=lambda: results.update(second={key: future.result() for key, future in flight.futures(['GLDM', 'USDINR'], fetch).items()}))
+    second.start()
+    started.acquire(timeout=5)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert calls == [['GLDM', 'SIVR'], ['USDINR']]
+    assert results['second'] == {'GLDM': 'gldm', 'USDINR': 'usdinr'}
+    assert flight.in_flight == {}
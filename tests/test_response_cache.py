@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import marketstack
+from http_client import Transport
+from quota import RequestBudget, set_default_budget
+from response_cache import ResponseCache, build_response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def query(cache, *args, **kwargs):
+    # No transport retries, so an injected error reaches the cache
+    return marketstack.EndOfDay(*args, **kwargs).with_cache(cache).with_transport(Transport(max_retries=0))
+
+
+def expire(cache):
+    cache.connection.execute("UPDATE responses SET expires_at = 0")
+    cache.connection.commit()
+
+
+def test_past_bars_are_kept_forever_and_latest_for_seconds(cache):
+    today = datetime.now(timezone.utc).date()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    assert cache.ttl_for("https://api.marketstack.com/v1/eod", {'date_to': yesterday}) is None
+    assert cache.ttl_for(f"https://api.marketstack.com/v1/eod/{yesterday}") is None
+    assert cache.ttl_for("https://api.marketstack.com/v1/eod", {'date_to': today.isoformat()}) == 300
+    assert cache.ttl_for("https://api.marketstack.com/v1/eod/latest") == 30
+
+
+def test_repeated_requests_are_answered_from_the_cache(stub, cache):
+    first = query(cache, "GLDM", date_from="2024-01-01", date_to="2024-01-31").get_data(paginate=False)
+    second = query(cache, "GLDM", date_from="2024-01-01", date_to="2024-01-31").get_data(paginate=False)
+    assert first == second
+    assert len(stub.requests) == 1
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_expired_entries_are_served_when_the_api_fails(stub, cache, status):
+    fresh = query(cache, "GLDM").latest().get_data(paginate=False)
+    expire(cache)
+    stub.fail_next(1, status)
+    assert query(cache, "GLDM").latest().get_data(paginate=False) == fresh
+    assert len(stub.requests) == 2
+
+
+def test_expired_entries_are_served_when_the_budget_is_spent(stub, cache, tmp_path):
+    set_default_budget(RequestBudget(str(tmp_path / "quota.json"), limits={'marketstack': {'monthly': 1, 'per_second': 1000, 'reserve': 0}}))
+    try:
+        fresh = query(cache, "GLDM").latest().get_data(paginate=False)
+        expire(cache)
+        assert query(cache, "GLDM").latest().get_data(paginate=False) == fresh
+    finally:
+        set_default_budget(None)
+    assert len(stub.requests) == 1
+
+
+def test_least_recently_used_entries_are_evicted_first(cache):
+    cache.max_bytes = 250
+    for key in ("a", "b"):
+        cache.set(key, "https://api.marketstack.com/v1/eod", build_response("", 200, {}, b"x" * 100), None)
+    cache.get("a")
+    cache.set("c", "https://api.marketstack.com/v1/eod", build_response("", 200, {}, b"x" * 100), None)
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.get("b") is None
@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from streaming import SymbolStream
+
+CAPACITY = 30
+MA_WINDOWS = (1, 7, 30)
+
+
+def random_bars(seed):
+    # A random walk over three buffer lengths, with repeated dates, missing prices and zero volume bars mixed in
+    rng = np.random.default_rng(seed)
+    steps = rng.choice([0, 60, 60, 120], size=100)
+    dates = np.cumsum(steps) * 10**9
+    prices = 40.0 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+    prices[rng.random(len(dates)) < 0.05] = np.nan
+    volumes = rng.integers(0, 1000, len(dates)).astype('float64')
+    volumes[rng.random(len(dates)) < 0.2] = 0.0
+    return list(zip(dates.tolist(), prices.tolist(), volumes.tolist()))
+
+
+def brute_force(bars):
+    # The same statistics computed from scratch with pandas rolling windows over every accepted bar
+    frame = pd.DataFrame(bars, columns=['date', 'price', 'volume'])
+    rolling = frame.rolling(CAPACITY, min_periods=1)
+    pv = (frame['price'] * frame['volume']).rolling(CAPACITY, min_periods=1).sum()
+    # The oldest bar's return starts outside the buffer, so the window of returns is one bar shorter
+    returns = np.log(frame['price']).diff()
+    last = frame.iloc[-1]
+    expected = {
+        'price': last['price'],
+        'bars': min(len(frame), CAPACITY),
+        'vwap': pv.iloc[-1] / rolling['volume'].sum().iloc[-1] if rolling['volume'].sum().iloc[-1] > 0 else math.nan,
+        'low': rolling['price'].min().iloc[-1],
+        'high': rolling['price'].max().iloc[-1],
+        'volatility': returns.rolling(CAPACITY - 1, min_periods=2).std().iloc[-1],
+    }
+    for window in MA_WINDOWS:
+        expected[f'ma_{window}'] = frame['price'].rolling(window).mean().iloc[-1]
+    return expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rolling_stats_match_pandas_bar_by_bar(seed):
+    stream = SymbolStream('GLDM', capacity=CAPACITY, ma_windows=MA_WINDOWS)
+    accepted = []
+    for date, price, volume in random_bars(seed):
+        added = stream.push(date, price, volume)
+        assert added == ((not accepted or date > accepted[-1][0]) and not math.isnan(price))
+        if not added:
+            continue
+        accepted.append((date, price, volume))
+
+        stats = stream.stats()
+        for name, value in brute_force(accepted).items():
+            assert stats[name] == pytest.approx(value, rel=1e-9, abs=1e-12, nan_ok=True), (len(accepted), name)
+
+    # Enough bars were accepted to wrap the buffer (and resync it) more than once
+    assert len(accepted) > 2 * CAPACITY
+    assert stream.series().tolist() == [price for _, price, _ in accepted[-CAPACITY:]]
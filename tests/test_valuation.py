@@ -0,0 +1,87 @@
+import pandas as pd
+
+import metalpriceapi
+from alerts import AlertEngine
+from backfill import RETRY_BACKOFF, Checkpoint
+from valuation import FX_SERIES, FX_SYMBOL, inr_series, update_inr_series
+
+
+def bars(days):
+    dates = pd.date_range("2024-05-01", periods=days, freq="D", tz="UTC")
+    return pd.DataFrame({'symbol': 'GLDM', 'date': dates, 'close': 40.0 + pd.RangeIndex(days)})
+
+
+def rates(start, days, rate=83.0):
+    return pd.DataFrame({'symbol': FX_SYMBOL, 'date': pd.date_range(start, periods=days, freq="D", tz="UTC"), 'rate': rate})
+
+
+def test_bars_without_a_rate_are_converted_once_older_rates_arrive(store):
+    store.append("Gold prices", bars(10))
+    # The tracker's first rate is recorded after the first bars
+    store.append(FX_SERIES, rates("2024-05-06", 1))
+    assert update_inr_series(store, "Gold prices", "GLDM") == 5
+
+    store.append("Gold prices", bars(12))
+    store.backfill(FX_SERIES, rates("2024-04-20", 16, rate=82.0))
+    assert update_inr_series(store, "Gold prices", "GLDM") == 7
+
+    converted = store.query(inr_series("Gold prices"), ["GLDM"])
+    assert converted['date'].tolist() == bars(12)['date'].tolist()
+    assert converted['close_inr'].iloc[0] == 40.0 * 82.0
+    assert converted['close_inr'].iloc[-1] == 51.0 * 83.0
+    assert update_inr_series(store, "Gold prices", "GLDM") == 0
+
+
+def test_historical_rates_are_daily_rows_per_pair(stub):
+    history = metalpriceapi.historical_rates(["USDINR", "XAUUSD"], "test", "2024-05-01", "2024-05-03")
+    assert history['symbol'].tolist() == ["USDINR", "XAUUSD"] * 3
+    assert history['date'].dt.day.tolist() == [1, 1, 2, 2, 3, 3]
+    assert history['rate'].between(70, 100).sum() == 3
+
+
+def test_full_run_values_the_whole_etf_history_in_inr(stub, store, tracker, tmp_path):
+    instruments = [{'symbol': 'GLDM', 'series': 'Gold prices', 'kind': 'etf'}, {'symbol': 'USDINR', 'series': FX_SERIES, 'kind': 'fx'}]
+    engine = AlertEngine([{'symbol': 'GLDM_INR', 'type': 'above', 'threshold': 1e9}], state_path=None)
+    checkpoint = str(tmp_path / "backfill.json")
+    tracker.check_instruments(store, engine, instruments, "test", inr=True, checkpoint_path=checkpoint)
+
+    etf = store.query("Gold prices", ["GLDM"])
+    converted = store.query(inr_series("Gold prices"), ["GLDM"])
+    assert len(etf) and converted['date'].tolist() == etf['date'].tolist()
+
+    # The seeded range is checkpointed, so the next run fetches no more rates
+    stub.requests.clear()
+    tracker.check_instruments(store, engine, instruments, "test", inr=True, checkpoint_path=checkpoint)
+    assert not [path for path, _ in stub.requests if path.endswith("timeframe")]
+
+
+def test_failed_rate_seed_backs_off(stub, store, tracker, tmp_path):
+    instruments = [{'symbol': 'GLDM', 'series': 'Gold prices', 'kind': 'etf'}]
+    store.append("Gold prices", bars(10))
+    store.append(FX_SERIES, rates("2024-05-06", 1))
+    checkpoint = str(tmp_path / "backfill.json")
+
+    def timeframe_requests():
+        return len([path for path, _ in stub.requests if path.endswith("timeframe")])
+
+    stub.fail_next(1, 400)
+    tracker.seed_inr_rates(store, instruments, "test", checkpoint)
+    assert timeframe_requests() == 1
+    # The next polls leave the failed chunk alone until the backoff has passed
+    tracker.seed_inr_rates(store, instruments, "test", checkpoint)
+    assert timeframe_requests() == 1
+
+    failed = Checkpoint(checkpoint)
+    (key, (failures, failed_at)), = failed.failed.items()
+    assert failures == 1
+    failed.mark_failed(key, failed_at - RETRY_BACKOFF)
+    # A second failure doubles the backoff, so this one has not passed yet
+    tracker.seed_inr_rates(store, instruments, "test", checkpoint)
+    assert timeframe_requests() == 1
+
+    failed.failed[key] = [1, failed_at - RETRY_BACKOFF]
+    failed.save()
+    tracker.seed_inr_rates(store, instruments, "test", checkpoint)
+    assert timeframe_requests() == 2
+    assert store.first_date(FX_SERIES, FX_SYMBOL) == bars(1)['date'].iloc[0]
+    assert Checkpoint(checkpoint).failed == {}
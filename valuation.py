@@ -0,0 +1,82 @@
+'''
+ETF prices in INR.
+
+marketstack quotes the ETFs in USD. value_in_inr() joins every bar with the USD/INR rate in effect at its date (the
+latest rate at or before it) in one pd.merge_asof, so years of history are converted in milliseconds.
+update_inr_series() keeps a derived "<series> (INR)" series in the history store up to date, converting only the bars
+that have no INR value yet. The tracker exposes it as <SYMBOL>_INR, so alert rules can use INR thresholds:
+
+    - symbol: GLDM_INR
+      type: above
+      threshold: 6000
+'''
+
+from typing import TYPE_CHECKING
+
+# pandas and the history store are only needed once something is converted, so quick checks can use INR_SUFFIX cheaply
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from history import HistoryStore
+
+INR_SUFFIX = "_INR"
+FX_SERIES = "USD to INR"
+FX_SYMBOL = "USDINR"
+
+
+def inr_series(series: str) -> str:
+    return f"{series} (INR)"
+
+
+def value_in_inr(prices: 'pd.DataFrame', rates: 'pd.DataFrame', price_column: str = 'close') -> 'pd.DataFrame':
+    '''
+    prices has symbol, date and price_column (USD); rates has date and rate. Returns symbol, date, price_column, rate and
+    close_inr, sorted by symbol and date. Bars older than the first known rate get NaN.
+    '''
+    import pandas as pd
+
+    if prices.empty:
+        return pd.DataFrame(columns=['symbol', 'date', price_column, 'rate', 'close_inr'])
+    valued = pd.merge_asof(
+        prices[['symbol', 'date', price_column]].sort_values('date'),
+        rates[['date', 'rate']].dropna().sort_values('date'),
+        on='date',
+        direction='backward',
+    )
+    valued['close_inr'] = valued[price_column] * valued['rate']
+    return valued.sort_values(['symbol', 'date']).reset_index(drop=True)
+
+
+def update_inr_series(store: 'HistoryStore', series: str, symbol: str, fx_series: str = FX_SERIES, fx_symbol: str = FX_SYMBOL) -> int:
+    '''
+    Converts the bars of `symbol` that have no INR value yet: the ones stored after the last converted bar, and the ones
+    before the first converted bar that older rates (e.g. from a USD/INR backfill) now cover. Bars older than the first
+    stored rate are left for a later run, so they never keep the bars after them from being converted.
+    '''
+    target = inr_series(series)
+    first_rate = store.first_date(fx_series, fx_symbol)
+    if first_rate is None:
+        return 0
+    first, last = store.first_date(target, symbol), store.last_date(target, symbol)
+
+    written = 0
+    if first is not None and first_rate < first:
+        older = store.query(series, [symbol], start=first_rate, end=first, columns=['close'])
+        if 'close' in older:
+            written += store.backfill(target, convert(store, older[older['date'] < first], fx_series, fx_symbol))
+    newer = store.query(series, [symbol], start=max(first_rate, last) if last is not None else first_rate, columns=['close'])
+    if last is not None and 'date' in newer:
+        newer = newer[newer['date'] > last]
+    if 'close' in newer:
+        written += store.append(target, convert(store, newer, fx_series, fx_symbol))
+    return written
+
+
+def convert(store: 'HistoryStore', prices: 'pd.DataFrame', fx_series: str, fx_symbol: str) -> 'pd.DataFrame':
+    # INR values of the bars in prices that have a stored rate on or before their date
+    if prices.empty:
+        return prices
+    rates = store.query(fx_series, [fx_symbol], end=prices['date'].max(), columns=['rate'])
+    if rates.empty or 'rate' not in rates:
+        return prices.iloc[:0]
+    return value_in_inr(prices, rates).dropna(subset=['close_inr'])